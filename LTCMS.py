@@ -1,16 +1,42 @@
 import streamlit as st
-import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta, date
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from itertools import islice
+from html import escape
+from string import Template
+from typing import Optional
+from collections import Counter
+from email.utils import parsedate_to_datetime
 import calendar
 import uuid
 import os
 import json
 import copy
+import logging
 import base64
+import atexit
+import gzip
+import hashlib
+import heapq
+import io
+import math
+import queue
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 import requests
 
+from auto_scheduler import Machine, Request, plan_batch
+
+logger = logging.getLogger("ltcms")
+
 # -------------- Page configuration -------------------
 st.set_page_config(
     page_title="LTCMS - Lipa Technical Center", 
@@ -22,9 +48,44 @@ st.set_page_config(
 REPO = "LukeyMe/LTCMS"
 FILE_PATH = "ltcms_state.json"
 BRANCH = "main"
-TOKEN = st.secrets["GITHUB_TOKEN"]
+try:
+    TOKEN = st.secrets.get("GITHUB_TOKEN")
+except FileNotFoundError:
+    TOKEN = None
+# Contents API endpoint; point it at contents_api_server.py to run offline
+GITHUB_API_URL = os.environ.get("LTCMS_GITHUB_API_URL", "https://api.github.com")
+# (connect, read) timeouts and retry policy for every GitHub call
+GITHUB_TIMEOUT = (5, 20)
+GITHUB_MAX_RETRIES = 3
+GITHUB_BACKOFF_SECONDS = 0.5
+GITHUB_BACKOFF_CAP_SECONDS = 10
+# Mirror every local save to the state file on GitHub (needs a token)
+GITHUB_MIRROR = bool(TOKEN)
+# Saves arriving within this window are coalesced into one GitHub commit
+MIRROR_DEBOUNCE_SECONDS = 10
+MIRROR_MAX_DELAY_SECONDS = 60
+MIRROR_RETRY_SECONDS = 30
+# How often a new session may revalidate the GitHub mirror for outside changes
+STATE_REVALIDATE_SECONDS = 30
+# Backup snapshots kept per period; uploads go to BACKUP_DIR on GitHub
+BACKUP_DIR = "backups"
+BACKUP_FILE_PATTERN = "ltcms_state_%Y%m%d.json.gz"
+BACKUP_KEEP_DAILY = 7
+BACKUP_KEEP_WEEKLY = 8
+BACKUP_KEEP_MONTHLY = 12
+# Conflicting mirror pushes are merged and retried with capped backoff
+MIRROR_MAX_ATTEMPTS = 5
+MIRROR_BACKOFF_SECONDS = 0.5
+MIRROR_BACKOFF_CAP_SECONDS = 8
+# Finished tests leave the live state for an append-only archive, one
+# JSON-lines partition per month under ARCHIVE_DIR on GitHub
+ARCHIVED_STATUSES = ('Completed', 'Cancelled')
+ARCHIVE_DIR = "archive"
+ARCHIVE_MONTH_FORMAT = "%Y-%m"
 
 DATA_FILE = "ltcms_state.json"
+# Local SQLite database that is the primary store for equipment and schedules
+DB_PATH = os.environ.get("LTCMS_DB_PATH", "ltcms_state.db")
 
 # -------------- CSS Styling ---------------
 st.markdown("""
@@ -79,6 +140,12 @@ st.markdown("""
         border-radius: 3px;
         font-size: 10px;
     }
+    .load-gauge { position: absolute; top: 34px; right: 10px; }
+    .overbooked {
+        color: #721c24; background: #f8d7da;
+        border-radius: 4px; padding: 2px 6px; margin: 4px 0;
+        font-size: 12px; font-weight: bold; display: inline-block;
+    }
     .progress-bar {
         background: #e0e0e0;
         border-radius: 8px;
@@ -101,6 +168,19 @@ st.markdown("""
     .status-idle { background: #fff3cd; color: #856404; }
     .status-maintenance { background: #f8d7da; color: #721c24; }
     .status-scheduled { background: #d1ecf1; color: #0c5460; }
+    .month-calendar { width: 100%; border-collapse: separate; border-spacing: 3px; table-layout: fixed; }
+    .month-calendar th { text-align: center; font-size: 13px; padding: 4px 0; }
+    .month-calendar td {
+        border: 1px solid #ddd; border-radius: 4px; text-align: center;
+        height: 52px; vertical-align: middle; cursor: default;
+    }
+    .month-calendar .cal-day { font-weight: 600; font-size: 14px; }
+    .month-calendar .cal-load { font-size: 11px; opacity: 0.8; }
+    .month-calendar .cal-empty { border: none; }
+    .month-calendar .cal-available { background: #d4edda; color: #155724; }
+    .month-calendar .cal-partial { background: #fff3cd; color: #856404; }
+    .month-calendar .cal-blocked { background: #f8d7da; color: #721c24; }
+    .month-calendar .cal-today { border: 2px solid #0c5460; }
     /* Universal modal override for full width/height */
 div[data-testid="stModal"],
 div[data-testid="stModal"] > div[role="dialog"],
@@ -153,133 +233,2636 @@ input[type="text"], input[type="number"], textarea {
 </style>
 """, unsafe_allow_html=True)
 
-# -------------- Persistent Storage Utilities -----------------
-def load_app_state():
-    url = f"https://api.github.com/repos/{REPO}/contents/{FILE_PATH}?ref={BRANCH}"
-    headers = {"Authorization": f"token {TOKEN}"}
-    r = requests.get(url, headers=headers)
-
-    if r.status_code == 200:
-        content = r.json().get("content", "")
-        decoded = base64.b64decode(content).decode("utf-8")
-        state = json.loads(decoded)
-
-        # Convert string dates back to date objects
-        for eq_id, schedules in state.get("schedules", {}).items():
-            for s in schedules:
-                for field in ("start_date", "end_date"):
-                    if isinstance(s.get(field), str):
-                        try:
-                            s[field] = datetime.strptime(s[field], "%Y-%m-%d").date()
-                        except ValueError:
-                            pass
-                if isinstance(s.get("created_at"), str):
-                    try:
-                        s["created_at"] = datetime.strptime(s["created_at"], "%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        pass
-
-        return state
+# -------------- Record Model -----------------
+# Equipment and schedules are slotted records with real date fields. Values are
+# validated once, when a record is decoded from a state document or built from
+# form input; the JSON document layout of ltcms_state.json is unchanged.
+DATE_FORMAT = "%Y-%m-%d"
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def to_date(value):
+    """Accept a date (or datetime) or a 'YYYY-MM-DD' string; raises ValueError otherwise."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"Not a date: {value!r}")
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+def to_datetime(value):
+    """Parse a stored timestamp; returns None when it is missing or unreadable."""
+    if value is None or isinstance(value, datetime):
+        return value
+    for fmt in (DATETIME_FORMAT, "%Y-%m-%d %H:%M:%S.%f"):
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+@dataclass(slots=True)
+class Equipment:
+    name: str
+    type: str
+    location: str = ''
+    status: str = 'Idle'
+    load_percentage: int = 0
+    last_updated: Optional[datetime] = None
+    parameters: dict = field(default_factory=dict)
+    channels: Optional[int] = None
+    plates: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            name=str(d.get('name', '')),
+            type=d['type'],
+            location=d.get('location') or '',
+            status=d.get('status', 'Idle'),
+            load_percentage=int(d.get('load_percentage') or 0),
+            last_updated=to_datetime(d.get('last_updated')),
+            parameters=dict(d.get('parameters') or {}),
+            channels=int(d['channels']) if d.get('channels') is not None else None,
+            plates=int(d['plates']) if d.get('plates') is not None else None,
+        )
+
+    def to_dict(self):
+        d = {
+            'name': self.name,
+            'type': self.type,
+            'location': self.location,
+            'status': self.status,
+            'load_percentage': self.load_percentage,
+            'last_updated': str(self.last_updated) if self.last_updated else None,
+        }
+        if self.parameters:
+            d['parameters'] = self.parameters
+        if self.channels is not None:
+            d['channels'] = self.channels
+        if self.plates is not None:
+            d['plates'] = self.plates
+        return d
+
+# Recurring schedules are stored once, as their first occurrence plus a rule;
+# the other occurrences are generated on demand by occurrences()
+RECURRENCE_UNITS = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}
+MAX_OCCURRENCES = 366
+
+@dataclass(slots=True)
+class Recurrence:
+    """Repeat rule of a recurring schedule.
+
+    Occurrences start every `every` days/weeks/months from the schedule's
+    own dates, until `count` occurrences or the last start on or before
+    `until`. `exceptions` maps an occurrence's regular start ('YYYY-MM-DD')
+    to the fields that differ for it alone, e.g. {'status': 'Cancelled'}
+    or new start/end dates.
+    """
+    unit: str
+    every: int = 1
+    count: Optional[int] = None
+    until: Optional[date] = None
+    exceptions: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get('unit') not in RECURRENCE_UNITS:
+            raise ValueError(f"Unknown recurrence unit: {d.get('unit')!r}")
+        if not d.get('count') and not d.get('until'):
+            raise ValueError("A recurrence needs a count or an until date")
+        return cls(
+            unit=d['unit'],
+            every=max(int(d.get('every') or 1), 1),
+            count=int(d['count']) if d.get('count') else None,
+            until=to_date(d['until']) if d.get('until') else None,
+            exceptions=dict(d.get('exceptions') or {}),
+        )
+
+    def to_dict(self):
+        d = {'unit': self.unit, 'every': self.every}
+        if self.count:
+            d['count'] = self.count
+        if self.until:
+            d['until'] = self.until.strftime(DATE_FORMAT)
+        if self.exceptions:
+            d['exceptions'] = self.exceptions
+        return d
+
+    def describe(self):
+        step = RECURRENCE_UNITS[self.unit] if self.every == 1 else f"Every {self.every} {self.unit}s"
+        ends = f"{self.count} times" if self.count else f"until {self.until:%Y-%m-%d}"
+        if self.count and self.until:
+            ends += f", until {self.until:%Y-%m-%d}"
+        return f"{step}, {ends}"
+
+@dataclass(slots=True)
+class Schedule:
+    schedule_id: str
+    test_id: str
+    user: str
+    start_date: date
+    end_date: date
+    load_percentage: int
+    priority: str = 'Medium'
+    description: str = ''
+    test_parameters: dict = field(default_factory=dict)
+    status: str = 'Scheduled'
+    created_at: Optional[datetime] = None
+    channels: Optional[list] = None
+    plates: Optional[list] = None
+    recurrence: Optional[Recurrence] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            # Older state files may predate schedule ids; every record needs one
+            schedule_id=d.get('schedule_id') or str(uuid.uuid4()),
+            test_id=str(d.get('test_id', '')),
+            user=str(d.get('user', '')),
+            start_date=to_date(d['start_date']),
+            end_date=to_date(d['end_date']),
+            load_percentage=int(d.get('load_percentage') or 0),
+            priority=d.get('priority', 'Medium'),
+            description=d.get('description') or '',
+            test_parameters=dict(d.get('test_parameters') or {}),
+            status=d.get('status', 'Scheduled'),
+            created_at=to_datetime(d.get('created_at')),
+            channels=list(d['channels']) if d.get('channels') else None,
+            plates=list(d['plates']) if d.get('plates') else None,
+            recurrence=Recurrence.from_dict(d['recurrence']) if d.get('recurrence') else None,
+        )
+
+    def to_dict(self):
+        d = {
+            'schedule_id': self.schedule_id,
+            'test_id': self.test_id,
+            'user': self.user,
+            'start_date': self.start_date.strftime(DATE_FORMAT),
+            'end_date': self.end_date.strftime(DATE_FORMAT),
+            'load_percentage': self.load_percentage,
+            'priority': self.priority,
+            'description': self.description,
+            'test_parameters': self.test_parameters,
+            'status': self.status,
+            'created_at': self.created_at.strftime(DATETIME_FORMAT) if self.created_at else None,
+        }
+        if self.channels:
+            d['channels'] = self.channels
+        if self.plates:
+            d['plates'] = self.plates
+        if self.recurrence:
+            d['recurrence'] = self.recurrence.to_dict()
+        return d
+
+@dataclass(slots=True)
+class WaitlistEntry:
+    """A test waiting for room on any equipment of a type."""
+    entry_id: str
+    eq_type: str
+    test_id: str
+    user: str
+    duration: int  # days
+    load_percentage: int
+    priority: str = 'Medium'
+    earliest: Optional[date] = None
+    units: int = 0  # channels / plates needed
+    description: str = ''
+    test_parameters: dict = field(default_factory=dict)
+    created_at: Optional[datetime] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            entry_id=d['entry_id'],
+            eq_type=d['eq_type'],
+            test_id=str(d.get('test_id', '')),
+            user=str(d.get('user', '')),
+            duration=max(int(d.get('duration') or 1), 1),
+            load_percentage=int(d.get('load_percentage') or 0),
+            priority=d.get('priority', 'Medium'),
+            earliest=to_date(d['earliest']) if d.get('earliest') else None,
+            units=int(d.get('units') or 0),
+            description=d.get('description') or '',
+            test_parameters=dict(d.get('test_parameters') or {}),
+            created_at=to_datetime(d.get('created_at')),
+        )
+
+    def to_dict(self):
+        return {
+            'entry_id': self.entry_id,
+            'eq_type': self.eq_type,
+            'test_id': self.test_id,
+            'user': self.user,
+            'duration': self.duration,
+            'load_percentage': self.load_percentage,
+            'priority': self.priority,
+            'earliest': self.earliest.strftime(DATE_FORMAT) if self.earliest else None,
+            'units': self.units,
+            'description': self.description,
+            'test_parameters': self.test_parameters,
+            'created_at': self.created_at.strftime(DATETIME_FORMAT) if self.created_at else None,
+        }
+
+def add_months(day, months):
+    """`day` moved by whole months, clamped to the end of shorter months."""
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+def occurrence_start(schedule, k):
+    """Regular start of occurrence k (0 is the schedule's own start)."""
+    rule = schedule.recurrence
+    if rule.unit == 'month':
+        return add_months(schedule.start_date, k * rule.every)
+    return schedule.start_date + timedelta(days=k * rule.every * (7 if rule.unit == 'week' else 1))
+
+def occurrence_starts(schedule, since=None):
+    """Yield the regular occurrence starts of a recurring schedule, in order.
+
+    With `since`, the walk starts near the first occurrence that can still
+    end on or after it instead of at the first occurrence.
+    """
+    rule = schedule.recurrence
+    k = 0
+    if since is not None and since > schedule.end_date:
+        # A period is at most this many days, so k never overshoots
+        longest = rule.every * {'day': 1, 'week': 7, 'month': 31}[rule.unit]
+        k = (since - schedule.end_date).days // longest
+    while rule.count is None or k < rule.count:
+        start = occurrence_start(schedule, k)
+        if rule.until and start > rule.until:
+            return
+        yield start
+        k += 1
+
+def make_occurrence(schedule, start, changes=None):
+    """One occurrence of a recurring schedule as a plain Schedule with id '<series id>@<regular start>'."""
+    occurrence = replace(
+        schedule,
+        schedule_id=f"{schedule.schedule_id}@{start:%Y-%m-%d}",
+        start_date=start,
+        end_date=start + (schedule.end_date - schedule.start_date),
+        recurrence=None,
+    )
+    for name, value in (changes or {}).items():
+        setattr(occurrence, name, to_date(value) if name in ('start_date', 'end_date') else value)
+    return occurrence
+
+def occurrences(schedule, start=None, end=None):
+    """Lazily yield the occurrences of `schedule` that share a day with [start, end].
+
+    A plain schedule yields itself. Regular occurrences come first, in
+    order, then the ones an exception changed.
+    """
+    rule = schedule.recurrence
+    if rule is None:
+        if (start is None or schedule.end_date >= start) and (end is None or schedule.start_date <= end):
+            yield schedule
+        return
+    span = schedule.end_date - schedule.start_date
+    for day in occurrence_starts(schedule, start):
+        if end is not None and day > end:
+            break
+        if day.strftime(DATE_FORMAT) not in rule.exceptions and (start is None or day + span >= start):
+            yield make_occurrence(schedule, day)
+    for key, changes in rule.exceptions.items():
+        occurrence = make_occurrence(schedule, to_date(key), changes)
+        if (start is None or occurrence.end_date >= start) and (end is None or occurrence.start_date <= end):
+            yield occurrence
+
+def next_occurrence(schedule, today=None):
+    """The earliest booked occurrence ending today or later, or None."""
+    today = today or date.today()
+    found = None
+    for occurrence in occurrences(schedule, today):
+        if occurrence.status in BOOKED_STATUSES and (found is None or occurrence.start_date < found.start_date):
+            found = occurrence
+        if found is not None and schedule.recurrence and not schedule.recurrence.exceptions:
+            # Without exceptions the first booked regular occurrence is the earliest
+            break
+    return found
+
+def last_end(schedule):
+    """Last day any occurrence of `schedule` runs."""
+    rule = schedule.recurrence
+    if rule is None:
+        return schedule.end_date
+    span = schedule.end_date - schedule.start_date
+    k = rule.count - 1 if rule.count else None
+    if rule.until:
+        if rule.unit == 'month':
+            months = (rule.until.year - schedule.start_date.year) * 12 + rule.until.month - schedule.start_date.month
+            by_until = months // rule.every
+            if occurrence_start(schedule, by_until) > rule.until:
+                by_until -= 1
+        else:
+            by_until = (rule.until - schedule.start_date).days // (rule.every * (7 if rule.unit == 'week' else 1))
+        k = by_until if k is None else min(k, by_until)
+    last = occurrence_start(schedule, max(k, 0)) + span
+    for key, changes in rule.exceptions.items():
+        last = max(last, make_occurrence(schedule, to_date(key), changes).end_date)
+    return last
+
+def decode_record(cls, d, where):
+    """`cls.from_dict(d)`, or None (logged) if the record is missing fields or has bad values."""
+    try:
+        return cls.from_dict(d)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        logger.warning("Skipping unreadable %s record in %s: %r (%s)", cls.__name__, where, d, e)
+        return None
+
+def with_schedule_ids(eq_id, items):
+    """Give schedule records written before schedules had ids a stable one.
+
+    The id is derived from the equipment and the record's content (plus a
+    counter for identical records), so decoding the same older document
+    twice yields the same ids and its records can be merged by id.
+    """
+    seen = Counter()
+    for d in items:
+        if isinstance(d, dict) and not d.get('schedule_id'):
+            content = f"{eq_id}/{json.dumps(d, sort_keys=True, default=str)}"
+            seen[content] += 1
+            d = dict(d, schedule_id=str(uuid.uuid5(uuid.NAMESPACE_OID, f"{content}/{seen[content]}")))
+        yield d
+
+def decode_state(doc):
+    """Bulk-decode a JSON-form state document into records.
+
+    Records that cannot be decoded are logged and left out, so one bad record
+    does not keep the rest of the state from loading.
+    """
+    equipment_data = {}
+    for eq_id, d in doc.get('equipment_data', {}).items():
+        eq = decode_record(Equipment, d, eq_id)
+        if eq is not None:
+            equipment_data[eq_id] = eq
+    schedules = {}
+    for eq_id, items in doc.get('schedules', {}).items():
+        decoded = (decode_record(Schedule, d, eq_id) for d in with_schedule_ids(eq_id, items))
+        schedules[eq_id] = [s for s in decoded if s is not None]
+    waitlist = (decode_record(WaitlistEntry, d, 'waitlist') for d in doc.get('waitlist', []))
+    return {
+        'equipment_data': equipment_data,
+        'schedules': schedules,
+        'waitlist': [e for e in waitlist if e is not None],
+    }
+
+def encode_state(equipment_data, schedules, waitlist):
+    """Bulk-encode records into the JSON-form state document."""
+    return {
+        'equipment_data': {eq_id: eq.to_dict() for eq_id, eq in equipment_data.items()},
+        'schedules': {eq_id: [s.to_dict() for s in items] for eq_id, items in schedules.items()},
+        'waitlist': [e.to_dict() for e in waitlist],
+    }
+
+# -------------- Persistent Storage Utilities -----------------
+# Local SQLite (WAL) is the primary store: one row per equipment item and per
+# schedule, plus one row per equipment holding its schedule order, so a save
+# only rewrites the records that changed. GitHub is kept
+# as an optional mirror of the full state file when a token is configured.
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS equipment (
+    eq_id TEXT PRIMARY KEY,
+    type TEXT,
+    status TEXT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    schedule_id TEXT PRIMARY KEY,
+    eq_id TEXT NOT NULL,
+    status TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_schedules_eq ON schedules (eq_id);
+CREATE INDEX IF NOT EXISTS idx_schedules_status ON schedules (status);
+CREATE INDEX IF NOT EXISTS idx_schedules_dates ON schedules (start_date, end_date);
+CREATE TABLE IF NOT EXISTS schedule_order (
+    eq_id TEXT PRIMARY KEY,
+    schedule_ids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waitlist (
+    entry_id TEXT PRIMARY KEY,
+    eq_type TEXT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+CREATE TABLE IF NOT EXISTS backup_blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS backup_snapshots (
+    taken_on TEXT PRIMARY KEY,
+    digest TEXT NOT NULL REFERENCES backup_blobs (digest)
+);
+CREATE TABLE IF NOT EXISTS backup_uploads (
+    taken_on TEXT PRIMARY KEY REFERENCES backup_snapshots (taken_on)
+);
+CREATE TABLE IF NOT EXISTS archive (
+    schedule_id TEXT PRIMARY KEY,
+    month TEXT NOT NULL,
+    archived_at TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    mirrored INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_archive_month ON archive (month, archived_at);
+CREATE INDEX IF NOT EXISTS idx_archive_mirrored ON archive (mirrored);
+CREATE TABLE IF NOT EXISTS archive_partitions (
+    month TEXT PRIMARY KEY,
+    etag TEXT
+);
+"""
+
+def state_rows(doc):
+    """Flatten a state document into storage rows keyed by ('equipment'|'schedule'|'schedule_order'|'waitlist', id).
+
+    A schedule row does not carry its place in the list, so removing or
+    moving one schedule only rewrites that row and its equipment's order row.
+    """
+    rows = {}
+    for eq_id, eq in doc.get('equipment_data', {}).items():
+        payload = json.dumps(eq, sort_keys=True)
+        rows[('equipment', eq_id)] = (eq_id, eq.get('type'), eq.get('status'), payload)
+    for eq_id, items in doc.get('schedules', {}).items():
+        for s in items:
+            payload = json.dumps(s, sort_keys=True)
+            rows[('schedule', s['schedule_id'])] = (
+                s['schedule_id'], eq_id, s.get('status'),
+                s.get('start_date'), s.get('end_date'), payload
+            )
+        if items:
+            rows[('schedule_order', eq_id)] = (eq_id, json.dumps([s['schedule_id'] for s in items]))
+    for e in doc.get('waitlist', []):
+        rows[('waitlist', e['entry_id'])] = (e['entry_id'], e.get('eq_type'), json.dumps(e, sort_keys=True))
+    return rows
+
+def state_digests(doc):
+    return {key: row_digest(row) for key, row in state_rows(doc).items()}
+
+def normalize_doc(doc):
+    """Round-trip a document that came from outside the store through the record model."""
+    state = decode_state(doc)
+    return encode_state(state['equipment_data'], state['schedules'], state['waitlist'])
+
+def row_digest(row):
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=16).hexdigest()
+
+class SQLiteStateStore:
+    """Primary state store backed by a local SQLite database in WAL mode."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(STATE_SCHEMA)
+        self._drop_schedule_positions()
+
+    def _drop_schedule_positions(self):
+        """Move the order of databases that kept it in a schedules.position column into schedule_order."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(schedules)")]
+        if 'position' not in columns:
+            return
+        cur = self._conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            order = {}
+            for eq_id, schedule_id in cur.execute(
+                    "SELECT eq_id, schedule_id FROM schedules ORDER BY eq_id, position").fetchall():
+                order.setdefault(eq_id, []).append(schedule_id)
+            cur.executemany("INSERT OR REPLACE INTO schedule_order (eq_id, schedule_ids) VALUES (?, ?)",
+                            [(eq_id, json.dumps(ids)) for eq_id, ids in order.items()])
+            cur.execute("DROP INDEX IF EXISTS idx_schedules_eq")
+            cur.execute("ALTER TABLE schedules RENAME TO schedules_old")
+            cur.execute("CREATE TABLE schedules (schedule_id TEXT PRIMARY KEY, eq_id TEXT NOT NULL, status TEXT, "
+                        "start_date TEXT, end_date TEXT, payload TEXT NOT NULL)")
+            cur.execute("INSERT INTO schedules SELECT schedule_id, eq_id, status, start_date, end_date, payload "
+                        "FROM schedules_old ORDER BY eq_id, position")
+            cur.execute("DROP TABLE schedules_old")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        # Recreate the indexes that went with the old table
+        self._conn.executescript(STATE_SCHEMA)
+
+    def is_empty(self):
+        with self._lock:
+            row = self._conn.execute("SELECT EXISTS (SELECT 1 FROM equipment)").fetchone()
+        return not row[0]
+
+    def revision(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def load_doc(self):
+        """Return the stored state as a JSON-form state document."""
+        with self._lock:
+            # Equipment keeps the order it was added in, as in the state file
+            eq_rows = self._conn.execute("SELECT eq_id, payload FROM equipment ORDER BY rowid").fetchall()
+            sched_rows = self._conn.execute(
+                "SELECT eq_id, schedule_id, payload FROM schedules ORDER BY rowid").fetchall()
+            order_rows = self._conn.execute("SELECT eq_id, schedule_ids FROM schedule_order").fetchall()
+            wait_rows = self._conn.execute("SELECT payload FROM waitlist ORDER BY rowid").fetchall()
+        equipment_data = {eq_id: json.loads(payload) for eq_id, payload in eq_rows}
+        grouped = {}
+        for eq_id, schedule_id, payload in sched_rows:
+            grouped.setdefault(eq_id, []).append((schedule_id, json.loads(payload)))
+        ranks = {eq_id: {sid: n for n, sid in enumerate(json.loads(ids))} for eq_id, ids in order_rows}
+        schedules = {}
+        for eq_id, items in grouped.items():
+            # Schedules missing from the order row (another session's order row
+            # won) go after the ordered ones, in the order they were added
+            rank = ranks.get(eq_id, {})
+            items.sort(key=lambda item: rank.get(item[0], len(rank)))
+            schedules[eq_id] = [record for _, record in items]
+        doc = {'equipment_data': equipment_data, 'schedules': schedules}
+        # Only written when there is a waitlist, so older state files stay as they were
+        if wait_rows:
+            doc['waitlist'] = [json.loads(payload) for payload, in wait_rows]
+        return doc
+
+    def load(self):
+        """Return the stored state as {'equipment_data': ..., 'schedules': ..., 'waitlist': ...} records."""
+        return decode_state(self.load_doc())
+
+    def apply(self, rows, base):
+        """Write the rows that differ from `base` and delete the ones that disappeared.
+
+        `base` maps row keys to the digests the caller last loaded or saved, so
+        records that were not touched by this caller are left alone. Returns the
+        digests of `rows` and whether anything was written.
+        """
+        digests = {key: row_digest(row) for key, row in rows.items()}
+        changed = [key for key, digest in digests.items() if base.get(key) != digest]
+        removed = [key for key in base if key not in digests]
+        if not changed and not removed:
+            return digests, False
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                for kind, record_id in removed:
+                    if kind == 'equipment':
+                        cur.execute("DELETE FROM equipment WHERE eq_id = ?", (record_id,))
+                    elif kind == 'waitlist':
+                        cur.execute("DELETE FROM waitlist WHERE entry_id = ?", (record_id,))
+                    elif kind == 'schedule_order':
+                        cur.execute("DELETE FROM schedule_order WHERE eq_id = ?", (record_id,))
+                    else:
+                        cur.execute("DELETE FROM schedules WHERE schedule_id = ?", (record_id,))
+                for key in changed:
+                    if key[0] == 'equipment':
+                        # An upsert keeps the rowid, and with it the equipment's place in the order
+                        cur.execute("INSERT INTO equipment (eq_id, type, status, payload) VALUES (?, ?, ?, ?) "
+                                    "ON CONFLICT (eq_id) DO UPDATE SET type = excluded.type, "
+                                    "status = excluded.status, payload = excluded.payload", rows[key])
+                    elif key[0] == 'waitlist':
+                        cur.execute("INSERT OR REPLACE INTO waitlist (entry_id, eq_type, payload) "
+                                    "VALUES (?, ?, ?)", rows[key])
+                    elif key[0] == 'schedule_order':
+                        cur.execute("INSERT OR REPLACE INTO schedule_order (eq_id, schedule_ids) "
+                                    "VALUES (?, ?)", rows[key])
+                    else:
+                        cur.execute("INSERT OR REPLACE INTO schedules (schedule_id, eq_id, status, "
+                                    "start_date, end_date, payload) VALUES (?, ?, ?, ?, ?, ?)", rows[key])
+                cur.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return digests, True
+
+    def mirror_base(self):
+        """Return (sha, doc) of the GitHub mirror blob this store last synced with, or (None, None)."""
+        with self._lock:
+            rows = dict(self._conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('mirror_sha', 'mirror_doc')").fetchall())
+        if 'mirror_sha' not in rows:
+            return None, None
+        return rows['mirror_sha'].decode("utf-8"), json.loads(gzip.decompress(rows['mirror_doc']))
+
+    def set_mirror_base(self, sha, doc):
+        # Stored as blobs, which the INTEGER affinity of meta.value leaves untouched
+        values = [('mirror_sha', (sha or '').encode("utf-8")),
+                  ('mirror_doc', gzip.compress(json.dumps(doc).encode("utf-8")))]
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def export(self):
+        """Return the whole store as a state JSON document (used for the GitHub mirror)."""
+        return json.dumps(self.load_doc(), indent=2)
+
+    def backup_snapshots(self):
+        """Return [(taken_on, digest)] for the stored backups, newest first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT taken_on, digest FROM backup_snapshots ORDER BY taken_on DESC").fetchall()
+
+    def add_backup(self, taken_on, digest, data):
+        """Record a snapshot; the gzip'd content is stored once per distinct digest."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute("INSERT OR IGNORE INTO backup_blobs (digest, data) VALUES (?, ?)", (digest, data))
+                cur.execute("INSERT OR REPLACE INTO backup_snapshots (taken_on, digest) VALUES (?, ?)", (taken_on, digest))
+                # A new snapshot for the day replaces the one that may have been uploaded
+                cur.execute("DELETE FROM backup_uploads WHERE taken_on = ?", (taken_on,))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def prune_backups(self, keep):
+        """Drop snapshots whose date is not in `keep` and blobs nothing refers to."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                for (taken_on,) in cur.execute("SELECT taken_on FROM backup_snapshots").fetchall():
+                    if taken_on not in keep:
+                        cur.execute("DELETE FROM backup_snapshots WHERE taken_on = ?", (taken_on,))
+                cur.execute("DELETE FROM backup_uploads WHERE taken_on NOT IN (SELECT taken_on FROM backup_snapshots)")
+                cur.execute("DELETE FROM backup_blobs WHERE digest NOT IN (SELECT digest FROM backup_snapshots)")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def unuploaded_backups(self):
+        """Return [(taken_on, data)] for the snapshots not on GitHub yet, oldest first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT s.taken_on, b.data FROM backup_snapshots s JOIN backup_blobs b ON b.digest = s.digest "
+                "WHERE s.taken_on NOT IN (SELECT taken_on FROM backup_uploads) ORDER BY s.taken_on").fetchall()
+
+    def mark_backup_uploaded(self, taken_on):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO backup_uploads (taken_on) VALUES (?)", (taken_on,))
+
+    def append_archive(self, lines, mirrored=False):
+        """Append archive lines (JSON-form dicts); lines already archived are ignored."""
+        rows = [(line['schedule_id'], to_datetime(line['archived_at']).strftime(ARCHIVE_MONTH_FORMAT), line['archived_at'],
+                 json.dumps(line, sort_keys=True), int(mirrored)) for line in lines]
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.executemany("INSERT OR IGNORE INTO archive (schedule_id, month, archived_at, payload, mirrored) "
+                                "VALUES (?, ?, ?, ?, ?)", rows)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def archive_months(self):
+        """Return the archive partitions held locally, newest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT month FROM archive ORDER BY month DESC").fetchall()
+        return [month for (month,) in rows]
+
+    def archive_partition(self, month):
+        """Return the archive lines of one month in archiving order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM archive WHERE month = ? "
+                                      "ORDER BY archived_at, schedule_id", (month,)).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def archive_since(self, rowid):
+        """Return (rowid, month, line) for archive rows added after `rowid`, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT rowid, month, payload FROM archive WHERE rowid > ? "
+                                      "ORDER BY rowid", (rowid,)).fetchall()
+        return [(row_id, month, json.loads(payload)) for row_id, month, payload in rows]
+
+    def archive_chunks(self, start=None, end=None, size=5000):
+        """Yield archive lines in archiving order, `size` at a time, of tests overlapping [start, end].
+
+        The date filter runs in SQLite and every chunk is its own query, so
+        the lock is not held while the caller works on a chunk.
+        """
+        where, args = "", []
+        if start is not None:
+            where += " AND json_extract(payload, '$.end_date') >= ?"
+            args.append(start.strftime(DATE_FORMAT))
+        if end is not None:
+            where += " AND json_extract(payload, '$.start_date') <= ?"
+            args.append(end.strftime(DATE_FORMAT))
+        rowid = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(f"SELECT rowid, payload FROM archive WHERE rowid > ?{where} "
+                                          "ORDER BY rowid LIMIT ?", (rowid, *args, size)).fetchall()
+            if not rows:
+                return
+            rowid = rows[-1][0]
+            yield [json.loads(payload) for _, payload in rows]
+
+    def unmirrored_archive_months(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT month FROM archive WHERE mirrored = 0").fetchall()
+        return sorted(month for (month,) in rows)
+
+    def mark_archive_mirrored(self, schedule_ids):
+        with self._lock:
+            self._conn.executemany("UPDATE archive SET mirrored = 1 WHERE schedule_id = ?",
+                                   [(sid,) for sid in schedule_ids])
+
+    def archive_etag(self, month):
+        with self._lock:
+            row = self._conn.execute("SELECT etag FROM archive_partitions WHERE month = ?", (month,)).fetchone()
+        return row[0] if row else None
+
+    def set_archive_etag(self, month, etag):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO archive_partitions (month, etag) VALUES (?, ?)", (month, etag))
+
+@st.cache_resource
+def get_state_store():
+    return SQLiteStateStore(DB_PATH)
+
+class GitHubClient:
+    """Shared, instrumented HTTP client for the GitHub Contents API.
+
+    One keep-alive session per process with per-call timeouts. 5xx and
+    rate-limited responses (and connection errors) are retried with jittered
+    exponential backoff. The X-RateLimit-* headers and request timings are kept
+    for the sidebar.
+    """
+
+    def __init__(self, base_url, token):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        """Send a request and return the final response.
+
+        Raises RuntimeError when the request still fails at the connection
+        level after GITHUB_MAX_RETRIES retries.
+        """
+        kwargs.setdefault("timeout", GITHUB_TIMEOUT)
+        url = self.base_url + path
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            started = time.monotonic()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._record(started, None)
+                if attempt == GITHUB_MAX_RETRIES:
+                    raise RuntimeError(f"GitHub request failed: {method} {path}: {e}") from e
+                delay = self._backoff(attempt)
+            else:
+                self._record(started, r)
+                delay = self._retry_delay(r, attempt)
+                if delay is None or attempt == GITHUB_MAX_RETRIES:
+                    return r
+            with self._lock:
+                self.retry_count += 1
+            time.sleep(delay)
+
+    def _record(self, started, r):
+        with self._lock:
+            self.request_count += 1
+            self.total_seconds += time.monotonic() - started
+            if r is None or r.status_code >= 500:
+                self.error_count += 1
+            if r is not None and "X-RateLimit-Remaining" in r.headers:
+                self.rate_limit_remaining = int(r.headers["X-RateLimit-Remaining"])
+                self.rate_limit_reset = int(r.headers.get("X-RateLimit-Reset", 0)) or None
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(GITHUB_BACKOFF_CAP_SECONDS, GITHUB_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _retry_after(self, value, attempt):
+        """Seconds a Retry-After header asks for; it may be delta-seconds or an HTTP-date."""
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return self._backoff(attempt)
+
+    def _retry_delay(self, r, attempt):
+        """Seconds to wait before retrying `r`, or None if it should be returned as is."""
+        if r.status_code >= 500:
+            return self._backoff(attempt)
+        if r.status_code not in (403, 429):
+            return None
+        if r.headers.get("Retry-After"):
+            delay = self._retry_after(r.headers["Retry-After"], attempt)
+        elif r.headers.get("X-RateLimit-Remaining") == "0" and r.headers.get("X-RateLimit-Reset"):
+            delay = int(r.headers["X-RateLimit-Reset"]) - time.time()
+        elif "rate limit" in r.text.lower():
+            delay = self._backoff(attempt)
+        else:
+            return None
+        # Don't hold a script or writer thread for a long primary rate-limit reset
+        return max(delay, 0) if delay <= GITHUB_BACKOFF_CAP_SECONDS else None
+
+@st.cache_resource
+def get_github_client():
+    return GitHubClient(GITHUB_API_URL, TOKEN)
+
+class StateCache:
+    """Process-wide cache of the parsed state, shared by every browser session.
+
+    `state`/`digests` belong to local store revision `revision`; `remote_sha` and
+    `remote_etag` identify the blob of the GitHub mirror this process last applied,
+    so revalidating an unchanged mirror costs a 304. `remote_doc` is that blob's
+    document, the common base for merging concurrent commits.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revision = None
+        self.state = None
+        self.digests = None
+        self.remote_sha = None
+        self.remote_etag = None
+        self.remote_doc = None
+        self.checked_at = None
+        self.archive_checked = {}
+
+@st.cache_resource
+def get_state_cache():
+    return StateCache()
+
+class MirrorConflict(RuntimeError):
+    """A mirrored file moved on since the sha a PUT was based on."""
+
+def fetch_github_file(path, etag=None):
+    """GET a file from the repository. Returns (sha, etag, text).
+
+    `text` is None when `etag` still matches (304) and (None, None, None) is
+    returned when the file does not exist yet. Raises RuntimeError otherwise.
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    r = get_github_client().get(f"/repos/{REPO}/contents/{path}", params={"ref": BRANCH}, headers=headers)
+    if r.status_code == 304:
+        return None, etag, None
+    if r.status_code == 404:
+        return None, None, None
+    if r.status_code != 200:
+        raise RuntimeError(f"Failed to load {path} from GitHub: {r.status_code} - {r.text}")
+    body = r.json()
+    decoded = base64.b64decode(body.get("content", "")).decode("utf-8")
+    return body.get("sha"), r.headers.get("ETag"), decoded
+
+def put_github_file(path, content, sha, message):
+    """PUT `content` on top of blob `sha` and return the new blob sha.
+
+    Raises MirrorConflict when GitHub rejects the sha (409/422) and
+    RuntimeError for any other failure.
+    """
+    data = {
+        "message": message,
+        "content": base64.b64encode(content.encode("utf-8")).decode("utf-8"),
+        "branch": BRANCH
+    }
+    if sha:
+        data["sha"] = sha
+    r_put = get_github_client().put(f"/repos/{REPO}/contents/{path}", data=json.dumps(data))
+    if r_put.status_code in (409, 422):
+        raise MirrorConflict(f"{path} changed on GitHub: {r_put.status_code} - {r_put.text}")
+    if r_put.status_code not in (200, 201):
+        raise RuntimeError(f"Error saving {path} to GitHub: {r_put.status_code} - {r_put.text}")
+    return r_put.json().get("content", {}).get("sha")
+
+def fetch_state_from_github(etag=None):
+    """GET the mirrored state file; see fetch_github_file()."""
+    return fetch_github_file(FILE_PATH, etag)
+
+def load_state_from_github(cache):
+    """Conditionally fetch the mirrored state file.
+
+    Returns (sha, etag, text), with text None when the blob is unchanged since
+    the last fetch (304) or is the one this process already holds, or None if
+    the request failed. The cache is left alone; the caller advances it once
+    the blob has been applied.
+    """
+    try:
+        sha, etag, text = fetch_state_from_github(cache.remote_etag)
+    except RuntimeError as e:
+        st.error(str(e))
+        return None
+    if text is None:
+        return cache.remote_sha, etag, None
+    if sha and sha == cache.remote_sha:
+        return sha, etag, None
+    return sha, etag, text
+
+def restore_mirror_base(store, cache):
+    """Load the last synced mirror blob (sha and document) kept in the store, once per process."""
+    if cache.remote_sha is None and cache.remote_doc is None:
+        sha, doc = store.mirror_base()
+        cache.remote_sha, cache.remote_doc = sha, normalize_doc(doc) if doc is not None else None
+
+def remember_mirror_base(store, cache, sha, doc):
+    cache.remote_sha = sha
+    cache.remote_doc = doc
+    store.set_mirror_base(sha, doc)
+
+def sync_from_github(store, cache):
+    """Merge state committed to the GitHub mirror by another app instance into the local store.
+
+    Checks at most every STATE_REVALIDATE_SECONDS per process (always when the
+    local store is still empty) and skips the import while local saves are
+    waiting to be pushed; the writer merges those itself. The merge is
+    three-way against the last synced blob, which is kept in the store so a
+    restart still knows it; without one, records on either side are kept and
+    conflicting fields keep the local value. Local changes the mirror does not
+    have yet (say, saves a crash kept from being pushed) are queued for the
+    writer.
+    """
+    empty = store.is_empty()
+    now = time.monotonic()
+    first = cache.checked_at is None
+    if not empty and not first and now - cache.checked_at < STATE_REVALIDATE_SECONDS:
+        return
+    cache.checked_at = now
+    restore_mirror_base(store, cache)
+    result = load_state_from_github(cache)
+    if result is None:
+        return
+    sha, etag, text = result
+    if text is not None:
+        if not empty and GITHUB_MIRROR and get_mirror_writer().pending:
+            return
+        # merge_states() matches schedules by id, which older files lack
+        remote = normalize_doc(json.loads(text))
+        local = store.load_doc()
+        merged = normalize_doc(merge_states(cache.remote_doc, local, remote))
+        store.apply(state_rows(merged), state_digests(local))
+        remember_mirror_base(store, cache, sha, remote)
+    cache.remote_etag = etag
+    if (first or text is not None) and GITHUB_MIRROR and not store.is_empty():
+        if store.load_doc() != normalize_doc(cache.remote_doc or {}):
+            get_mirror_writer().submit()
+
+def put_state_to_github(new_content, sha):
+    """PUT the state document on top of blob `sha`; see put_github_file()."""
+    return put_github_file(FILE_PATH, new_content, sha, "Update LTCMS state from Streamlit app")
+
+_MISSING = object()
+
+def merge_records(base, ours, theirs):
+    """Three-way merge of one record; None stands for an absent (deleted) record.
+
+    Non-conflicting field changes from both sides are combined. A field both
+    sides changed differently keeps our value, and a record deleted on one side
+    but edited on the other is kept so no edit is silently dropped.
+    """
+    if ours == theirs:
+        return ours
+    if ours == base:
+        return theirs
+    if theirs == base:
+        return ours
+    if ours is None or theirs is None:
+        return theirs if ours is None else ours
+    base = base or {}
+    merged = {}
+    for field in list(ours) + [f for f in theirs if f not in ours]:
+        b = base.get(field, _MISSING)
+        o = ours.get(field, _MISSING)
+        t = theirs.get(field, _MISSING)
+        value = t if (o == b and t != b) else o
+        if value is not _MISSING:
+            merged[field] = value
+    return merged
+
+def merge_states(base, ours, theirs):
+    """Record-level three-way merge of state documents (JSON form).
+
+    Equipment is matched by equipment ID, schedules by schedule_id and
+    waitlist entries by entry_id; the equipment a schedule belongs to is
+    merged like any other field. Schedules keep our ordering, followed by the
+    ones only the other side has.
+    """
+    base = base or {}
+
+    def schedule_map(doc):
+        out = {}
+        for eq_id, items in doc.get('schedules', {}).items():
+            for position, s in enumerate(items):
+                out[s['schedule_id']] = (position, dict(s, _equipment_id=eq_id))
+        return out
+
+    equipment_data = {}
+    base_eq, ours_eq, theirs_eq = (d.get('equipment_data', {}) for d in (base, ours, theirs))
+    for eq_id in list(ours_eq) + [k for k in theirs_eq if k not in ours_eq]:
+        record = merge_records(base_eq.get(eq_id), ours_eq.get(eq_id), theirs_eq.get(eq_id))
+        if record is not None:
+            equipment_data[eq_id] = record
+
+    base_s, ours_s, theirs_s = (schedule_map(d) for d in (base, ours, theirs))
+    ordered = []
+    for sid in list(ours_s) + [k for k in theirs_s if k not in ours_s]:
+        record = merge_records(
+            base_s[sid][1] if sid in base_s else None,
+            ours_s[sid][1] if sid in ours_s else None,
+            theirs_s[sid][1] if sid in theirs_s else None,
+        )
+        if record is None:
+            continue
+        order = ours_s[sid][0] if sid in ours_s else len(ours_s) + theirs_s[sid][0]
+        ordered.append((order, record))
+    schedules = {}
+    for _, record in sorted(ordered, key=lambda item: item[0]):
+        eq_id = record.pop('_equipment_id')
+        # Schedules of equipment deleted on either side go with it
+        if eq_id in equipment_data:
+            schedules.setdefault(eq_id, []).append(record)
+    merged = {'equipment_data': equipment_data, 'schedules': schedules}
+
+    base_w, ours_w, theirs_w = ({e['entry_id']: e for e in d.get('waitlist', [])} for d in (base, ours, theirs))
+    waitlist = []
+    for entry_id in list(ours_w) + [k for k in theirs_w if k not in ours_w]:
+        record = merge_records(base_w.get(entry_id), ours_w.get(entry_id), theirs_w.get(entry_id))
+        if record is not None:
+            waitlist.append(record)
+    if waitlist:
+        merged['waitlist'] = waitlist
+    return merged
+
+def mirror_state_to_github(store, cache):
+    """Push the store to GitHub with optimistic concurrency; returns the new blob sha.
+
+    The PUT carries the sha the mirror had when this process last synced. If
+    another instance committed in between, its document is merged with ours
+    against that common base, the merge is applied to the local store and the
+    PUT is retried with bounded, jittered backoff.
+    """
+    restore_mirror_base(store, cache)
+    ours = store.load_doc()
+    sha = cache.remote_sha
+    base = cache.remote_doc
+    for attempt in range(MIRROR_MAX_ATTEMPTS):
+        try:
+            new_sha = put_state_to_github(json.dumps(ours, indent=2), sha)
+        except MirrorConflict:
+            if attempt == MIRROR_MAX_ATTEMPTS - 1:
+                raise
+        else:
+            # Our own commit must not be re-imported by sync_from_github
+            remember_mirror_base(store, cache, new_sha, ours)
+            return new_sha
+        sha, _, text = fetch_state_from_github()
+        theirs = normalize_doc(json.loads(text)) if text else {}
+        merged = normalize_doc(merge_states(base, ours, theirs))
+        # Only write what the merge changed, so local saves made since the
+        # export are not overwritten
+        store.apply(state_rows(merged), state_digests(ours))
+        base, ours = theirs, merged
+        time.sleep(min(MIRROR_BACKOFF_CAP_SECONDS, MIRROR_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+_STOP = object()
+
+class MirrorWriter:
+    """Background thread that coalesces state saves into one GitHub commit per window.
+
+    save_app_state() only enqueues a notification; the writer waits until no
+    new save has arrived for MIRROR_DEBOUNCE_SECONDS (or MIRROR_MAX_DELAY_SECONDS
+    have passed since the first pending one) and then pushes the current store
+    contents once. Failed pushes are retried every MIRROR_RETRY_SECONDS.
+    """
+
+    def __init__(self, store, cache):
+        self.store = store
+        self.cache = cache
+        self.status = 'saved'
+        self.last_saved = None
+        self.last_error = None
+        self._dirty = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ltcms-mirror-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        return self._dirty or not self._queue.empty()
+
+    def submit(self):
+        self.status = 'saving'
+        self._queue.put(True)
+
+    def close(self, timeout=30):
+        """Flush any pending save and stop the thread (called at interpreter exit)."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _debounce(self):
+        """Absorb further saves until the window is quiet; return True if asked to stop."""
+        first = time.monotonic()
+        while True:
+            wait = min(MIRROR_DEBOUNCE_SECONDS, first + MIRROR_MAX_DELAY_SECONDS - time.monotonic())
+            if wait <= 0:
+                return False
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                return False
+            if item is _STOP:
+                return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=MIRROR_RETRY_SECONDS if self._dirty else None)
+            except queue.Empty:
+                item = None  # retry a failed push
+            stopping = item is _STOP
+            if item is True:
+                self._dirty = True
+                stopping = self._debounce()
+            if self._dirty:
+                self._flush()
+
+    def _flush(self):
+        self.status = 'saving'
+        try:
+            # Archived tests go first, so a test leaving the mirrored state
+            # is already in its archive partition on GitHub
+            mirror_archive_to_github(self.store)
+            mirror_state_to_github(self.store, self.cache)
+        except Exception as e:
+            self.status = 'failed'
+            self.last_error = str(e)
+            return
+        self._dirty = False
+        self.last_error = None
+        self.last_saved = datetime.now()
+        # A save may have been queued while the push was in flight
+        self.status = 'saving' if not self._queue.empty() else 'saved'
+
+@st.cache_resource
+def get_mirror_writer():
+    writer = MirrorWriter(get_state_store(), get_state_cache())
+    atexit.register(writer.close)
+    return writer
+
+def load_app_state():
+    store = get_state_store()
+    cache = get_state_cache()
+    if TOKEN:
+        sync_from_github(store, cache)
+    # New sessions share one parsed copy per store revision instead of
+    # re-reading and re-parsing every record
+    with cache.lock:
+        revision = store.revision()
+        if cache.state is None or cache.revision != revision:
+            cache.state = store.load()
+            cache.digests = state_digests(encode_state(
+                cache.state['equipment_data'], cache.state['schedules'], cache.state['waitlist']))
+            cache.revision = revision
+        state = copy.deepcopy(cache.state)
+        # Remember what this session loaded so saves only write its own changes
+        st.session_state.state_base = dict(cache.digests)
+    return state
+
+def save_app_state():
+    store = get_state_store()
+    rows = state_rows(encode_state(st.session_state.equipment_data, st.session_state.schedules,
+                                   st.session_state.waitlist.entries.values()))
+    base = st.session_state.get('state_base', {})
+    digests, changed = store.apply(rows, base)
+    st.session_state.state_base = digests
+    if changed and 'aggregates' in st.session_state:
+        touched = st.session_state.aggregates.touched(rows, base, digests)
+        st.session_state.aggregates.update(st.session_state.equipment_data, st.session_state.schedules, touched)
+        st.session_state.schedule_index.update(st.session_state.schedules, touched)
+        st.session_state.schedule_table.update(st.session_state.schedules, touched)
+        st.session_state.search_index.update(st.session_state.equipment_data, st.session_state.schedules, touched)
+        st.session_state.forecast.update(st.session_state.equipment_data, st.session_state.schedules, touched)
+    if changed and GITHUB_MIRROR:
+        get_mirror_writer().submit()
+
+def render_save_indicator():
+    """Show the GitHub mirror status (saving / saved / failed) in the sidebar."""
+    if not GITHUB_MIRROR:
+        st.caption("💾 Saved locally")
+        return
+    writer = get_mirror_writer()
+    if writer.status == 'saving':
+        st.caption("⏳ Saving to GitHub...")
+    elif writer.status == 'failed':
+        st.caption(f"⚠️ GitHub sync failed, retrying: {writer.last_error[:200]}")
+    elif writer.last_saved:
+        st.caption(f"✅ Saved to GitHub at {writer.last_saved.strftime('%H:%M:%S')}")
+    else:
+        st.caption("✅ Saved")
+    backup_error = get_backup_service().last_error
+    if backup_error:
+        st.caption(f"⚠️ GitHub backup failed, will retry with the next backup: {backup_error[:200]}")
+    client = get_github_client()
+    if client.rate_limit_remaining is not None:
+        avg_ms = client.total_seconds / max(client.request_count, 1) * 1000
+        st.caption(f"GitHub API: {client.rate_limit_remaining} calls left · "
+                   f"{client.request_count} requests, avg {avg_ms:.0f} ms")
+
+# -------------- Backups -----------------
+# Daily snapshots of the store, gzip'd and content-addressed: an unchanged
+# state is never stored or uploaded twice, and old snapshots are thinned out
+# by a daily/weekly/monthly retention policy.
+def backup_retention(dates):
+    """Return the snapshot dates kept by the daily/weekly/monthly policy."""
+    keep, days, weeks, months = set(), set(), set(), set()
+    for d in sorted(dates, reverse=True):
+        week, month = d.isocalendar()[:2], (d.year, d.month)
+        if len(days) < BACKUP_KEEP_DAILY and d not in days:
+            days.add(d)
+            keep.add(d)
+        if len(weeks) < BACKUP_KEEP_WEEKLY and week not in weeks:
+            weeks.add(week)
+            keep.add(d)
+        if len(months) < BACKUP_KEEP_MONTHLY and month not in months:
+            months.add(month)
+            keep.add(d)
+    return keep
+
+def git_blob_sha(data):
+    """The sha GitHub reports for a file with this content."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def backup_file_date(name):
+    """Parse the snapshot date out of a backups/ file name, or None."""
+    try:
+        return datetime.strptime(name, BACKUP_FILE_PATTERN).date()
+    except ValueError:
+        return None
+
+def upload_backup_to_github(taken_on, data):
+    """Upload a gzip'd snapshot to the backups/ folder and apply retention there.
+
+    Skips the upload when that day's or the newest remote snapshot already
+    has this content. Raises RuntimeError when the upload or deleting an
+    expired snapshot fails (the snapshot then counts as not uploaded, so
+    the next run tries again).
+    """
+    client = get_github_client()
+    r = client.get(f"/repos/{REPO}/contents/{BACKUP_DIR}", params={"ref": BRANCH})
+    if r.status_code not in (200, 404):
+        raise RuntimeError(f"Failed to list backups on GitHub: {r.status_code} - {r.text}")
+    remote = {}
+    for item in (r.json() if r.status_code == 200 else []):
+        file_date = backup_file_date(item.get("name", ""))
+        if file_date:
+            remote[file_date] = item
+    newest = remote[max(remote)] if remote else None
+    blob_sha = git_blob_sha(data)
+    if remote.get(taken_on, {}).get("sha") != blob_sha and (not newest or newest.get("sha") != blob_sha):
+        name = taken_on.strftime(BACKUP_FILE_PATTERN)
+        body = {
+            "message": f"Automated backup {taken_on.strftime('%Y-%m-%d')}",
+            "content": base64.b64encode(data).decode("utf-8"),
+            "branch": BRANCH
+        }
+        if taken_on in remote:
+            body["sha"] = remote[taken_on]["sha"]
+        put_r = client.put(f"/repos/{REPO}/contents/{BACKUP_DIR}/{name}", data=json.dumps(body))
+        if put_r.status_code not in (200, 201):
+            raise RuntimeError(f"Error creating backup file: {put_r.status_code} - {put_r.text}")
+        remote[taken_on] = {"name": name, "sha": put_r.json().get("content", {}).get("sha")}
+    keep = backup_retention(remote)
+    failed = []
+    for file_date, item in remote.items():
+        if file_date not in keep:
+            body = {"message": f"Expire backup {item['name']}", "sha": item["sha"], "branch": BRANCH}
+            del_r = client.delete(f"/repos/{REPO}/contents/{BACKUP_DIR}/{item['name']}", data=json.dumps(body))
+            if del_r.status_code not in (200, 404):
+                failed.append(f"{item['name']}: {del_r.status_code} - {del_r.text}")
+    if failed:
+        raise RuntimeError("Error expiring backup files: " + "; ".join(failed))
+
+class BackupService:
+    """Takes at most one snapshot per day per process, off the script thread.
+
+    Each run also uploads the snapshots a failed earlier run left off GitHub.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.last_period = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        today = date.today()
+        with self._lock:
+            if self.last_period == today:
+                return
+            self.last_period = today
+        threading.Thread(target=self._backup, args=(today,), name="ltcms-backup", daemon=True).start()
+
+    def _backup(self, today):
+        if self.store.is_empty():
+            return
+        text = self.store.export()
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        snapshots = self.store.backup_snapshots()
+        if not snapshots or snapshots[0][1] != digest:
+            # mtime=0 keeps the gzip bytes (and so the GitHub blob sha) stable
+            data = gzip.compress(text.encode("utf-8"), mtime=0)
+            self.store.add_backup(today.isoformat(), digest, data)
+            dates = [datetime.strptime(taken_on, "%Y-%m-%d").date() for taken_on, _ in self.store.backup_snapshots()]
+            self.store.prune_backups({d.isoformat() for d in backup_retention(dates)})
+        if GITHUB_MIRROR:
+            try:
+                for taken_on, data in self.store.unuploaded_backups():
+                    upload_backup_to_github(datetime.strptime(taken_on, "%Y-%m-%d").date(), data)
+                    self.store.mark_backup_uploaded(taken_on)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("GitHub backup failed: %s", e)
+
+@st.cache_resource
+def get_backup_service():
+    return BackupService(get_state_store())
+
+# -------------- Test History Archive -----------------
+# Completed and cancelled tests are moved out of the live state into an
+# append-only archive partitioned by the month they were archived in. The
+# partitions live in the local store and as ARCHIVE_DIR/<YYYY-MM>.jsonl on
+# GitHub, and are only read when the history view asks for a month.
+def archive_file_path(month):
+    return f"{ARCHIVE_DIR}/{month}.jsonl"
+
+def archive_lines(eq_id, schedules, archived_at):
+    """JSON-form archive lines for schedules leaving the live state."""
+    return [dict(s.to_dict(), equipment_id=eq_id, archived_at=str(archived_at)) for s in schedules]
+
+def parse_archive_text(text):
+    return [json.loads(line) for line in (text or "").splitlines() if line.strip()]
+
+def mirror_archive_to_github(store):
+    """Append locally archived tests to their month partitions on GitHub.
+
+    Partitions are append-only, so a partition another instance committed to
+    in the meantime is resolved by taking the union of both sides' lines and
+    retrying with the same backoff as the state mirror.
+    """
+    for month in store.unmirrored_archive_months():
+        path = archive_file_path(month)
+        for attempt in range(MIRROR_MAX_ATTEMPTS):
+            sha, _, text = fetch_github_file(path)
+            remote = parse_archive_text(text)
+            store.append_archive(remote, mirrored=True)
+            lines = store.archive_partition(month)
+            schedule_ids = [line['schedule_id'] for line in lines]
+            if set(schedule_ids) <= {line['schedule_id'] for line in remote}:
+                store.mark_archive_mirrored(schedule_ids)
+                break
+            content = "".join(json.dumps(line, sort_keys=True) + "\n" for line in lines)
+            try:
+                put_github_file(path, content, sha, f"Archive LTCMS tests for {month}")
+            except MirrorConflict:
+                if attempt == MIRROR_MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(min(MIRROR_BACKOFF_CAP_SECONDS, MIRROR_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+            store.mark_archive_mirrored(schedule_ids)
+            break
+
+@st.cache_data(ttl=STATE_REVALIDATE_SECONDS, show_spinner=False)
+def list_archive_months_on_github():
+    r = get_github_client().get(f"/repos/{REPO}/contents/{ARCHIVE_DIR}", params={"ref": BRANCH})
+    if r.status_code == 404:
+        return []
+    if r.status_code != 200:
+        raise RuntimeError(f"Failed to list the test archive on GitHub: {r.status_code} - {r.text}")
+    return [item["name"][:-len(".jsonl")] for item in r.json() if item.get("name", "").endswith(".jsonl")]
+
+def archive_months():
+    """Return every archive partition (local or on GitHub), newest first."""
+    months = set(get_state_store().archive_months())
+    if TOKEN:
+        try:
+            months.update(list_archive_months_on_github())
+        except RuntimeError as e:
+            st.error(str(e))
+    return sorted(months, reverse=True)
+
+def load_archive_partition(month):
+    """Return one month of archived tests, revalidating it against GitHub first.
+
+    The partition is fetched with If-None-Match, at most every
+    STATE_REVALIDATE_SECONDS per process, so an unchanged month costs a 304.
+    """
+    store = get_state_store()
+    cache = get_state_cache()
+    now = time.monotonic()
+    checked = cache.archive_checked.get(month)
+    if TOKEN and (checked is None or now - checked >= STATE_REVALIDATE_SECONDS):
+        cache.archive_checked[month] = now
+        try:
+            _, etag, text = fetch_github_file(archive_file_path(month), store.archive_etag(month))
+        except RuntimeError as e:
+            st.error(str(e))
+        else:
+            if text is not None:
+                store.append_archive(parse_archive_text(text), mirrored=True)
+                store.set_archive_etag(month, etag)
+    return store.archive_partition(month)
+
+# -------------- Schedule Interval Index -----------------
+# Active schedules of each equipment as date intervals (inclusive), so
+# overlap and free-window questions are answered without walking day by day.
+# Kept current by save_app_state() for the equipment a save touched.
+BOOKED_STATUSES = ('Scheduled', 'In Progress')
+
+class IntervalIndex:
+    """Intervals sorted by start, searched as an implicit balanced tree.
+
+    Every position `mid` of the sorted list is the root of the sub-range
+    [lo, hi) it splits, and `_max_end[mid]` is the latest end in that
+    sub-range. A search prunes every sub-range that ends before the query
+    or starts after it, so it costs O(log n + k) for k matches on typical
+    schedules. Updates re-sort and rebuild the maxima, which is cheap at
+    the sizes one equipment item sees.
+    """
+
+    def __init__(self, intervals=()):
+        self._reset(intervals)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _reset(self, intervals):
+        self._items = sorted(intervals)
+        self._max_end = [None] * len(self._items)
+        self._build(0, len(self._items))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        latest = self._items[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > latest:
+                latest = child
+        self._max_end[mid] = latest
+        return latest
+
+    def latest_end(self):
+        """The latest end of any interval (kept at the root), or None when empty."""
+        return self._max_end[len(self._items) // 2] if self._items else None
+
+    def add(self, start, end, key):
+        self._reset(self._items + [(start, end, key)])
+
+    def remove(self, key):
+        self._reset([item for item in self._items if item[2] != key])
+
+    def overlapping(self, start, end):
+        """Return (start, end, key) for every interval intersecting [start, end], by start."""
+        out = []
+        self._search(0, len(self._items), start, end, out)
+        return out
+
+    def _search(self, lo, hi, start, end, out):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] < start:
+            return
+        self._search(lo, mid, start, end, out)
+        item = self._items[mid]
+        if item[0] > end:
+            return
+        if item[1] >= start:
+            out.append(item)
+        self._search(mid + 1, hi, start, end, out)
+
+    def free_windows(self, start, end):
+        """Return the maximal (start, end) date ranges inside [start, end] no interval covers."""
+        windows = []
+        cursor = start
+        for s, e, _ in self.overlapping(start, end):
+            if s > cursor:
+                windows.append((cursor, s - timedelta(days=1)))
+            if e >= cursor:
+                cursor = e + timedelta(days=1)
+        if cursor <= end:
+            windows.append((cursor, end))
+        return windows
+
+def sweep_load(intervals):
+    """Sweep (start, end, load) intervals into [(day, load)] steps.
+
+    Each step's load holds from its day until the next step; the last step
+    (the day after the final end) is back to 0.
+    """
+    events = {}
+    for start, end, load in intervals:
+        events[start] = events.get(start, 0) + load
+        after = end + timedelta(days=1)
+        events[after] = events.get(after, 0) - load
+    steps, level = [], 0
+    for day in sorted(events):
+        level += events[day]
+        steps.append((day, level))
+    return steps
+
+def concurrent_load(schedules, day=None):
+    """Load of the booked schedules running on `day` (default today)."""
+    day = day or date.today()
+    return sum(o.load_percentage for s in schedules for o in occurrences(s, day, day)
+               if o.status in BOOKED_STATUSES)
+
+# Channels of a pulse tester and plates of a vibration table are booked per
+# test; sets of them are bitmasks with bit n-1 standing for unit n
+ALLOCATED_UNITS = {
+    'PULSE_TESTER': ('channels', 'Channels', 8),
+    'VIBRATION': ('plates', 'Plates', 3),
+}
+
+def units_mask(numbers):
+    mask = 0
+    for n in numbers or ():
+        mask |= 1 << (n - 1)
+    return mask
+
+def mask_units(mask):
+    return [i + 1 for i in range(mask.bit_length()) if mask >> i & 1]
+
+def format_units(numbers):
+    """Compact '1-4, 7' form of a sorted list of unit numbers."""
+    parts, run = [], []
+    for n in numbers:
+        if run and n != run[-1] + 1:
+            parts.append(f"{run[0]}-{run[-1]}" if len(run) > 1 else str(run[0]))
+            run = []
+        run.append(n)
+    if run:
+        parts.append(f"{run[0]}-{run[-1]}" if len(run) > 1 else str(run[0]))
+    return ", ".join(parts)
+
+def parse_units(text):
+    """Inverse of format_units: '1-4, 7' -> [1, 2, 3, 4, 7]; None if it is not that form."""
+    numbers = set()
+    for part in str(text).replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        try:
+            low, high = int(float(low)), int(float(high or low))
+        except ValueError:
+            return None
+        if low < 1 or high < low:
+            return None
+        numbers.update(range(low, high + 1))
+    return sorted(numbers) or None
+
+class ScheduleIndex:
+    """One IntervalIndex of booked (scheduled / in progress) tests per equipment.
+
+    Recurring schedules are kept aside per equipment and expanded only over
+    the range a query asks about.
+    """
+
+    def __init__(self, schedules=None):
+        self.by_equipment = {}
+        self.series = {}  # eq_id -> booked recurring schedules
+        self.schedules = {}  # schedule_id -> Schedule
+        if schedules:
+            self.update(schedules, list(schedules))
+
+    def update(self, schedules, eq_ids):
+        # Every touched equipment is cleared before any is refilled: a renamed
+        # item's schedules move to its new ID, which may come first
+        for eq_id in eq_ids:
+            old = self.by_equipment.pop(eq_id, None)
+            if old is not None:
+                for _, _, schedule_id in old._items:
+                    self.schedules.pop(schedule_id, None)
+            for series in self.series.pop(eq_id, []):
+                self.schedules.pop(series.schedule_id, None)
+        for eq_id in eq_ids:
+            booked = [s for s in schedules.get(eq_id, []) if s.status in BOOKED_STATUSES]
+            single = [s for s in booked if s.recurrence is None]
+            if single:
+                self.by_equipment[eq_id] = IntervalIndex(
+                    (s.start_date, s.end_date, s.schedule_id) for s in single)
+            if len(single) < len(booked):
+                self.series[eq_id] = [s for s in booked if s.recurrence is not None]
+            self.schedules.update((s.schedule_id, s) for s in booked)
+
+    def overlapping(self, eq_id, start, end, exclude=None):
+        """Booked schedules (or occurrences) of `eq_id` that share at least one day with [start, end].
+
+        `exclude` leaves out a schedule, a whole series or one occurrence.
+        """
+        index = self.by_equipment.get(eq_id)
+        found = [self.schedules[key] for _, _, key in index.overlapping(start, end)
+                 if key != exclude] if index is not None else []
+        for series in self.series.get(eq_id, ()):
+            if series.schedule_id != exclude:
+                found.extend(o for o in occurrences(series, start, end)
+                             if o.status in BOOKED_STATUSES and o.schedule_id != exclude)
+        return found
+
+    def free_windows(self, eq_id, start, end, min_days=1):
+        """Unbooked date ranges of `eq_id` within [start, end] at least `min_days` long."""
+        booked = IntervalIndex((s.start_date, s.end_date, s.schedule_id)
+                               for s in self.overlapping(eq_id, start, end))
+        windows = booked.free_windows(start, end)
+        return [(s, e) for s, e in windows if (e - s).days + 1 >= min_days]
+
+    def load_profile(self, eq_id, start, end, exclude=None, extra=0):
+        """Concurrent load steps of `eq_id` within [start, end] (see sweep_load).
+
+        `exclude` leaves one schedule out (the one being edited) and `extra`
+        adds a prospective booking's load over the whole range.
+        """
+        intervals = [(max(s.start_date, start), min(s.end_date, end), s.load_percentage)
+                     for s in self.overlapping(eq_id, start, end, exclude)]
+        if extra:
+            intervals.append((start, end, extra))
+        return sweep_load(intervals)
+
+    def peak_load(self, eq_id, start, end, exclude=None, extra=0):
+        """Return (peak load, first day it occurs) of `eq_id` within [start, end]."""
+        peak, peak_day = 0, start
+        for day, level in self.load_profile(eq_id, start, end, exclude, extra):
+            if level > peak:
+                peak, peak_day = level, day
+        return peak, peak_day
+
+    def occupancy(self, eq_id, start, end, kind, exclude=None):
+        """Per-day bitmap of the `kind` units ('channels' or 'plates') booked within [start, end].
+
+        Returned run-length encoded as [(day, mask)] steps: each mask holds
+        from its day until the next step's day.
+        """
+        booked = [(max(s.start_date, start), min(s.end_date, end), units_mask(getattr(s, kind)))
+                  for s in self.overlapping(eq_id, start, end, exclude)]
+        boundaries = {start}
+        for a, b, _ in booked:
+            boundaries.add(a)
+            boundaries.add(b + timedelta(days=1))
+        steps = []
+        for day in sorted(boundaries):
+            if day > end:
+                break
+            mask = 0
+            for a, b, units in booked:
+                if a <= day <= b:
+                    mask |= units
+            steps.append((day, mask))
+        return steps
+
+    def free_units(self, eq_id, start, end, kind, capacity, exclude=None):
+        """Unit numbers 1..capacity free on every day of [start, end] (AND of the daily free masks)."""
+        free = (1 << capacity) - 1
+        for _, mask in self.occupancy(eq_id, start, end, kind, exclude):
+            free &= ~mask
+        return mask_units(free)
+
+    def assign_units(self, eq_id, start, end, kind, capacity, count, exclude=None):
+        """The lowest `count` units free for the whole range, or None if there are not enough."""
+        free = self.free_units(eq_id, start, end, kind, capacity, exclude)
+        return free[:count] if len(free) >= count else None
+
+    def peak_load_for(self, eq_id, schedule, exclude=None):
+        """(peak load, day) over every occurrence of `schedule` if it were booked on `eq_id`."""
+        peak = (0, schedule.start_date)
+        for o in occurrences(schedule):
+            if o.status in BOOKED_STATUSES:
+                level = self.peak_load(eq_id, o.start_date, o.end_date, exclude, o.load_percentage)
+                if level[0] > peak[0]:
+                    peak = level
+        return peak
+
+    def free_units_for(self, eq_id, schedule, kind, capacity, exclude=None):
+        """Units free on every day of every occurrence of `schedule`."""
+        free = (1 << capacity) - 1
+        for o in occurrences(schedule):
+            if o.status in BOOKED_STATUSES:
+                free &= units_mask(self.free_units(eq_id, o.start_date, o.end_date, kind, capacity, exclude))
+        return mask_units(free)
+
+    def latest_end(self, eq_id):
+        """The last booked day of `eq_id`, or None."""
+        index = self.by_equipment.get(eq_id)
+        ends = [index.latest_end()] if index is not None else []
+        ends.extend(last_end(s) for s in self.series.get(eq_id, ()))
+        return max(ends, default=None)
+
+    def upcoming_peak(self, eq_id, today=None):
+        """(peak load, day) from today to the last booked day, or None if nothing is booked."""
+        today = today or date.today()
+        last = self.latest_end(eq_id)
+        if last is None or last < today:
+            return None
+        return self.peak_load(eq_id, today, last)
+
+    def bookings_by_day(self, eq_id, start, end):
+        """{day: [booked schedules running that day]} for the booked days within [start, end]."""
+        days = {}
+        for s in sorted(self.overlapping(eq_id, start, end), key=lambda s: s.start_date):
+            day = max(s.start_date, start)
+            while day <= min(s.end_date, end):
+                days.setdefault(day, []).append(s)
+                day += timedelta(days=1)
+        return days
+
+    def timeline(self, eq_id, start, end):
+        """Booked schedules of `eq_id` clipped to [start, end] as (start, end, schedule), by start."""
+        return sorted(((max(s.start_date, start), min(s.end_date, end), s)
+                       for s in self.overlapping(eq_id, start, end)),
+                      key=lambda bar: bar[0])
+
+# -------------- Schedule Table -----------------
+# Every schedule (booked or not) keyed by id, with secondary indexes on
+# status, equipment, user and date span so the schedule list views filter
+# by set intersection instead of rescanning all tests on every rerun.
+# Kept current by save_app_state() like the interval index.
+SCHEDULE_TABLE_COLUMNS = ['Equipment', 'Test ID', 'User', 'Start Date', 'End Date', 'Status',
+                          'Load %', 'Repeats', 'Created']
+
+class ScheduleTable:
+    """`rows[schedule_id]` is (equipment ID, Schedule); the indexes map a key to a set of ids.
+
+    Each equipment's spans (first start to last occurrence end) sit in an
+    IntervalIndex for date-range queries. `frame()` is the display table,
+    indexed by schedule id and rebuilt per equipment only after a change.
+    """
+
+    def __init__(self, schedules=None):
+        self.rows = {}
+        self.by_status = {}
+        self.by_equipment = {}
+        self.by_user = {}  # lower-cased user -> ids
+        self.keys = {}  # id -> (status, lower-cased user) it is indexed under
+        self.spans = {}  # eq_id -> IntervalIndex of (start, last end, schedule_id)
+        self._frames = {}
+        self._frame = None
+        if schedules:
+            self.update(schedules, list(schedules))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def update(self, schedules, eq_ids):
+        # All removals go first, as in ScheduleIndex.update()
+        for eq_id in eq_ids:
+            for schedule_id in self.by_equipment.pop(eq_id, ()):
+                # Schedules are edited in place, so drop the keys they were
+                # indexed under rather than their current values
+                del self.rows[schedule_id]
+                status, user = self.keys.pop(schedule_id)
+                self._discard(self.by_status, status, schedule_id)
+                self._discard(self.by_user, user, schedule_id)
+            self.spans.pop(eq_id, None)
+            self._frames.pop(eq_id, None)
+            self._frame = None
+        for eq_id in eq_ids:
+            current = schedules.get(eq_id, [])
+            if not current:
+                continue
+            for s in current:
+                self.rows[s.schedule_id] = (eq_id, s)
+                self.keys[s.schedule_id] = (s.status, s.user.lower())
+                self.by_status.setdefault(s.status, set()).add(s.schedule_id)
+                self.by_user.setdefault(s.user.lower(), set()).add(s.schedule_id)
+            self.by_equipment[eq_id] = {s.schedule_id for s in current}
+            self.spans[eq_id] = IntervalIndex((s.start_date, last_end(s), s.schedule_id) for s in current)
+
+    @staticmethod
+    def _discard(index, key, schedule_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(schedule_id)
+            if not ids:
+                del index[key]
+
+    def get(self, schedule_id):
+        """(equipment ID, Schedule) for `schedule_id`, or None."""
+        return self.rows.get(schedule_id)
+
+    def users(self):
+        return sorted({s.user for _, s in self.rows.values() if s.user})
+
+    def overlapping(self, start, end, eq_ids=None):
+        """Ids of schedules with a day (or, if recurring, an occurrence) within [start, end]."""
+        found = set()
+        for eq_id in self.spans if eq_ids is None else eq_ids:
+            index = self.spans.get(eq_id)
+            if index is None:
+                continue
+            for _, _, schedule_id in index.overlapping(start, end):
+                s = self.rows[schedule_id][1]
+                if s.recurrence is None or next(occurrences(s, start, end), None) is not None:
+                    found.add(schedule_id)
+        return found
+
+    def query(self, status=None, eq_id=None, user=None, start=None, end=None):
+        """Ids matching every given filter, or None when no filter is set.
+
+        `user` matches case-insensitively anywhere in the name, and the
+        date filter keeps schedules overlapping [start, end].
+        """
+        matches = []
+        if status:
+            matches.append(self.by_status.get(status, set()))
+        if eq_id:
+            matches.append(self.by_equipment.get(eq_id, set()))
+        if user:
+            needle = user.lower()
+            matches.append(set().union(*(ids for name, ids in self.by_user.items() if needle in name)))
+        if start is not None:
+            matches.append(self.overlapping(start, end or start, [eq_id] if eq_id else None))
+        if not matches:
+            return None
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
+
+    def frame(self, ids=None):
+        """Display rows (index: schedule id) for `ids`, in equipment order; all rows when None."""
+        if self._frame is None:
+            parts = [self._equipment_frame(eq_id) for eq_id in sorted(self.by_equipment)]
+            self._frame = pd.concat(parts) if parts else pd.DataFrame(columns=SCHEDULE_TABLE_COLUMNS)
+        if ids is None:
+            return self._frame
+        return self._frame[self._frame.index.isin(ids)]
+
+    def _equipment_frame(self, eq_id):
+        if eq_id not in self._frames:
+            current = [self.rows[schedule_id][1] for schedule_id in self.by_equipment[eq_id]]
+            current.sort(key=lambda s: (s.start_date, s.test_id))
+            self._frames[eq_id] = pd.DataFrame({
+                'Equipment': eq_id,
+                'Test ID': [s.test_id for s in current],
+                'User': [s.user for s in current],
+                'Start Date': [s.start_date for s in current],
+                'End Date': [s.end_date for s in current],
+                'Status': [s.status for s in current],
+                'Load %': [s.load_percentage for s in current],
+                'Repeats': [s.recurrence.describe() if s.recurrence else "" for s in current],
+                'Created': [s.created_at.strftime("%Y-%m-%d %H:%M") if s.created_at else "N/A" for s in current],
+            }, index=pd.Index([s.schedule_id for s in current], name='schedule_id'))
+        return self._frames[eq_id]
+
+    def label(self, schedule_id):
+        eq_id, s = self.rows[schedule_id]
+        return f"{eq_id} - {s.test_id} - {s.user} - {s.start_date} to {s.end_date}"
+
+# -------------- Search Index -----------------
+# Inverted index from search terms to equipment, schedules and archived
+# tests, with a trigram index over the terms so misspelled or partial
+# queries still find them. Live equipment and schedules are indexed per
+# session and kept current by save_app_state(); the archive is indexed once
+# per process and only reads the rows added since its last search.
+SEARCH_TOKEN = re.compile(r"[^\s,;|/()]+")
+SEARCH_MIN_OVERLAP = 0.5  # share of a query term's trigrams a fuzzy match needs
+SEARCH_RESULTS = 8
+SEARCH_TERMS = 200  # closest indexed terms scored per query term
+SEARCH_SCAN = 20000  # largest trigram posting scanned for candidate terms
+
+@lru_cache(maxsize=65536)
+def trigrams(term):
+    padded = f"  {term} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def search_terms(text):
+    """Lower-cased words of `text`, plus the alphanumeric parts of compound ones (TS-2024-001)."""
+    terms = set()
+    for word in SEARCH_TOKEN.findall(str(text).lower()):
+        terms.add(word)
+        parts = re.findall(r"\w+", word)
+        if parts != [word]:
+            terms.update(parts)
+    return terms
+
+def search_value(value):
+    return f"{value:g}" if isinstance(value, (int, float)) else str(value)
+
+class SearchIndex:
+    """`postings[term]` maps document slots to the weight of the field the term is in.
+
+    Every document holds a dense integer slot (reused after removal), so a
+    query scores all documents at once in NumPy arrays; each term's postings
+    are turned into arrays the first time a query needs them after a change.
+    `grams[trigram]` holds the terms containing that trigram. A query term
+    that is not itself indexed matches terms it is a prefix or substring of,
+    or fuzzily ones sharing at least SEARCH_MIN_OVERLAP of its trigrams;
+    candidates are drawn only from the rarest trigram postings such a match
+    must appear in.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.grams = {}
+        self.slots = {}  # key -> slot
+        self.docs = []  # slot -> (key, terms, info), None when free
+        self.free = []
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, key, fields, info=None):
+        """Index `key` from (text, weight) fields; `info` is kept for showing the result."""
+        self.remove(key)
+        weights = {}
+        for text, weight in fields:
+            for term in search_terms(text):
+                if weight > weights.get(term, 0):
+                    weights[term] = weight
+        slot = self.free.pop() if self.free else len(self.docs)
+        if slot == len(self.docs):
+            self.docs.append(None)
+        for term, weight in weights.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                for gram in trigrams(term):
+                    self.grams.setdefault(gram, set()).add(term)
+            docs[slot] = weight
+            self._arrays.pop(term, None)
+        self.slots[key] = slot
+        self.docs[slot] = (key, tuple(weights), info)
+
+    def remove(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        for term in self.docs[slot][1]:
+            docs = self.postings[term]
+            del docs[slot]
+            self._arrays.pop(term, None)
+            if not docs:
+                del self.postings[term]
+                for gram in trigrams(term):
+                    terms = self.grams[gram]
+                    terms.discard(term)
+                    if not terms:
+                        del self.grams[gram]
+        self.docs[slot] = None
+        self.free.append(slot)
+
+    def matches(self, token):
+        """{term: score} for the (at most SEARCH_TERMS) indexed terms closest to `token`."""
+        if token in self.postings:
+            # An exact term (a full test ID, say) is not widened to its look-alikes
+            return {token: 1.0}
+        grams = trigrams(token)
+        need = max(1, math.ceil(len(grams) * SEARCH_MIN_OVERLAP))
+        postings = sorted((self.grams.get(gram, ()) for gram in grams), key=len)
+        rarest = len(grams) - need + 1
+        counts = Counter()
+        for terms in postings[:rarest]:
+            # Trigrams nearly every term has ("  a") would cost more than they narrow
+            if len(terms) <= SEARCH_SCAN:
+                counts.update(terms)
+        found = {}
+        for term, shared in counts.items():
+            if term == token:
+                found[term] = 1.0
+            elif term.startswith(token):
+                found[term] = 0.9
+            elif token in term:
+                found[term] = 0.8
+            else:
+                shared += sum(term in terms for terms in postings[rarest:])
+                if shared >= need:
+                    # A term of n characters has at most n + 1 padded trigrams
+                    found[term] = 0.7 * 2 * shared / (len(grams) + len(term) + 1)
+        if len(found) > SEARCH_TERMS:
+            found = dict(heapq.nlargest(SEARCH_TERMS, found.items(), key=lambda item: item[1]))
+        return found
+
+    def term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            docs = self.postings[term]
+            arrays = self._arrays[term] = (np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+                                           np.fromiter(docs.values(), dtype=np.float64, count=len(docs)))
+        return arrays
+
+    def search(self, query, limit=SEARCH_RESULTS):
+        """Best documents for `query` as (rank, key, info); rank is (query terms matched, score)."""
+        size = len(self.docs)
+        scores = np.zeros(size)
+        matched = np.zeros(size, dtype=np.int64)
+        tokens = dict.fromkeys(SEARCH_TOKEN.findall(query.lower()))
+        for token in tokens:
+            best = np.zeros(size)
+            for term, score in self.matches(token).items():
+                slots, weights = self.term_arrays(term)
+                best[slots] = np.maximum(best[slots], score * weights)
+            scores += best
+            matched += best > 0
+        hits = np.flatnonzero(scores)
+        # A score is at most 3 per query term, so this orders by matched terms first
+        rank = matched[hits] * (3.0 * len(tokens) + 1) + scores[hits]
+        if limit and len(hits) > limit:
+            top = np.argpartition(-rank, limit - 1)[:limit]
+            hits, rank = hits[top], rank[top]
+        order = np.argsort(-rank, kind='stable')
+        return [((int(matched[slot]), float(scores[slot])), self.docs[slot][0], self.docs[slot][2])
+                for slot in hits[order]]
+
+def test_search_fields(eq_id, test_id, user, description, test_parameters):
+    fields = [(test_id, 3), (user, 2), (description, 1), (eq_id, 1)]
+    fields.extend((search_value(v), 1) for v in test_parameters.values())
+    return fields
+
+class LiveSearchIndex(SearchIndex):
+    """Equipment and schedules of this session, re-indexed per touched equipment."""
+
+    def __init__(self, equipment_data=None, schedules=None):
+        super().__init__()
+        self.owned = {}  # eq_id -> schedule ids indexed for it
+        if equipment_data is not None:
+            self.update(equipment_data, schedules, set(equipment_data) | set(schedules))
+
+    def update(self, equipment_data, schedules, eq_ids):
+        # All removals go first, as in ScheduleIndex.update()
+        for eq_id in eq_ids:
+            self.remove(('equipment', eq_id))
+            for schedule_id in self.owned.pop(eq_id, ()):
+                self.remove(('schedule', schedule_id))
+        for eq_id in eq_ids:
+            eq = equipment_data.get(eq_id)
+            if eq is not None:
+                fields = [(eq_id, 3), (eq.name, 2), (eq.location, 1), (eq.type.replace('_', ' '), 1)]
+                fields.extend((search_value(v), 1) for v in eq.parameters.values())
+                self.add(('equipment', eq_id), fields, eq_id)
+            current = schedules.get(eq_id, [])
+            for s in current:
+                self.add(('schedule', s.schedule_id),
+                         test_search_fields(eq_id, s.test_id, s.user, s.description, s.test_parameters), eq_id)
+            if current:
+                self.owned[eq_id] = [s.schedule_id for s in current]
+
+class ArchiveSearchIndex(SearchIndex):
+    """Archived tests of the local store, shared by every session of the process.
+
+    The first pass over the archive runs in the background; until it is
+    done, searches return no archive results rather than wait for it.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.lock = threading.Lock()
+        self.last_rowid = 0
+
+    def catch_up(self):
+        """Index the archive rows added since the last call (call with the lock held)."""
+        for rowid, month, line in self.store.archive_since(self.last_rowid):
+            eq_id, test_id, user = line.get('equipment_id', ''), line.get('test_id', ''), line.get('user', '')
+            fields = test_search_fields(eq_id, test_id, user, line.get('description', ''),
+                                        line.get('test_parameters') or {})
+            self.add(('archive', line['schedule_id']), fields, (eq_id, test_id, user, month))
+            self.last_rowid = rowid
+
+    def warm(self):
+        with self.lock:
+            self.catch_up()
+
+    def search(self, query, limit=SEARCH_RESULTS):
+        if not self.lock.acquire(blocking=False):
+            return []
+        try:
+            self.catch_up()
+            return super().search(query, limit)
+        finally:
+            self.lock.release()
+
+@st.cache_resource
+def get_archive_search():
+    index = ArchiveSearchIndex(get_state_store())
+    threading.Thread(target=index.warm, name="ltcms-archive-search", daemon=True).start()
+    return index
+
+def search_everything(query, limit=SEARCH_RESULTS):
+    """Live and archived matches for `query`, best first."""
+    hits = st.session_state.search_index.search(query, limit) + get_archive_search().search(query, limit)
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    return hits[:limit]
+
+def search_equipment_ids(query):
+    """Equipment whose own fields or schedules match every term of `query`."""
+    wanted = len(set(SEARCH_TOKEN.findall(query.lower())))
+    return {info for (matched, _), _, info in st.session_state.search_index.search(query, limit=None)
+            if matched == wanted}
+
+# -------------- Dashboard Aggregates -----------------
+# The numbers the sidebar and summary cards show are kept per equipment and
+# per group and only recomputed for the equipment a save actually touched.
+# `version` changes with every state change, so anything derived from the
+# aggregates (like the utilization figure) can be memoized on it.
+@dataclass(slots=True)
+class EquipmentSummary:
+    type: str
+    status: str
+    load_percentage: int
+    active_tests: int
+    completed_tests: int
+    next_start: Optional[date]
+
+@dataclass(slots=True)
+class GroupSummary:
+    equipment: int = 0
+    active_tests: int = 0
+    completed_tests: int = 0
+    load_total: int = 0
+    status_counts: dict = field(default_factory=dict)
+
+    def add(self, summary, sign=1):
+        self.equipment += sign
+        self.active_tests += sign * summary.active_tests
+        self.completed_tests += sign * summary.completed_tests
+        self.load_total += sign * summary.load_percentage
+        self.status_counts[summary.status] = self.status_counts.get(summary.status, 0) + sign
+
+def summarize_equipment(eq, schedules):
+    upcoming = [s.start_date for s in schedules if s.status in ('Scheduled', 'In Progress') and s.recurrence is None]
+    upcoming += [o.start_date for o in map(next_occurrence, (s for s in schedules if s.recurrence)) if o]
+    completed = sum(1 for s in schedules if s.status == 'Completed')
+    return EquipmentSummary(
+        type=eq.type,
+        status=eq.status,
+        load_percentage=eq.load_percentage,
+        active_tests=len(schedules) - completed,
+        completed_tests=completed,
+        next_start=min(upcoming) if upcoming else None,
+    )
+
+class DashboardAggregates:
+    """Per-equipment summaries and per-group totals ('ALL' plus each type)."""
+
+    def __init__(self):
+        self.version = 0
+        self.equipment = {}
+        self.groups = {}
+        self.owners = {}  # schedule_id -> equipment ID
+        self._figure = None
+        self._figure_version = None
+
+    def group(self, name):
+        return self.groups.get(name) or GroupSummary()
+
+    def rebuild(self, equipment_data, schedules):
+        self.equipment.clear()
+        self.groups.clear()
+        self.owners.clear()
+        self.update(equipment_data, schedules, list(equipment_data))
+
+    def update(self, equipment_data, schedules, eq_ids):
+        """Recompute the given equipment and adjust their groups' totals."""
+        self.version += 1
+        for eq_id in eq_ids:
+            old = self.equipment.pop(eq_id, None)
+            if old is not None:
+                for name in ('ALL', old.type):
+                    self.groups[name].add(old, -1)
+            if eq_id not in equipment_data:
+                continue
+            items = schedules.get(eq_id, [])
+            summary = summarize_equipment(equipment_data[eq_id], items)
+            self.equipment[eq_id] = summary
+            for name in ('ALL', summary.type):
+                self.groups.setdefault(name, GroupSummary()).add(summary)
+            for s in items:
+                self.owners[s.schedule_id] = eq_id
+
+    def touched(self, rows, base, digests):
+        """Equipment IDs whose equipment or schedule rows differ from `base`."""
+        eq_ids = set()
+        for key, digest in digests.items():
+            if base.get(key) == digest or key[0] == 'waitlist':
+                continue
+            if key[0] in ('equipment', 'schedule_order'):
+                eq_ids.add(key[1])
+            else:
+                # A schedule may also have moved away from its old equipment
+                eq_ids.add(rows[key][1])
+                eq_ids.add(self.owners.get(key[1]))
+        for key in base:
+            if key not in digests and key[0] != 'waitlist':
+                eq_ids.add(key[1] if key[0] in ('equipment', 'schedule_order') else self.owners.pop(key[1], None))
+        eq_ids.discard(None)
+        return eq_ids
+
+    def utilization_figure(self, equipment_data):
+        """The sidebar utilization bar chart, rebuilt only when the version changes."""
+        if self._figure_version != self.version:
+            # Equipment the aggregates have not caught up with yet is left out
+            shown = [(eq, self.equipment.get(eq)) for eq in equipment_data]
+            equipment_names = [eq for eq, summary in shown if summary is not None]
+            utilizations = [summary.load_percentage for _, summary in shown if summary is not None]
+            fig = px.bar(x=equipment_names, y=utilizations,
+                         title="Equipment Utilization %", color=utilizations,
+                         color_continuous_scale="RdYlGn_r")
+            fig.update_layout(height=300, showlegend=False)
+            self._figure = fig
+            self._figure_version = self.version
+        return self._figure
+
+# -------------- Utilization Forecast -----------------
+# Booked load of every equipment item for each of the coming weeks, as an
+# equipment x day matrix so lab-wide planning questions are array reductions.
+FORECAST_WEEKS = [4, 8, 12]
+FORECAST_DAYS = 7 * max(FORECAST_WEEKS)
+BOTTLENECK_LOAD = 90  # days at or above this load count towards a bottleneck
+
+class UtilizationForecast:
+    """`matrix[row, day]` is the booked load of `eq_ids[row]` on `origin + day`.
+
+    Rows are filled with a difference array (+load at a test's first day,
+    -load after its last, cumulative sum along the days) and save_app_state()
+    refills only the rows of the equipment a save touched. The matrix is
+    rebuilt when equipment is added or removed or the date rolls over.
+    """
+
+    def __init__(self, days=FORECAST_DAYS):
+        self.days = days
+        self.version = 0
+        self.origin = None
+        self.eq_ids = []
+        self.rows = {}
+        self.types = np.array([], dtype=object)
+        self.available = np.array([], dtype=bool)
+        self.matrix = np.zeros((0, days), dtype=np.int32)
+
+    def rebuild(self, equipment_data, schedules, today=None):
+        self.origin = today or date.today()
+        self.eq_ids = sorted(equipment_data)
+        self.rows = {eq_id: i for i, eq_id in enumerate(self.eq_ids)}
+        self.types = np.array([equipment_data[eq_id].type for eq_id in self.eq_ids], dtype=object)
+        # Equipment in maintenance has no capacity to offer
+        self.available = np.array([equipment_data[eq_id].status != 'Maintenance' for eq_id in self.eq_ids], dtype=bool)
+        self.matrix = self._fill(self.eq_ids, schedules)
+        self.version += 1
+
+    def update(self, equipment_data, schedules, eq_ids, today=None):
+        today = today or date.today()
+        if today != self.origin or set(equipment_data) != set(self.rows):
+            self.rebuild(equipment_data, schedules, today)
+            return
+        eq_ids = [eq_id for eq_id in eq_ids if eq_id in self.rows]
+        if not eq_ids:
+            return
+        rows = [self.rows[eq_id] for eq_id in eq_ids]
+        self.matrix[rows] = self._fill(eq_ids, schedules)
+        self.types[rows] = [equipment_data[eq_id].type for eq_id in eq_ids]
+        self.available[rows] = [equipment_data[eq_id].status != 'Maintenance' for eq_id in eq_ids]
+        self.version += 1
+
+    def _fill(self, eq_ids, schedules):
+        last = self.origin + timedelta(days=self.days - 1)
+        booked = [(row, o.start_date, o.end_date, o.load_percentage)
+                  for row, eq_id in enumerate(eq_ids)
+                  for s in schedules.get(eq_id, [])
+                  for o in occurrences(s, self.origin, last) if o.status in BOOKED_STATUSES]
+        diff = np.zeros((len(eq_ids), self.days + 1), dtype=np.int32)
+        if booked:
+            rows, starts, ends, loads = zip(*booked)
+            rows, loads = np.array(rows), np.array(loads, dtype=np.int32)
+            origin = np.datetime64(self.origin, 'D')
+            first = np.clip((np.array(starts, dtype='datetime64[D]') - origin).astype(int), 0, self.days)
+            after = np.clip((np.array(ends, dtype='datetime64[D]') - origin).astype(int) + 1, 0, self.days)
+            inside = first < after
+            np.add.at(diff, (rows[inside], first[inside]), loads[inside])
+            np.add.at(diff, (rows[inside], after[inside]), -loads[inside])
+        return np.cumsum(diff[:, :-1], axis=1)
+
+    def dates(self, weeks):
+        return pd.date_range(self.origin, periods=7 * weeks, freq='D')
+
+    def group_curves(self, weeks):
+        """Mean daily load of each group's available equipment (columns: 'ALL' and each type)."""
+        window = self.matrix[:, :7 * weeks]
+        curves = {}
+        for name in ['ALL'] + sorted(set(self.types)):
+            mask = self.available if name == 'ALL' else self.available & (self.types == name)
+            if mask.any():
+                curves[name] = window[mask].mean(axis=0)
+        return pd.DataFrame(curves, index=self.dates(weeks))
+
+    def free_capacity(self, weeks):
+        """Unbooked equipment-days per group (a day at 40% leaves 0.6)."""
+        free = (100 - np.clip(self.matrix[:, :7 * weeks], 0, 100)).sum(axis=1) / 100
+        free = np.where(self.available, free, 0)
+        totals = {'ALL': float(free.sum())}
+        for name in sorted(set(self.types)):
+            totals[name] = float(free[self.types == name].sum())
+        return totals
+
+    def bottlenecks(self, weeks, threshold=BOTTLENECK_LOAD):
+        """Equipment with days at or above `threshold`, most such days first."""
+        window = self.matrix[:, :7 * weeks]
+        hot = window >= threshold
+        days = hot.sum(axis=1)
+        rows = np.flatnonzero(days)
+        first = hot.argmax(axis=1)
+        out = pd.DataFrame({
+            'Equipment': [self.eq_ids[r] for r in rows],
+            'Type': self.types[rows],
+            f'Days ≥ {threshold}%': days[rows],
+            'First Day': [self.origin + timedelta(days=int(first[r])) for r in rows],
+            'Peak Load %': window[rows].max(axis=1),
+            'Average Load %': window[rows].mean(axis=1).round(1),
+        })
+        return out.sort_values([f'Days ≥ {threshold}%', 'Peak Load %'], ascending=False, ignore_index=True)
+
+# -------------- Batch Scheduling -----------------
+# A queue of test requests is placed by auto_scheduler.plan_batch() on every
+# equipment item of each request's type, previewed, and committed in one save.
+BATCH_BUDGETS = [0, 1, 2, 5, 10]  # seconds for the plan's improvement pass
+
+def batch_machines(eq_types, today=None):
+    """Equipment of the given types (not in maintenance) with their bookings from today on."""
+    today = today or date.today()
+    index = st.session_state.schedule_index
+    machines = []
+    for eq_id, eq in st.session_state.equipment_data.items():
+        if eq.type not in eq_types or eq.status == 'Maintenance':
+            continue
+        units = ALLOCATED_UNITS.get(eq.type)
+        kind = units[0] if units else None
+        bookings = [(s.start_date, s.end_date, s.load_percentage, units_mask(getattr(s, kind)) if kind else 0)
+                    for s in index.overlapping(eq_id, today, date.max)]
+        capacity = (getattr(eq, kind) or units[2]) if units else 0
+        machines.append(Machine(eq_id, eq.type, capacity, bookings))
+    return machines
+
+def commit_batch_plan(plan, rows):
+    """Add a Schedule for every placement of `plan`; `rows` maps request ids to the form rows.
+
+    Placements are re-checked against the current bookings plus the plan's
+    earlier placements first, since other sessions may have booked the same
+    days after the preview. Returns the placements that no longer fit
+    (nothing is saved then).
+    """
+    index = st.session_state.schedule_index
+    stale = []
+    placed = {}  # eq_id -> [(start, end, load, units)] of the placements checked so far
+    for p in plan.placements:
+        eq = st.session_state.equipment_data.get(p.eq_id)
+        if eq is None:
+            stale.append(p)
+            continue
+        row = rows[p.request_id]
+        units = ALLOCATED_UNITS.get(eq.type)
+        earlier = [q for q in placed.get(p.eq_id, []) if q[0] <= p.end and q[1] >= p.start]
+        intervals = [(max(s.start_date, p.start), min(s.end_date, p.end), s.load_percentage)
+                     for s in index.overlapping(p.eq_id, p.start, p.end)]
+        intervals += [(max(a, p.start), min(b, p.end), load) for a, b, load, _ in earlier]
+        intervals.append((p.start, p.end, row['load']))
+        taken = {n for _, _, _, q_units in earlier for n in q_units}
+        if max((level for _, level in sweep_load(intervals)), default=0) > 100:
+            stale.append(p)
+        elif units and not set(p.units) <= set(index.free_units(
+                p.eq_id, p.start, p.end, units[0], getattr(eq, units[0]) or units[2])) - taken:
+            stale.append(p)
+        placed.setdefault(p.eq_id, []).append((p.start, p.end, row['load'], p.units or ()))
+    if stale:
+        return stale
+    created_at = datetime.now()
+    booked = []
+    for p in plan.placements:
+        row = rows[p.request_id]
+        eq = st.session_state.equipment_data[p.eq_id]
+        schedule = Schedule(
+            schedule_id=str(uuid.uuid4()),
+            test_id=row['test_id'],
+            user=row['user'],
+            start_date=p.start,
+            end_date=p.end,
+            load_percentage=row['load'],
+            priority=row['priority'],
+            description=row['description'],
+            test_parameters=dict(EQUIPMENT_GROUPS[eq.type].get('defaults', {})),
+            status='Scheduled',
+            created_at=created_at,
+        )
+        units = ALLOCATED_UNITS.get(eq.type)
+        if units:
+            setattr(schedule, units[0], p.units)
+        booked.append((p.eq_id, schedule))
+    book_schedules(booked)
+    return []
+
+def book_schedules(booked):
+    """Add (equipment ID, Schedule) pairs to the state and save once."""
+    eq_ids = set()
+    for eq_id, schedule in booked:
+        st.session_state.schedules.setdefault(eq_id, []).append(schedule)
+        eq_ids.add(eq_id)
+    for eq_id in eq_ids:
+        eq = st.session_state.equipment_data[eq_id]
+        eq.load_percentage = concurrent_load(st.session_state.schedules[eq_id])
+        if eq.status not in ['Running', 'Maintenance']:
+            eq.status = 'Scheduled'
+    save_app_state()
+
+# -------------- Waitlist -----------------
+# Tests that found no room wait per equipment type, best priority first and
+# then oldest. When a booked test completes, is cancelled or is deleted, the
+# waiting tests of that equipment's type are offered the days it gave up and
+# every one that fits is booked.
+WAITLIST_RANK = {'Critical': 0, 'High': 1, 'Medium': 2, 'Low': 3}
+
+class Waitlist:
+    """Waiting entries by id, plus a heap of (rank, created_at, entry_id) per equipment type.
+
+    Removal is lazy: heap items whose entry is gone are skipped and dropped
+    when they reach the top.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = {}
+        self.heaps = {}
+        for entry in entries:
+            self.push(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, entry):
+        self.entries[entry.entry_id] = entry
+        heapq.heappush(self.heaps.setdefault(entry.eq_type, []),
+                       (WAITLIST_RANK.get(entry.priority, 2), entry.created_at or datetime.min, entry.entry_id))
 
-    else:
-        st.error(f"Failed to load state from GitHub: {r.status_code} - {r.text}")
-        return {}
+    def remove(self, entry_id):
+        return self.entries.pop(entry_id, None)
 
-def save_app_state():
-    # make a deep copy so we don't mutate session state
-    save_state = {
-        'equipment_data': copy.deepcopy(st.session_state.equipment_data),
-        'schedules': copy.deepcopy(st.session_state.schedules)
-    }
-    # convert dates to strings in the copy only
-    for eq_id, schedules in save_state['schedules'].items():
-        for s in schedules:
-            for field in ("start_date", "end_date"):
-                val = s.get(field)
-                if isinstance(val, (date, datetime)):
-                    s[field] = val.strftime("%Y-%m-%d")
-            # also convert created_at if present
-            if isinstance(s.get('created_at'), datetime):
-                s['created_at'] = s['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-    # Serialize to JSON
-    new_content = json.dumps(save_state, indent=2, default=str)
-    # Get the current sha of the file on GitHub (required by GitHub API)
-    url = f"https://api.github.com/repos/{REPO}/contents/{FILE_PATH}?ref={BRANCH}"
-    headers = {"Authorization": f"token {TOKEN}"}
-    r = requests.get(url, headers=headers)
-    if r.status_code == 200:
-        sha = r.json().get("sha")
-        if not sha:
-            st.error("Could not get file sha for updating state on GitHub.")
-            return
-        data = {
-            "message": "Update LTCMS state from Streamlit app",
-            "content": base64.b64encode(new_content.encode("utf-8")).decode("utf-8"),
-            "branch": BRANCH,
-            "sha": sha
-        }
-        r_put = requests.put(url, headers=headers, data=json.dumps(data))
-        if r_put.status_code not in (200, 201):
-            st.error(f"Error saving state file to GitHub: {r_put.status_code} - {r_put.text}")
-    else:
-        st.error(f"Failed to get current file sha from GitHub: {r.status_code} - {r.text}")
-
-# CHANGE #5 - Automated Backup on Friday
-def backup_json_file():
-    today = datetime.now()
-    # 4 is Friday (Monday=0)
-    if today.weekday() == 4:
-        # Download the raw file from the repo
-        url = f"https://raw.githubusercontent.com/{REPO}/{BRANCH}/{FILE_PATH}"
-        r = requests.get(url)
-        if r.status_code == 200:
-            backup_file = f"ltcms_state_{today.strftime('%Y%m%d')}.json"
-            # Push to GitHub as backup
-            url_api = f"https://api.github.com/repos/{REPO}/contents/{backup_file}?ref={BRANCH}"
-            headers = {"Authorization": f"token {TOKEN}"}
-            r_api = requests.get(url_api, headers=headers)
-            sha = None
-            if r_api.status_code == 200:
-                sha = r_api.json().get("sha")
-            data = {
-                "message": f"Automated weekly backup {today.strftime('%Y-%m-%d')}",
-                "content": base64.b64encode(r.content).decode("utf-8"),
-                "branch": BRANCH
-            }
-            if sha:
-                data["sha"] = sha
-            put_r = requests.put(url_api, headers=headers, data=json.dumps(data))
-            if put_r.status_code not in (200, 201):
-                st.error(f"Error creating backup file: {put_r.status_code} - {put_r.text}")
-
-# Early on, run backup in each session (idempotent unless new commits are made)
-backup_json_file()
+    def waiting(self, eq_type):
+        """Yield the entries waiting for `eq_type`, best first, leaving the heap as it is."""
+        heap = self.heaps.get(eq_type, [])
+        while heap and heap[0][2] not in self.entries:
+            heapq.heappop(heap)
+        candidates = list(heap)
+        while candidates:
+            _, _, entry_id = heapq.heappop(candidates)
+            if entry_id in self.entries:
+                yield self.entries[entry_id]
+
+def waitlist_fit(entry, eq_id, first, last):
+    """(start, units) of the first start in [first, last] where `entry` fits on `eq_id`, or None."""
+    eq = st.session_state.equipment_data[eq_id]
+    index = st.session_state.schedule_index
+    units = ALLOCATED_UNITS.get(eq.type)
+    day = max(first, entry.earliest or first)
+    while day <= last:
+        end = day + timedelta(days=entry.duration - 1)
+        if index.peak_load(eq_id, day, end, extra=entry.load_percentage)[0] <= 100:
+            if not units:
+                return day, None
+            chosen = index.assign_units(eq_id, day, end, units[0], getattr(eq, units[0]) or units[2], max(entry.units, 1))
+            if chosen:
+                return day, chosen
+        day += timedelta(days=1)
+    return None
+
+def promote_waitlist(freed, today=None):
+    """Book waiting tests into the days that `freed` (equipment ID, schedule) pairs gave up.
+
+    Call after the freed schedules are saved out of the bookings. Returns
+    the promotion messages, which are also queued for the dashboard.
+    """
+    today = today or date.today()
+    waitlist = st.session_state.waitlist
+    messages = []
+    for eq_id, schedule in freed:
+        eq = st.session_state.equipment_data.get(eq_id)
+        if not waitlist or eq is None or eq.status == 'Maintenance':
+            continue
+        window = next_occurrence(replace(schedule, status='Scheduled'), today) if schedule.recurrence else schedule
+        if window is None or window.end_date < today:
+            continue
+        for entry in list(waitlist.waiting(eq.type)):
+            fit = waitlist_fit(entry, eq_id, max(window.start_date, today), window.end_date)
+            if fit is None:
+                continue
+            start, units = fit
+            promoted = Schedule(
+                schedule_id=str(uuid.uuid4()),
+                test_id=entry.test_id,
+                user=entry.user,
+                start_date=start,
+                end_date=start + timedelta(days=entry.duration - 1),
+                load_percentage=entry.load_percentage,
+                priority=entry.priority,
+                description=entry.description,
+                test_parameters=entry.test_parameters,
+                status='Scheduled',
+                created_at=datetime.now(),
+            )
+            if units:
+                setattr(promoted, ALLOCATED_UNITS[eq.type][0], units)
+            waitlist.remove(entry.entry_id)
+            # Saved one at a time so the next entry is checked against this booking
+            book_schedules([(eq_id, promoted)])
+            messages.append(f"⏳ {entry.test_id} ({entry.priority}) was promoted from the waitlist to {eq_id}, "
+                            f"{promoted.start_date:%Y-%m-%d} to {promoted.end_date:%Y-%m-%d}.")
+    if messages:
+        st.session_state.waitlist_notification = st.session_state.get('waitlist_notification', []) + messages
+    return messages
 
 # -------------- Auto-cleanup completed tests -----------------
-def cleanup_completed_tests():
-    """Remove completed tests and update equipment load percentages"""
-    changes_made = False
+def cleanup_completed_tests(today=None):
+    """Move completed and cancelled tests to the archive and update equipment load percentages"""
+    today = today or date.today()
+    archived = []
+    freed = []
+    archived_at = datetime.now()
     for eq_id in list(st.session_state.schedules.keys()):
         schedules = st.session_state.schedules[eq_id]
-        original_count = len(schedules)
-        
-        # Remove completed tests
-        st.session_state.schedules[eq_id] = [s for s in schedules if s.get('status') != 'Completed']
-        
-        if len(st.session_state.schedules[eq_id]) != original_count:
-            changes_made = True
+        # Occurrences are completed one by one as exceptions, so a series is
+        # never marked Completed by hand; it is done once its last one has run
+        elapsed = [s for s in schedules
+                   if s.recurrence and s.status in BOOKED_STATUSES and last_end(s) < today]
+        for s in elapsed:
+            s.status = 'Completed'
+        finished = [s for s in schedules if s.status in ARCHIVED_STATUSES]
+
+        if finished:
+            archived.extend(archive_lines(eq_id, finished, archived_at))
+            # An elapsed series ran its course and frees no days
+            freed.extend((eq_id, s) for s in finished if s not in elapsed)
+            st.session_state.schedules[eq_id] = [s for s in schedules if s.status not in ARCHIVED_STATUSES]
             
             # Recalculate load percentage
-            remaining_load = sum(s['load_percentage'] for s in st.session_state.schedules[eq_id])
-            st.session_state.equipment_data[eq_id]['load_percentage'] = remaining_load
+            st.session_state.equipment_data[eq_id].load_percentage = concurrent_load(st.session_state.schedules[eq_id])
             
             # Update equipment status if no active schedules
             if not st.session_state.schedules[eq_id]:
-                current_status = st.session_state.equipment_data[eq_id]['status']
+                current_status = st.session_state.equipment_data[eq_id].status
                 if current_status == 'Scheduled':
-                    st.session_state.equipment_data[eq_id]['status'] = 'Idle'
-    
-    if changes_made:
+                    st.session_state.equipment_data[eq_id].status = 'Idle'
+
+    if archived:
+        # Archive before saving: if the save fails the tests are still in the
+        # live state and are archived again (a no-op) on the next run
+        get_state_store().append_archive(archived)
+        save_app_state()
+        st.session_state.cleanup_notification = True
+        # Tests that ended early leave days the waitlist can use
+        promote_waitlist(freed)
+
+def refresh_equipment_loads():
+    """Set each equipment's load to what its tests running today add up to.
+
+    The stored load goes stale as days pass, so it is refreshed when a
+    session starts and on Refresh; only equipment whose load moved is saved.
+    """
+    changed = False
+    for eq_id, eq in st.session_state.equipment_data.items():
+        load = concurrent_load(st.session_state.schedules.get(eq_id, []))
+        if eq.load_percentage != load:
+            eq.load_percentage = load
+            changed = True
+    if changed:
         save_app_state()
 
 # -------------- Session State Initialization ---------------
@@ -287,27 +2870,30 @@ if 'app_state_loaded' not in st.session_state:
     loaded_state = load_app_state()
     st.session_state.equipment_data = loaded_state.get('equipment_data', {})
     st.session_state.schedules = loaded_state.get('schedules', {})
+    st.session_state.waitlist = Waitlist(loaded_state.get('waitlist', []))
+    st.session_state.aggregates = DashboardAggregates()
+    st.session_state.aggregates.rebuild(st.session_state.equipment_data, st.session_state.schedules)
+    st.session_state.schedule_index = ScheduleIndex(st.session_state.schedules)
+    st.session_state.schedule_table = ScheduleTable(st.session_state.schedules)
+    st.session_state.search_index = LiveSearchIndex(st.session_state.equipment_data, st.session_state.schedules)
+    get_archive_search()
+    st.session_state.forecast = UtilizationForecast()
+    st.session_state.forecast.rebuild(st.session_state.equipment_data, st.session_state.schedules)
     st.session_state.selected_group = 'ALL'
-    st.session_state.show_add_equipment = False
-    st.session_state.show_schedule_form = None
-    st.session_state.show_settings = None
-    st.session_state.show_test_status = False
-    st.session_state.show_edit_equipment = None
-    st.session_state.show_all_schedules = False
+    # Set by a dialog that wants the calendar opened after it closes
     st.session_state.show_calendar = None
     st.session_state.search_term = ""
+    # Equipment a search result jumped to; the grid shows only its card
+    st.session_state.grid_focus = None
+    st.session_state.grid_visible = 0
+    st.session_state.grid_view = None
     st.session_state.app_state_loaded = True
+    # Later runs only archive when a status change or Refresh asks for it
+    cleanup_completed_tests()
+    refresh_equipment_loads()
 
-cleanup_completed_tests()
-
-def reset_all_modals():
-    st.session_state.show_add_equipment = False
-    st.session_state.show_schedule_form = None
-    st.session_state.show_settings = None
-    st.session_state.show_test_status = False
-    st.session_state.show_edit_equipment = None
-    st.session_state.show_all_schedules = False
-    st.session_state.show_calendar = None
+# Cheap after the first session of the day: the service runs once per day
+get_backup_service().run()
 
 # -------------- Constants and Helpers ------------------------
 EQUIPMENT_GROUPS = {
@@ -357,6 +2943,11 @@ EQUIPMENT_GROUPS = {
 }
 
 TEST_STATUS_OPTIONS = ['Scheduled', 'In Progress', 'Completed', 'On Hold', 'Cancelled']
+PRIORITY_OPTIONS = ['Low', 'Medium', 'High', 'Critical']
+# Equipment grid paging: cards are built only for the visible page(s)
+GRID_PAGE_SIZES = [12, 24, 48, 96]
+GRID_SORT_OPTIONS = ['Order added', 'Equipment ID', 'Load (high to low)', 'Status', 'Next start date']
+GRID_STATUS_ORDER = {'Running': 0, 'Scheduled': 1, 'Maintenance': 2, 'Idle': 3}
 
 def get_parameter_display_name(param_name):
     param_names = {
@@ -396,55 +2987,111 @@ def get_parameter_unit(param_name):
     }
     return units.get(param_name, '')
 
-def create_mini_donut(load_percentage, size=60):
+# Accepted (min, max) of each test parameter, used to check imported plans
+PARAMETER_RANGES = {
+    'min_temperature': (-80, 200),
+    'max_temperature': (-80, 200),
+    'ambient_temperature': (-80, 300),
+    'relative_humidity': (0, 100),
+    'dwell_time': (0, 1440),
+    'num_cycles': (1, 1_000_000),
+    'amplitude_gs': (0, 100),
+    'frequency_hz': (1, 10_000),
+    'duration': (0, 10_000),
+    'num_axis': (1, 3),
+    'sweep_time': (0, 1440),
+    'num_plates': (1, 10),
+    'pulse_interval': (0, 100_000),
+    'pulse_current': (0, 100_000),
+    'pulse_width': (0, 1_000_000),
+}
+
+def load_band_color(load_percentage):
     if load_percentage >= 90:
-        color = '#dc3545'
-    elif load_percentage >= 70:
-        color = '#ffc107'
-    else:
-        color = '#28a745'
-    fig = go.Figure(data=[go.Pie(
-        labels=['Used', 'Available'],
-        values=[load_percentage, 100 - load_percentage],
-        hole=0.7,
-        marker_colors=[color, '#e9ecef'],
-        textinfo='none'
-    )])
-    fig.update_layout(
-        showlegend=False,
-        height=size,
-        width=size,
-        margin=dict(t=0, b=20, l=0, r=80),
-        annotations=[{
-            'text': f'<b>{load_percentage}%</b>',
-            'x': 0.5, 'y': 0.5,
-            'font_size': 7,
-            'showarrow': False
-        }]
+        return '#dc3545'
+    if load_percentage >= 70:
+        return '#ffc107'
+    return '#28a745'
+
+@lru_cache(maxsize=512)
+def _gauge_svg(load_percentage, color, size):
+    radius = size / 2 - 5
+    circumference = 2 * math.pi * radius
+    filled = circumference * load_percentage / 100
+    center = size / 2
+    # Single line: indented lines would be read as a Markdown code block
+    return (
+        f'<svg class="load-gauge" width="{size}" height="{size}" viewBox="0 0 {size} {size}" '
+        f'role="img" aria-label="Load {load_percentage}%">'
+        f'<circle cx="{center}" cy="{center}" r="{radius:.2f}" fill="none" stroke="#e9ecef" stroke-width="7"/>'
+        f'<circle cx="{center}" cy="{center}" r="{radius:.2f}" fill="none" stroke="{color}" stroke-width="7" '
+        f'stroke-dasharray="{filled:.2f} {circumference:.2f}" transform="rotate(-90 {center} {center})"/>'
+        f'<text x="50%" y="50%" dominant-baseline="central" text-anchor="middle" '
+        f'font-size="{size // 5}" font-weight="bold" fill="#333">{load_percentage}%</text>'
+        f'</svg>'
     )
-    return fig
+
+def load_gauge_svg(load_percentage, size=60):
+    """Inline SVG ring showing an equipment load, cached per percentage and color band."""
+    load_percentage = max(0, min(100, int(load_percentage)))
+    return _gauge_svg(load_percentage, load_band_color(load_percentage), size)
+
+def sort_equipment(items, sort_by):
+    """Order (eq_id, equipment) pairs for the grid; ties fall back to the ID.
+
+    'Order added' keeps the order of equipment_data.
+    """
+    if sort_by == 'Equipment ID':
+        return sorted(items, key=lambda item: item[0])
+    if sort_by == 'Load (high to low)':
+        return sorted(items, key=lambda item: (-item[1].load_percentage, item[0]))
+    if sort_by == 'Status':
+        return sorted(items, key=lambda item: (GRID_STATUS_ORDER.get(item[1].status, len(GRID_STATUS_ORDER)), item[0]))
+    if sort_by == 'Next start date':
+        # Equipment with nothing upcoming goes last
+        next_dates = {eq_id: get_next_scheduled_date(eq_id) for eq_id, _ in items}
+        return sorted(items, key=lambda item: (next_dates[item[0]] is None, next_dates[item[0]] or date.max, item[0]))
+    return items
+
+def select_group(group):
+    st.session_state.selected_group = group
+
+def show_more_equipment():
+    st.session_state.grid_visible += st.session_state.grid_page_size
+
+def focus_equipment(eq_id):
+    st.session_state.grid_focus = eq_id
+
+def clear_grid_focus():
+    st.session_state.grid_focus = None
+
+def render_search_results(query):
+    """Ranked sidebar search matches, each jumping to its card, test or archive month."""
+    hits = search_everything(query)
+    if not hits:
+        st.caption("No matches.")
+        return
+    for n, (_, key, info) in enumerate(hits):
+        if key[0] == 'equipment':
+            st.button(f"🏭 {info} - {st.session_state.equipment_data[info].name}", key=f"search_hit_{n}",
+                      on_click=focus_equipment, args=(info,), use_container_width=True)
+        elif key[0] == 'schedule':
+            found = st.session_state.schedule_table.get(key[1])
+            if found and st.button(f"📋 {found[1].test_id} ({found[1].user}) on {info}", key=f"search_hit_{n}",
+                                   use_container_width=True):
+                st.session_state.test_status_selectbox = key[1]
+                test_status_modal()
+        else:
+            eq_id, test_id, user, month = info
+            if st.button(f"📚 {test_id} ({user}) on {eq_id}, archived {month}", key=f"search_hit_{n}",
+                         use_container_width=True):
+                st.session_state.history_month = month
+                test_history_modal()
 
 def get_next_scheduled_date(equipment_id):
-    if equipment_id not in st.session_state.schedules:
-        return None
-    upcoming_dates = []
-    for schedule in st.session_state.schedules[equipment_id]:
-        if schedule['status'] in ['Scheduled', 'In Progress']:
-            upcoming_dates.append(schedule['start_date'])
-    return min(upcoming_dates) if upcoming_dates else None
-
-def parse_date(val):
-    # Accept date, pd.Timestamp, or string
-    if isinstance(val, date):
-        return val
-    if isinstance(val, datetime):
-        return val.date()
-    if isinstance(val, pd.Timestamp):
-        return val.to_pydatetime().date()
-    try:
-        return datetime.strptime(val, "%Y-%m-%d").date()
-    except Exception:
-        return date.today()
+    summary = st.session_state.aggregates.equipment.get(equipment_id)
+    return summary.next_start if summary else None
+
 # -------------- Modal: Add Equipment --------------------
 @st.dialog("Add New Equipment")
 def add_equipment_modal():
@@ -496,50 +3143,160 @@ def add_equipment_modal():
                 if equipment_id in st.session_state.equipment_data:
                     st.error("Equipment ID already exists!")
                 else:
-                    equipment_data = {
-                        'name': equipment_name,
-                        'type': equipment_type,
-                        'location': location,
-                        'status': status,
-                        'load_percentage': 0,
-                        'last_updated': datetime.now()
-                    }
+                    equipment_data = Equipment(
+                        name=equipment_name,
+                        type=equipment_type,
+                        location=location,
+                        status=status,
+                        load_percentage=0,
+                        last_updated=datetime.now()
+                    )
                     if equipment_type in EQUIPMENT_GROUPS and 'parameters' in EQUIPMENT_GROUPS[equipment_type]:
-                        equipment_data['parameters'] = params
+                        equipment_data.parameters = params
                     if equipment_type == 'PULSE_TESTER':
-                        equipment_data['channels'] = channels
+                        equipment_data.channels = channels
                     elif equipment_type == 'VIBRATION':
-                        equipment_data['plates'] = plates
+                        equipment_data.plates = plates
                     st.session_state.equipment_data[equipment_id] = equipment_data
                     save_app_state()
                     st.success(f"✅ Equipment {equipment_id} added successfully!")
-                    st.session_state.show_add_equipment = False
                     st.rerun()
             else:
                 st.error("Please fill in Equipment ID and Name")
     with col_cancel:
         if st.button("❌ Cancel", use_container_width=True):
-            st.session_state.show_add_equipment = False
             st.rerun()
 
+# -------------- Exports -----------------
+# Export files are written only when their download button is clicked
+# (Streamlit calls the data callable then, on its own thread), from chunks
+# of rows into a temporary file that spills to disk past EXPORT_SPOOL_BYTES,
+# so a long history is never a whole DataFrame plus its CSV text at once.
+# The finished file itself is still handed over as bytes: download_button
+# keeps whatever the callable returns in memory and cannot stream it.
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024
+ARCHIVE_COLUMNS = ['Equipment', 'Test ID', 'User', 'Start Date', 'End Date', 'Status',
+                   'Load %', 'Priority', 'Description', 'Archived']
+# Parquet column types; every other column is written as text. Fixed up front
+# so chunks whose values happen to infer differently share one schema.
+EXPORT_PARQUET_TYPES = {'Start Date': 'date32', 'End Date': 'date32', 'Load %': 'float64'}
+
+def frame_chunks(df, size=EXPORT_CHUNK_ROWS):
+    return (df.iloc[i:i + size] for i in range(0, len(df), size))
+
+def parquet_table(chunk, schema):
+    import pyarrow as pa
+    arrays = []
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_date32(field.type):
+            array = pa.array(pd.to_datetime(values, errors='coerce'), from_pandas=True).cast(field.type)
+        elif pa.types.is_floating(field.type):
+            array = pa.array(pd.to_numeric(values, errors='coerce'), type=field.type, from_pandas=True)
+        else:
+            array = pa.array(values.astype("string"), type=field.type, from_pandas=True)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_export(chunks, fmt, columns):
+    """Write the `columns` of DataFrame `chunks` as one `fmt` file and return its bytes."""
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as out:
+        if fmt == 'CSV':
+            text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+            header = True
+            for chunk in chunks:
+                chunk.to_csv(text, columns=columns, header=header, index=False)
+                header = False
+            if header:
+                text.write(pd.DataFrame(columns=columns).to_csv(index=False))
+            text.flush()
+            text.detach()
+        elif fmt == 'Parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = pa.schema([(column, getattr(pa, EXPORT_PARQUET_TYPES.get(column, 'string'))())
+                                for column in columns])
+            writer = pq.ParquetWriter(out, schema)
+            try:
+                for chunk in chunks:
+                    writer.write_table(parquet_table(chunk, schema))
+            finally:
+                writer.close()
+        else:
+            from openpyxl import Workbook
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("LTCMS")
+            sheet.append(columns)
+            for chunk in chunks:
+                for row in chunk[columns].itertuples(index=False, name=None):
+                    sheet.append(row)
+            workbook.save(out)
+        out.seek(0)
+        return out.read()
+
+def export_controls(key, columns, chunks, file_stem):
+    """Format and column pickers and a download button; `chunks()` runs only on click."""
+    col_format, col_columns = st.columns([1, 3])
+    with col_format:
+        fmt = st.selectbox("Format", list(EXPORT_FORMATS), key=f"{key}_format")
+    with col_columns:
+        chosen = st.multiselect("Columns", columns, default=columns, key=f"{key}_columns") or columns
+    extension, mime = EXPORT_FORMATS[fmt]
+    st.download_button(
+        f"📥 Export {fmt}",
+        data=lambda: write_export(chunks(), fmt, chosen),
+        file_name=f"{file_stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+        mime=mime,
+        key=f"{key}_download",
+        on_click="ignore",
+        use_container_width=True
+    )
+
+def archive_frame(lines):
+    return pd.DataFrame([{
+        "Equipment": line.get("equipment_id", "Unknown"),
+        "Test ID": line.get("test_id", "N/A"),
+        "User": line.get("user", "N/A"),
+        "Start Date": line.get("start_date", "N/A"),
+        "End Date": line.get("end_date", "N/A"),
+        "Status": line.get("status", "Unknown"),
+        "Load %": line.get("load_percentage", 0),
+        "Priority": line.get("priority", "Medium"),
+        "Description": line.get("description", ""),
+        "Archived": line.get("archived_at", "")[:16]
+    } for line in lines], columns=ARCHIVE_COLUMNS)
+
+def archive_export_chunks(start, end):
+    for lines in get_state_store().archive_chunks(start, end, EXPORT_CHUNK_ROWS):
+        yield archive_frame(lines)
+
 # -------------- Modal: All Schedules View --------------------
+def delete_schedule(eq_id, schedule_id):
+    """Remove one schedule, save, and offer the days it freed to the waitlist."""
+    schedules = st.session_state.schedules[eq_id]
+    removed = schedules.pop(next(i for i, s in enumerate(schedules) if s.schedule_id == schedule_id))
+    st.session_state.equipment_data[eq_id].load_percentage = concurrent_load(schedules)
+    if not schedules:
+        st.session_state.equipment_data[eq_id].status = "Idle"
+    save_app_state()
+    if removed.status in BOOKED_STATUSES:
+        promote_waitlist([(eq_id, removed)])
+    return removed
+
 @st.dialog("All Schedules & Requests")
 def all_schedules_modal():
     st.markdown("### 📋 Complete Schedule History")
 
-    # Gather all schedules
-    all_schedules = []
-    for eq_id, schedules in st.session_state.schedules.items():
-        for i, schedule in enumerate(schedules):
-            schedule_data = schedule.copy()
-            schedule_data["equipment_id"] = eq_id
-            schedule_data["schedule_index"] = i
-            all_schedules.append(schedule_data)
-
-    if not all_schedules:
+    table = st.session_state.schedule_table
+    if not len(table):
         st.info("No schedules found.")
         if st.button("❌ Close"):
-            st.session_state.show_all_schedules = False
             st.rerun()
         return
 
@@ -552,87 +3309,40 @@ def all_schedules_modal():
     with col3:
         user_filter = st.text_input("Filter by User")
     with col4:
-        date_filter = st.date_input("Filter by Date", value=None)
-
-    # Apply filters
-    filtered_schedules = all_schedules.copy()
-    if status_filter != "All":
-        filtered_schedules = [s for s in filtered_schedules if s.get("status") == status_filter]
-    if equipment_filter != "All":
-        filtered_schedules = [s for s in filtered_schedules if s.get("equipment_id") == equipment_filter]
-    if user_filter:
-        filtered_schedules = [s for s in filtered_schedules if user_filter.lower() in s.get("user", "").lower()]
-    if date_filter:
-        filtered_schedules = [s for s in filtered_schedules if s.get("start_date") == date_filter or s.get("end_date") == date_filter]
-
-    # Prepare dataframe
-    df_data = []
-    for schedule in filtered_schedules:
-        created_at = schedule.get("created_at", "N/A")
-        if isinstance(created_at, datetime):
-            created_at = created_at.strftime("%Y-%m-%d %H:%M")
-        df_data.append({
-            "Equipment": schedule.get("equipment_id", "Unknown"),
-            "Test ID": schedule.get("test_id", "N/A"),
-            "User": schedule.get("user", "N/A"),
-            "Start Date": schedule.get("start_date", "N/A"),
-            "End Date": schedule.get("end_date", "N/A"),
-            "Status": schedule.get("status", "Unknown"),
-            "Load %": schedule.get("load_percentage", 0),
-            "Created": created_at,
-            "Index": f"{schedule['equipment_id']}_{schedule['schedule_index']}"
-        })
-    df = pd.DataFrame(df_data)
+        # One date or a range; schedules running on any of those days match
+        date_filter = st.date_input("Filter by Dates", value=[])
+
+    # Apply filters through the table's indexes
+    matching = table.query(
+        status=status_filter if status_filter != "All" else None,
+        eq_id=equipment_filter if equipment_filter != "All" else None,
+        user=user_filter,
+        start=date_filter[0] if date_filter else None,
+        end=date_filter[-1] if date_filter else None,
+    )
+    df = table.frame(matching)
 
     # Display dataframe
-    st.dataframe(df.drop(columns=["Index"]), height=300)
+    st.dataframe(df, height=300, hide_index=True)
 
     # Select a schedule to delete
-    if filtered_schedules:
-        selected_schedule_key = st.selectbox(
+    if not df.empty:
+        selected_schedule_id = st.selectbox(
             "Select a schedule to delete",
-            options=df["Index"],
-            format_func=lambda x: f"{df[df['Index'] == x]['Equipment'].values[0]} - {df[df['Index'] == x]['Test ID'].values[0]}"
-        )
-        if selected_schedule_key:
-            selected_schedule = next(s for s in filtered_schedules if f"{s['equipment_id']}_{s['schedule_index']}" == selected_schedule_key)
-            eq_id = selected_schedule["equipment_id"]
-            i = selected_schedule["schedule_index"]
-            if st.button("🗑️ Delete Selected Schedule"):
-                removed = st.session_state.schedules[eq_id].pop(i)
-                remaining_load = sum(s["load_percentage"] for s in st.session_state.schedules[eq_id])
-                st.session_state.equipment_data[eq_id]["load_percentage"] = remaining_load
-                if not st.session_state.schedules[eq_id]:
-                    st.session_state.equipment_data[eq_id]["status"] = "Idle"
-                save_app_state()
-                st.success(f"Test {removed['test_id']} permanently deleted.")
-                st.rerun()
-
-    # Export options
-    col_export1, col_export2, col_close = st.columns(3)
-    with col_export1:
-        csv = df.drop(columns=["Index"]).to_csv(index=False)
-        st.download_button(
-            "📥 Export to CSV",
-            data=csv,
-            file_name=f"ltcms_all_schedules_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            use_container_width=True
+            options=df.index,
+            format_func=lambda schedule_id: f"{table.rows[schedule_id][0]} - {table.rows[schedule_id][1].test_id}"
         )
-    with col_export2:
-        if len(filtered_schedules) != len(all_schedules):
-            csv = df.drop(columns=["Index"]).to_csv(index=False)
-            st.download_button(
-                "📥 Export Filtered",
-                data=csv,
-                file_name=f"ltcms_filtered_schedules_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
-    with col_close:
-        if st.button("❌ Close", use_container_width=True):
-            st.session_state.show_all_schedules = False
+        if selected_schedule_id and st.button("🗑️ Delete Selected Schedule"):
+            removed = delete_schedule(table.rows[selected_schedule_id][0], selected_schedule_id)
+            st.success(f"Test {removed.test_id} permanently deleted.")
             st.rerun()
+
+    # Export options: the rows shown above, written only when the button is clicked
+    st.markdown("#### Export")
+    export_controls("all_schedules_export", SCHEDULE_TABLE_COLUMNS, lambda: frame_chunks(df),
+                    "ltcms_schedules" if len(df) == len(table) else "ltcms_filtered_schedules")
+    if st.button("❌ Close", use_container_width=True):
+        st.rerun()
             
 # -------------- Modal: Edit Equipment with editable ID (#3 change) --------------------
 @st.dialog("Edit Equipment")
@@ -643,27 +3353,27 @@ def edit_equipment_modal(equipment_id):
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         new_eq_id = st.text_input("Equipment ID", value=equipment_id, key="edit_eq_id")  # Editable!
-        new_name = st.text_input("Equipment Name", value=equipment['name'], key="edit_eq_name")
-        new_location = st.text_input("Location", value=equipment['location'], key="edit_eq_location")
+        new_name = st.text_input("Equipment Name", value=equipment.name, key="edit_eq_name")
+        new_location = st.text_input("Location", value=equipment.location, key="edit_eq_location")
         new_status = st.selectbox("Status", ['Idle', 'Running', 'Maintenance', 'Scheduled'],
-                                index=['Idle', 'Running', 'Maintenance', 'Scheduled'].index(equipment['status']), key="edit_eq_status")
+                                index=['Idle', 'Running', 'Maintenance', 'Scheduled'].index(equipment.status), key="edit_eq_status")
     with col2:
-        st.write(f"**Type:** {EQUIPMENT_GROUPS[equipment['type']]['name']}")
-        st.write(f"**Current Load:** {equipment['load_percentage']}%")
-        if equipment['type'] == 'PULSE_TESTER':
+        st.write(f"**Type:** {EQUIPMENT_GROUPS[equipment.type]['name']}")
+        st.write(f"**Current Load:** {equipment.load_percentage}%")
+        if equipment.type == 'PULSE_TESTER':
             new_channels = st.number_input("Number of Channels", min_value=1, max_value=32,
-                                          value=equipment.get('channels', 8), key="edit_eq_channels")
-        elif equipment['type'] == 'VIBRATION':
+                                          value=equipment.channels or 8, key="edit_eq_channels")
+        elif equipment.type == 'VIBRATION':
             new_plates = st.number_input("Number of Plates", min_value=1, max_value=10,
-                                        value=equipment.get('plates', 3), key="edit_eq_plates")
+                                        value=equipment.plates or 3, key="edit_eq_plates")
         else:
             new_channels = None
             new_plates = None
     with col3:
         new_params = {}
-        if 'parameters' in equipment:
+        if equipment.parameters:
             st.markdown("**Equipment Parameters**")
-            params_list = list(equipment['parameters'].items())
+            params_list = list(equipment.parameters.items())
             half_point = len(params_list) // 2
             for param, value in params_list[:half_point]:
                 label = get_parameter_display_name(param)
@@ -671,9 +3381,9 @@ def edit_equipment_modal(equipment_id):
                 label_with_unit = f"{label} ({unit})" if unit else label
                 new_params[param] = st.number_input(label_with_unit, value=float(value), key=f"edit_param_{param}_{equipment_id}")
     with col4:
-        if 'parameters' in equipment and len(equipment['parameters']) > 1:
+        if len(equipment.parameters) > 1:
             st.markdown("**Additional Parameters**")
-            params_list = list(equipment['parameters'].items())
+            params_list = list(equipment.parameters.items())
             half_point = len(params_list) // 2
             for param, value in params_list[half_point:]:
                 label = get_parameter_display_name(param)
@@ -692,19 +3402,18 @@ def edit_equipment_modal(equipment_id):
                 if equipment_id in st.session_state.schedules:
                     st.session_state.schedules[new_eq_id] = st.session_state.schedules.pop(equipment_id)
                 equipment_id = new_eq_id  # for further updates
-            st.session_state.equipment_data[equipment_id]['name'] = new_name
-            st.session_state.equipment_data[equipment_id]['location'] = new_location
-            st.session_state.equipment_data[equipment_id]['status'] = new_status
-            st.session_state.equipment_data[equipment_id]['last_updated'] = datetime.now()
+            st.session_state.equipment_data[equipment_id].name = new_name
+            st.session_state.equipment_data[equipment_id].location = new_location
+            st.session_state.equipment_data[equipment_id].status = new_status
+            st.session_state.equipment_data[equipment_id].last_updated = datetime.now()
             if new_channels is not None:
-                st.session_state.equipment_data[equipment_id]['channels'] = new_channels
+                st.session_state.equipment_data[equipment_id].channels = new_channels
             if new_plates is not None:
-                st.session_state.equipment_data[equipment_id]['plates'] = new_plates
+                st.session_state.equipment_data[equipment_id].plates = new_plates
             if new_params:
-                st.session_state.equipment_data[equipment_id]['parameters'] = new_params
+                st.session_state.equipment_data[equipment_id].parameters = new_params
             save_app_state()
             st.success(f"✅ Equipment {equipment_id} updated successfully!")
-            st.session_state.show_edit_equipment = None
             st.rerun()
     with col_delete:
         if st.button("🗑️ Delete Equipment", type="secondary", use_container_width=True):
@@ -714,11 +3423,9 @@ def edit_equipment_modal(equipment_id):
                 del st.session_state.schedules[equipment_id]
             save_app_state()
             st.success(f"✅ Equipment {equipment_id} deleted successfully!")
-            st.session_state.show_edit_equipment = None
             st.rerun()
     with col_cancel:
         if st.button("❌ Cancel", use_container_width=True):
-            st.session_state.show_edit_equipment = None
             st.rerun()
 
 # -------------- Modal: Schedule Test ----------------------
@@ -727,22 +3434,6 @@ def schedule_test_modal(equipment_id):
     st.markdown(f"### 📅 Schedule Test for {equipment_id}")
     equipment = st.session_state.equipment_data[equipment_id]
 
-    # Collect currently blocked dates for reference only
-    blocked_dates = set()
-    if equipment_id in st.session_state.schedules:
-        for schedule in st.session_state.schedules[equipment_id]:
-            if schedule['status'] in ['Scheduled', 'In Progress']:
-                start_date = schedule['start_date']
-                end_date = schedule['end_date']
-                if isinstance(start_date, str):
-                    start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-                if isinstance(end_date, str):
-                    end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-                current_date = start_date
-                while current_date <= end_date:
-                    blocked_dates.add(current_date)
-                    current_date += timedelta(days=1)
-
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         test_id = st.text_input("Test ID", placeholder="e.g., LTC-2024-001", key="schedule_test_id")
@@ -752,31 +3443,81 @@ def schedule_test_modal(equipment_id):
         start_date = st.date_input("Start Date", value=date.today(), key="schedule_start")
         end_date = st.date_input("End Date", value=date.today() + timedelta(days=7), key="schedule_end")
         priority = st.selectbox("Priority", options=["Low", "Medium", "High", "Critical"], index=1, key="schedule_priority")
+        repeat = st.selectbox("Repeat", options=[None] + list(RECURRENCE_UNITS),
+                              format_func=lambda unit: RECURRENCE_UNITS.get(unit, "Does not repeat"), key="schedule_repeat")
+        recurrence = None
+        if repeat:
+            every = st.number_input(f"Every how many {repeat}s", min_value=1, max_value=52, value=1, key="schedule_every")
+            ends = st.radio("Ends", ["After a number of times", "On a date"], horizontal=True, key="schedule_ends")
+            if ends == "On a date":
+                until = st.date_input("Last start on or before", value=start_date + timedelta(days=90), key="schedule_until")
+                recurrence = Recurrence(repeat, every, until=until)
+            else:
+                count = st.number_input("Occurrences", min_value=2, max_value=MAX_OCCURRENCES, value=4, key="schedule_count")
+                recurrence = Recurrence(repeat, every, count=count)
+        # Everything below checks each occurrence; a one-off test has just one
+        proposed = Schedule(schedule_id='', test_id='', user='', start_date=start_date, end_date=end_date,
+                            load_percentage=load_percentage, recurrence=recurrence)
+        valid_dates = bool(start_date and end_date and start_date <= end_date)
+        occurrence_count = 1
+        if valid_dates and recurrence:
+            occurrence_count = sum(1 for _ in islice(occurrence_starts(proposed), MAX_OCCURRENCES + 1))
+            if occurrence_count > MAX_OCCURRENCES:
+                st.error(f"⛔ That is more than {MAX_OCCURRENCES} occurrences; choose a nearer end date.")
+            elif not occurrence_count:
+                st.error("⛔ The repeat ends before the first occurrence.")
+            else:
+                st.caption(f"🔁 {occurrence_count} occurrences, the last ending {last_end(proposed):%Y-%m-%d}")
+        valid_dates = valid_dates and 0 < occurrence_count <= MAX_OCCURRENCES
         # Show date conflicts but allow scheduling
-        conflict_dates = []
-        if start_date and end_date:
-            current_date = start_date
-            while current_date <= end_date:
-                if current_date in blocked_dates:
-                    conflict_dates.append(current_date)
-                current_date += timedelta(days=1)
-        if conflict_dates:
-            st.warning(f"⚠️ The following dates have existing schedules: {', '.join([d.strftime('%Y-%m-%d') for d in conflict_dates])}. You can still schedule this test.")
+        conflicts = []
+        if valid_dates:
+            for o in occurrences(proposed):
+                conflicts.extend((o, s) for s in st.session_state.schedule_index.overlapping(equipment_id, o.start_date, o.end_date))
+        if conflicts:
+            overlaps = ', '.join(
+                f"{s.test_id} ({max(s.start_date, o.start_date):%Y-%m-%d} to {min(s.end_date, o.end_date):%Y-%m-%d})"
+                for o, s in conflicts[:5])
+            if len(conflicts) > 5:
+                overlaps += f" and {len(conflicts) - 5} more"
+            st.warning(f"⚠️ The selected dates overlap existing schedules: {overlaps}. You can still schedule this test.")
+            if not recurrence:
+                free = st.session_state.schedule_index.free_windows(equipment_id, start_date, end_date)
+                if free:
+                    st.caption("Free in this range: " + ', '.join(f"{s:%Y-%m-%d} to {e:%Y-%m-%d}" for s, e in free))
+        # Overlapping is allowed, going over 100% on any day is not
+        peak_load, peak_day = 0, start_date
+        if valid_dates:
+            peak_load, peak_day = st.session_state.schedule_index.peak_load_for(equipment_id, proposed)
+            if peak_load > 100:
+                st.error(f"⛔ With this test the load would reach {peak_load}% on {peak_day:%Y-%m-%d}.")
     with col3:
         selected_channels = []
         selected_plates = []
-        if equipment['type'] == 'PULSE_TESTER':
-            available_channels = list(range(1, equipment.get('channels', 8) + 1))
-            selected_channels = st.multiselect("Select Channels", options=available_channels, default=[1], key="schedule_channels")
-        elif equipment['type'] == 'VIBRATION':
-            available_plates = list(range(1, equipment.get('plates', 3) + 1))
-            selected_plates = st.multiselect("Select Plates", options=available_plates, default=[1], key="schedule_plates")
+        needed = 0
+        units = ALLOCATED_UNITS.get(equipment.type)
+        if units:
+            kind, label, default_capacity = units
+            capacity = getattr(equipment, kind) or default_capacity
+            free_units = list(range(1, capacity + 1))
+            if valid_dates:
+                free_units = st.session_state.schedule_index.free_units_for(equipment_id, proposed, kind, capacity)
+            needed = st.number_input(f"{label} needed", min_value=1, max_value=capacity, value=1, key=f"schedule_{kind}_count")
+            st.caption(f"Free for the whole range: {format_units(free_units) or 'none'}")
+            # Lowest free units are pre-selected; the key follows the inputs
+            # so the suggestion updates when they change
+            selected = st.multiselect(f"Select {label}", options=free_units, default=free_units[:needed],
+                                      key=f"schedule_{kind}_{needed}_{start_date}_{end_date}_{recurrence.describe() if recurrence else ''}")
+            if kind == 'channels':
+                selected_channels = selected
+            else:
+                selected_plates = selected
     with col4:
         test_params = {}
-        if equipment['type'] in EQUIPMENT_GROUPS and 'parameters' in EQUIPMENT_GROUPS[equipment['type']]:
+        if equipment.type in EQUIPMENT_GROUPS and 'parameters' in EQUIPMENT_GROUPS[equipment.type]:
             st.markdown("**Test Parameters**")
-            defaults = EQUIPMENT_GROUPS[equipment['type']]['defaults']
-            for param in EQUIPMENT_GROUPS[equipment['type']]['parameters'][:4]:
+            defaults = EQUIPMENT_GROUPS[equipment.type]['defaults']
+            for param in EQUIPMENT_GROUPS[equipment.type]['parameters'][:4]:
                 label = get_parameter_display_name(param)
                 unit = get_parameter_unit(param)
                 label_with_unit = f"Test {label} ({unit})" if unit else f"Test {label}"
@@ -788,43 +3529,67 @@ def schedule_test_modal(equipment_id):
             if not test_id or not user_name:
                 st.error("Please fill in Test ID and User name")
                 return
+            if start_date > end_date:
+                st.error("Start Date cannot be after End Date.")
+                return
+            if not valid_dates:
+                st.error("The repeat rule gives no occurrences or too many; check its end.")
+                return
+            if peak_load > 100:
+                st.error(f"Cannot schedule: {equipment_id} would be booked at {peak_load}% on {peak_day:%Y-%m-%d}. "
+                         "You can add it to the waitlist instead.")
+                return
+            chosen = len(selected_channels or selected_plates)
+            if units and chosen != needed:
+                if not chosen:
+                    st.error(f"No {units[1].lower()} selected; none may be free for the whole range.")
+                else:
+                    st.error(f"Select exactly {needed} {units[1].lower()}; {chosen} are selected.")
+                return
             if equipment_id not in st.session_state.schedules:
                 st.session_state.schedules[equipment_id] = []
-            schedule_id = str(uuid.uuid4())
-            schedule_data = {
-                'schedule_id': schedule_id,
-                'test_id': test_id,
-                'user': user_name,
-                'start_date': start_date,
-                'end_date': end_date,
-                'load_percentage': load_percentage,
-                'priority': priority,
-                'description': test_description,
-                'test_parameters': test_params,
-                'status': 'Scheduled',
-                'created_at': datetime.now()
-            }
-            if equipment['type'] == 'PULSE_TESTER' and selected_channels:
-                schedule_data['channels'] = selected_channels
-            if equipment['type'] == 'VIBRATION' and selected_plates:
-                schedule_data['plates'] = selected_plates
+            schedule_data = Schedule(
+                schedule_id=str(uuid.uuid4()),
+                test_id=test_id,
+                user=user_name,
+                start_date=start_date,
+                end_date=end_date,
+                load_percentage=load_percentage,
+                priority=priority,
+                description=test_description,
+                test_parameters=test_params,
+                status='Scheduled',
+                created_at=datetime.now(),
+                recurrence=recurrence,
+            )
+            if equipment.type == 'PULSE_TESTER' and selected_channels:
+                schedule_data.channels = selected_channels
+            if equipment.type == 'VIBRATION' and selected_plates:
+                schedule_data.plates = selected_plates
             st.session_state.schedules[equipment_id].append(schedule_data)
-            current_load = sum(s['load_percentage'] for s in st.session_state.schedules[equipment_id])
-            st.session_state.equipment_data[equipment_id]['load_percentage'] = min(current_load, 100)
-            cur_status = st.session_state.equipment_data[equipment_id]['status']
+            st.session_state.equipment_data[equipment_id].load_percentage = concurrent_load(st.session_state.schedules[equipment_id])
+            cur_status = st.session_state.equipment_data[equipment_id].status
             if cur_status not in ['Running', 'Maintenance']:
-                st.session_state.equipment_data[equipment_id]['status'] = 'Scheduled'
+                st.session_state.equipment_data[equipment_id].status = 'Scheduled'
             save_app_state()
             st.success(f"✅ Test {test_id} scheduled successfully!")
-            st.session_state.show_schedule_form = None
             st.rerun()
+        if peak_load > 100 and not recurrence and valid_dates:
+            if st.button("⏳ Add to Waitlist", use_container_width=True,
+                         help="Wait for room on any equipment of this type"):
+                if not test_id or not user_name:
+                    st.error("Please fill in Test ID and User name")
+                    return
+                add_to_waitlist(equipment.type, test_id, user_name, (end_date - start_date).days + 1, load_percentage,
+                                priority, start_date, needed, test_description, test_params)
+                st.success(f"✅ {test_id} added to the waitlist.")
+                st.rerun()
     with col_calendar:
         if st.button("📅 View Calendar", use_container_width=True):
             st.session_state.show_calendar = equipment_id
             st.rerun()
     with col_cancel:
         if st.button("❌ Cancel", use_container_width=True):
-            st.session_state.show_schedule_form = None
             st.rerun()
 
 # -------------- Modal: Equipment Settings -----------------
@@ -837,32 +3602,32 @@ def equipment_settings_modal(equipment_id):
     with col1:
         new_status = st.selectbox("Equipment Status", 
                                   ['Idle', 'Running', 'Maintenance', 'Scheduled'], 
-                                  index=['Idle', 'Running', 'Maintenance', 'Scheduled'].index(equipment['status']), 
+                                  index=['Idle', 'Running', 'Maintenance', 'Scheduled'].index(equipment.status), 
                                   key=f"settings_status_{equipment_id}")
-        st.write(f"**Equipment Type:** {EQUIPMENT_GROUPS[equipment['type']]['name']}")
-        st.write(f"**Location:** {equipment['location']}")
-        st.write(f"**Current Load:** {equipment['load_percentage']}%")
-        if equipment['type'] == 'PULSE_TESTER':
+        st.write(f"**Equipment Type:** {EQUIPMENT_GROUPS[equipment.type]['name']}")
+        st.write(f"**Location:** {equipment.location}")
+        st.write(f"**Current Load:** {equipment.load_percentage}%")
+        if equipment.type == 'PULSE_TESTER':
             new_channels = st.number_input("Number of Channels", min_value=1, max_value=32, 
-                                          value=equipment.get('channels', 8), key=f"settings_channels_{equipment_id}")
-        elif equipment['type'] == 'VIBRATION':
+                                          value=equipment.channels or 8, key=f"settings_channels_{equipment_id}")
+        elif equipment.type == 'VIBRATION':
             new_plates = st.number_input("Number of Plates", min_value=1, max_value=10,
-                                        value=equipment.get('plates', 3), key=f"settings_plates_{equipment_id}")
+                                        value=equipment.plates or 3, key=f"settings_plates_{equipment_id}")
         else:
             new_channels = None
             new_plates = None
     with col2:
-        if 'parameters' in equipment:
+        if equipment.parameters:
             st.markdown("### Current Parameters")
-            for param, value in equipment['parameters'].items():
+            for param, value in equipment.parameters.items():
                 label = get_parameter_display_name(param)
                 unit = get_parameter_unit(param)
                 st.write(f"**{label}:** {value} {unit}")
     with col3:
         new_params = {}
-        if 'parameters' in equipment:
+        if equipment.parameters:
             st.markdown("### Edit Parameters")
-            for param, value in equipment['parameters'].items():
+            for param, value in equipment.parameters.items():
                 label = get_parameter_display_name(param)
                 unit = get_parameter_unit(param)
                 label_with_unit = f"{label} ({unit})" if unit else label
@@ -870,21 +3635,19 @@ def equipment_settings_modal(equipment_id):
     col_apply, col_cancel = st.columns([1,1])
     with col_apply:
         if st.button("✅ Apply Changes", type="primary", use_container_width=True):
-            st.session_state.equipment_data[equipment_id]['status'] = new_status
-            st.session_state.equipment_data[equipment_id]['last_updated'] = datetime.now()
+            st.session_state.equipment_data[equipment_id].status = new_status
+            st.session_state.equipment_data[equipment_id].last_updated = datetime.now()
             if new_channels is not None:
-                st.session_state.equipment_data[equipment_id]['channels'] = new_channels
+                st.session_state.equipment_data[equipment_id].channels = new_channels
             if new_plates is not None:
-                st.session_state.equipment_data[equipment_id]['plates'] = new_plates
+                st.session_state.equipment_data[equipment_id].plates = new_plates
             if new_params:
-                st.session_state.equipment_data[equipment_id]['parameters'] = new_params
+                st.session_state.equipment_data[equipment_id].parameters = new_params
             save_app_state()
             st.success(f"✅ Settings updated for {equipment_id}")
-            st.session_state.show_settings = None
             st.rerun()
     with col_cancel:
         if st.button("❌ Cancel", use_container_width=True):
-            st.session_state.show_settings = None
             st.rerun()
 
 # -------------- Modal: Active Test Status Management ----------------
@@ -892,112 +3655,105 @@ def equipment_settings_modal(equipment_id):
 def test_status_modal():
     st.markdown("### 📋 Active Test Status Management")
 
-    # Gather all active tests
-    all_schedules = []
-    for eq_id, schedules in st.session_state.schedules.items():
-        for i, schedule in enumerate(schedules):
-            schedule_data = schedule.copy()
-            schedule_data['equipment_id'] = eq_id
-            schedule_data['schedule_index'] = i
-            schedule_data['schedule_id'] = schedule.get('schedule_id', str(uuid.uuid4()))  # Ensure unique schedule_id
-            all_schedules.append(schedule_data)
-
-    if not all_schedules:
+    table = st.session_state.schedule_table
+    if not len(table):
         st.info("No active tests found.")
         if st.button("❌ Close", key="close_test_status_modal", use_container_width=True):
-            st.session_state.show_test_status = False
             st.rerun()
         return
 
-    # Prepare dataframe for display
-    df_data = []
-    for schedule in all_schedules:
-        df_data.append({
-            "Equipment": schedule["equipment_id"],
-            "Test ID": schedule["test_id"],
-            "User": schedule["user"],
-            "Start Date": str(schedule["start_date"]),
-            "End Date": str(schedule["end_date"]),
-            "Status": schedule["status"],
-            "Load %": schedule["load_percentage"],
-            "Index": schedule["schedule_id"]  # Use schedule_id as unique identifier
-        })
-    df = pd.DataFrame(df_data)
-
     # Display dataframe with native scrolling
     st.markdown("#### Active Tests")
-    st.dataframe(df.drop(columns=["Index"]), height=300)  # Height enables scrolling for long lists
+    df = table.frame()
+    st.dataframe(df.drop(columns=["Created"]), height=300, hide_index=True)  # Height enables scrolling for long lists
 
-    # Dropdown to select a test
-    test_options = [
-        f"{s['equipment_id']} - {s['test_id']} - {s['user']} - {s['start_date']} to {s['end_date']}"
-        for s in all_schedules
-    ]
-    selected_test_str = st.selectbox(
+    # Dropdown to select a test; options are schedule ids resolved through the table
+    selected_id = st.selectbox(
         "Select a test to edit or delete",
-        options=test_options,
+        options=df.index,
+        format_func=table.label,
         key="test_status_selectbox"
     )
 
     # Find the selected schedule
-    if selected_test_str:
-        selected_schedule = next(
-            s for s in all_schedules
-            if f"{s['equipment_id']} - {s['test_id']} - {s['user']} - {s['start_date']} to {s['end_date']}" == selected_test_str
-        )
-        schedule_id = selected_schedule["schedule_id"]
-        eq_id = selected_schedule["equipment_id"]
-        i = selected_schedule["schedule_index"]
+    if selected_id in table.rows:
+        eq_id, selected_schedule = table.get(selected_id)
+        schedule_id = selected_schedule.schedule_id
 
         # Display editing fields with unique keys
         st.markdown("#### Edit Selected Test")
         col1, col2, col3 = st.columns(3)
         with col1:
-            new_test_id = st.text_input("Test ID", value=selected_schedule["test_id"], key=f"test_id_{schedule_id}")
+            new_test_id = st.text_input("Test ID", value=selected_schedule.test_id, key=f"test_id_{schedule_id}")
         with col2:
-            new_user = st.text_input("User", value=selected_schedule["user"], key=f"user_{schedule_id}")
+            new_user = st.text_input("User", value=selected_schedule.user, key=f"user_{schedule_id}")
         with col3:
-            new_load = st.number_input("Load %", min_value=1, max_value=100, value=selected_schedule["load_percentage"], key=f"load_{schedule_id}")
+            new_load = st.number_input("Load %", min_value=1, max_value=100, value=selected_schedule.load_percentage, key=f"load_{schedule_id}")
 
         col4, col5, col6 = st.columns(3)
         with col4:
-            start_date = parse_date(selected_schedule["start_date"])
-            new_start_date = st.date_input("Start Date", value=start_date, key=f"start_date_{schedule_id}")
+            new_start_date = st.date_input("Start Date", value=selected_schedule.start_date, key=f"start_date_{schedule_id}")
         with col5:
-            end_date = parse_date(selected_schedule["end_date"])
-            new_end_date = st.date_input("End Date", value=end_date, key=f"end_date_{schedule_id}")
+            new_end_date = st.date_input("End Date", value=selected_schedule.end_date, key=f"end_date_{schedule_id}")
         with col6:
-            status_idx = TEST_STATUS_OPTIONS.index(selected_schedule["status"]) if selected_schedule["status"] in TEST_STATUS_OPTIONS else 0
+            status_idx = TEST_STATUS_OPTIONS.index(selected_schedule.status) if selected_schedule.status in TEST_STATUS_OPTIONS else 0
             new_status = st.selectbox("Status", TEST_STATUS_OPTIONS, index=status_idx, key=f"status_{schedule_id}")
 
         # Action buttons with unique keys
         col_save, col_delete, _ = st.columns([1, 1, 3])
         with col_save:
             if st.button("💾 Save", key=f"save_{schedule_id}"):
+                peak_load, peak_day = 0, None
+                clash, units = [], ALLOCATED_UNITS.get(st.session_state.equipment_data[eq_id].type)
+                if new_status in BOOKED_STATUSES and new_start_date <= new_end_date:
+                    # A recurring test is checked over all of its occurrences
+                    proposed = replace(selected_schedule, start_date=new_start_date, end_date=new_end_date,
+                                       load_percentage=new_load, status=new_status)
+                    peak_load, peak_day = st.session_state.schedule_index.peak_load_for(eq_id, proposed, exclude=schedule_id)
+                    if units:
+                        # The test keeps its channels/plates; they must stay free on the new dates
+                        kind, _, default_capacity = units
+                        taken = getattr(selected_schedule, kind) or []
+                        capacity = max([getattr(st.session_state.equipment_data[eq_id], kind) or default_capacity] + taken)
+                        free = st.session_state.schedule_index.free_units_for(
+                            eq_id, proposed, kind, capacity, exclude=schedule_id)
+                        clash = [n for n in taken if n not in free]
                 if not new_test_id or not new_user:
                     st.error("Please provide Test ID and User.")
                 elif new_start_date > new_end_date:
                     st.error("Start Date cannot be after End Date.")
+                elif peak_load > 100:
+                    st.error(f"Cannot save: {eq_id} would be booked at {peak_load}% on {peak_day:%Y-%m-%d}.")
+                elif clash:
+                    st.error(f"Cannot save: {units[1].lower()} {format_units(clash)} are booked by another test on these dates.")
                 else:
                     # Update the schedule data
-                    st.session_state.schedules[eq_id][i].update({
-                        "test_id": new_test_id,
-                        "user": new_user,
-                        "start_date": new_start_date,
-                        "end_date": new_end_date,
-                        "status": new_status,
-                        "load_percentage": new_load,
-                        "schedule_id": schedule_id  # Preserve schedule_id
-                    })
+                    schedule = selected_schedule
+                    if schedule.recurrence and new_start_date != schedule.start_date:
+                        # Exceptions are keyed by the old occurrence dates
+                        schedule.recurrence.exceptions.clear()
+                    schedule.test_id = new_test_id
+                    schedule.user = new_user
+                    schedule.start_date = new_start_date
+                    schedule.end_date = new_end_date
+                    schedule.status = new_status
+                    schedule.load_percentage = new_load
+                    if schedule.recurrence and new_status == 'Completed':
+                        # Completing a series ends it at today's occurrence; the
+                        # archive keeps what ran, not the occurrences still to come
+                        today = date.today()
+                        rule = schedule.recurrence
+                        rule.until = min(rule.until or today, today)
+                        for key in [key for key in rule.exceptions if to_date(key) > today]:
+                            del rule.exceptions[key]
                     # Recalculate equipment load percentage
-                    remaining_load = sum(s["load_percentage"] for s in st.session_state.schedules[eq_id])
-                    st.session_state.equipment_data[eq_id]["load_percentage"] = min(remaining_load, 100)
+                    st.session_state.equipment_data[eq_id].load_percentage = concurrent_load(st.session_state.schedules[eq_id])
                     # Update equipment status if needed
-                    if not any(s["status"] in ["Scheduled", "In Progress"] for s in st.session_state.schedules[eq_id]):
-                        st.session_state.equipment_data[eq_id]["status"] = "Idle"
+                    if not any(s.status in ["Scheduled", "In Progress"] for s in st.session_state.schedules[eq_id]):
+                        st.session_state.equipment_data[eq_id].status = "Idle"
                     elif new_status in ["Scheduled", "In Progress"]:
-                        st.session_state.equipment_data[eq_id]["status"] = "Scheduled"
-                    if new_status == "Completed":
+                        st.session_state.equipment_data[eq_id].status = "Scheduled"
+                    if new_status in ARCHIVED_STATUSES:
                         cleanup_completed_tests()
                     save_app_state()
                     st.success(f"Test {new_test_id} updated successfully!")
@@ -1006,44 +3762,151 @@ def test_status_modal():
         with col_delete:
             if st.button("🗑️ Delete", key=f"delete_{schedule_id}"):
                 # Delete the selected test
-                removed = st.session_state.schedules[eq_id].pop(i)
-                remaining_load = sum(s["load_percentage"] for s in st.session_state.schedules[eq_id])
-                st.session_state.equipment_data[eq_id]["load_percentage"] = remaining_load
-                if not st.session_state.schedules[eq_id]:
-                    st.session_state.equipment_data[eq_id]["status"] = "Idle"
-                save_app_state()
-                st.success(f"Test {removed['test_id']} deleted.")
+                removed = delete_schedule(eq_id, schedule_id)
+                st.success(f"Test {removed.test_id} deleted.")
                 st.rerun()
 
+        if selected_schedule.recurrence:
+            occurrence_editor(eq_id, selected_schedule)
+
     else:
         st.info("Select a test to edit or delete.")
 
     # Close button
     if st.button("❌ Close", key="close_test_status_modal", use_container_width=True):
-        st.session_state.show_test_status = False
         st.rerun()
         
+def occurrence_editor(eq_id, series):
+    """Move, re-status or restore single upcoming occurrences of a recurring test."""
+    rule = series.recurrence
+    schedule_id = series.schedule_id
+    st.markdown("#### Occurrences")
+    st.caption(f"🔁 {rule.describe()}")
+    today = date.today()
+    span = series.end_date - series.start_date
+    upcoming = list(islice((d for d in occurrence_starts(series, today) if d + span >= today), 52))
+    if not upcoming:
+        st.info("No occurrences left.")
+        return
+    day = st.selectbox(
+        "Occurrence",
+        options=upcoming,
+        format_func=lambda d: f"{d:%Y-%m-%d}" + (" (changed)" if d.strftime(DATE_FORMAT) in rule.exceptions else ""),
+        key=f"occurrence_{schedule_id}"
+    )
+    key = day.strftime(DATE_FORMAT)
+    current = make_occurrence(series, day, rule.exceptions.get(key))
+    oc1, oc2, oc3 = st.columns(3)
+    with oc1:
+        occ_start = st.date_input("Occurrence start", value=current.start_date, key=f"occ_start_{schedule_id}_{key}")
+    with oc2:
+        occ_end = st.date_input("Occurrence end", value=current.end_date, key=f"occ_end_{schedule_id}_{key}")
+    with oc3:
+        status_idx = TEST_STATUS_OPTIONS.index(current.status) if current.status in TEST_STATUS_OPTIONS else 0
+        occ_status = st.selectbox("Occurrence status", TEST_STATUS_OPTIONS, index=status_idx, key=f"occ_status_{schedule_id}_{key}")
+
+    col_occ_save, col_occ_restore, _ = st.columns([1, 1, 3])
+    with col_occ_save:
+        if st.button("💾 Save occurrence", key=f"save_occ_{schedule_id}"):
+            index = st.session_state.schedule_index
+            peak_load, peak_day, clash = 0, None, []
+            if occ_status in BOOKED_STATUSES and occ_start <= occ_end:
+                peak_load, peak_day = index.peak_load(eq_id, occ_start, occ_end, exclude=current.schedule_id,
+                                                      extra=series.load_percentage)
+                units = ALLOCATED_UNITS.get(st.session_state.equipment_data[eq_id].type)
+                taken = (getattr(series, units[0]) or []) if units else []
+                if taken:
+                    free = index.free_units(eq_id, occ_start, occ_end, units[0], max(taken), exclude=current.schedule_id)
+                    clash = [n for n in taken if n not in free]
+            if occ_start > occ_end:
+                st.error("Start Date cannot be after End Date.")
+            elif peak_load > 100:
+                st.error(f"Cannot save: {eq_id} would be booked at {peak_load}% on {peak_day:%Y-%m-%d}.")
+            elif clash:
+                st.error(f"Cannot save: {format_units(clash)} are booked by another test on these dates.")
+            else:
+                regular = make_occurrence(series, day)
+                changes = {}
+                if occ_start != regular.start_date:
+                    changes['start_date'] = occ_start.strftime(DATE_FORMAT)
+                if occ_end != regular.end_date:
+                    changes['end_date'] = occ_end.strftime(DATE_FORMAT)
+                if occ_status != series.status:
+                    changes['status'] = occ_status
+                if changes:
+                    rule.exceptions[key] = changes
+                else:
+                    rule.exceptions.pop(key, None)
+                st.session_state.equipment_data[eq_id].load_percentage = concurrent_load(st.session_state.schedules[eq_id])
+                save_app_state()
+                if current.status in BOOKED_STATUSES and occ_status not in BOOKED_STATUSES:
+                    promote_waitlist([(eq_id, current)])
+                st.success(f"Occurrence of {day:%Y-%m-%d} updated.")
+                st.rerun()
+    with col_occ_restore:
+        if key in rule.exceptions and st.button("↩️ Restore", key=f"restore_occ_{schedule_id}"):
+            rule.exceptions.pop(key)
+            st.session_state.equipment_data[eq_id].load_percentage = concurrent_load(st.session_state.schedules[eq_id])
+            save_app_state()
+            st.rerun()
+
 # -------- Equipment Calendar ----------------------
+# The month grid is a single table built from the schedule index, so a month
+# change redraws one element instead of a column per day.
+CALENDAR_TEMPLATE = Template('<table class="month-calendar"><tr>$weekdays</tr>$weeks</table>')
+CALENDAR_DAY_TEMPLATE = Template(
+    '<td class="cal-$state$today" title="$title">'
+    '<div class="cal-day">$day</div><div class="cal-load">$load</div></td>'
+)
+CALENDAR_WEEKDAYS = ''.join(f'<th>{name}</th>' for name in calendar.day_abbr)
+
+def month_calendar_html(eq_id, year, month, today=None):
+    """The month grid of `eq_id` with every day coloured by its booked load."""
+    today = today or date.today()
+    month_start = date(year, month, 1)
+    month_end = date(year, month, calendar.monthrange(year, month)[1])
+    bookings = st.session_state.schedule_index.bookings_by_day(eq_id, month_start, month_end)
+    weeks = []
+    for week in calendar.monthcalendar(year, month):
+        cells = []
+        for day in week:
+            if day == 0:
+                cells.append('<td class="cal-empty"></td>')
+                continue
+            current = date(year, month, day)
+            running = bookings.get(current, [])
+            load = sum(s.load_percentage for s in running)
+            if not running:
+                state = 'available'
+            else:
+                state = 'blocked' if load >= 100 else 'partial'
+            title = ', '.join(f"{s.test_id} ({s.user}) {s.load_percentage}%" for s in running)
+            cells.append(CALENDAR_DAY_TEMPLATE.substitute(
+                state=state,
+                today=' cal-today' if current == today else '',
+                title=escape(title or 'Available'),
+                day=day,
+                load=f"{load}%" if running else '',
+            ))
+        weeks.append(f"<tr>{''.join(cells)}</tr>")
+    return CALENDAR_TEMPLATE.substitute(weekdays=CALENDAR_WEEKDAYS, weeks=''.join(weeks))
+
 @st.dialog("Equipment Calendar")
 def calendar_modal(equipment_id):
     # Defensive check: ensure equipment_id exists
     if equipment_id not in st.session_state.equipment_data:
         st.error(f"Equipment ID '{equipment_id}' not found.")
         if st.button("❌ Close"):
-            st.session_state.show_calendar = None
             st.rerun()
         return
 
-    import calendar
-    from datetime import datetime, date, timedelta
-
     st.markdown(f"### 📅 Calendar View: {equipment_id}")
     
     col1, col2 = st.columns([2, 1])
+    today = date.today()
     
     with col1:
         # Calendar controls: month and year selectors
-        today = date.today()
         selected_month = st.selectbox(
             "Month", 
             options=list(range(1, 13)), 
@@ -1053,215 +3916,797 @@ def calendar_modal(equipment_id):
         selected_year = st.number_input(
             "Year", min_value=2024, max_value=2030, value=today.year
         )
-        
-        # Generate month calendar (weeks with days or zeros)
-        cal = calendar.monthcalendar(selected_year, selected_month)
-        
-        # Collect blocked dates for this equipment in this month
-        blocked_dates = set()
-        if equipment_id in st.session_state.schedules:
-            for schedule in st.session_state.schedules[equipment_id]:
-                if schedule.get('status') in ['Scheduled', 'In Progress']:
-                    start_date = schedule.get('start_date')
-                    end_date = schedule.get('end_date')
-
-                    # Defensive date conversion
-                    try:
-                        if isinstance(start_date, str):
-                            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-                        if isinstance(end_date, str):
-                            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-                    except Exception as e:
-                        st.warning(f"Warning: Could not parse dates for test '{schedule.get('test_id', 'N/A')}': {e}")
-                        continue
-
-                    current_date = start_date
-                    while current_date <= end_date:
-                        blocked_dates.add(current_date)
-                        current_date += timedelta(days=1)
+        month_start = date(selected_year, selected_month, 1)
+        month_end = date(selected_year, selected_month, calendar.monthrange(selected_year, selected_month)[1])
         
         st.markdown("#### Calendar")
-        # Day headers
-        days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-        header_cols = st.columns(7)
-        for i, day in enumerate(days):
-            header_cols[i].markdown(f"**{day}**")
-        
-        # Helper function to get inline CSS for calendar day boxes
-        def get_inline_style(status):
-            base = (
-                "border:1px solid #ddd; padding:10px 5px; margin:1px; "
-                "border-radius:4px; text-align:center; font-weight:600; font-size:14px; "
-                "min-height:40px; min-width:40px; line-height:40px; user-select:none; cursor:default;"
-            )
-            styles = {
-                "available": "background-color:#d4edda; color:#155724;",
-                "blocked": "background-color:#f8d7da; color:#721c24;",
-                "today":   "background-color:#bee5eb; color:#0c5460; font-weight:700; border:2px solid #0c5460;"
-            }
-            return base + styles.get(status, "")
-
-        # Render calendar grid with inline styles
-        for week in cal:
-            week_cols = st.columns(7)
-            for i, day in enumerate(week):
-                if day == 0:
-                    week_cols[i].markdown("")  # empty cell for padding
-                else:
-                    current_date = date(selected_year, selected_month, day)
-                    
-                    # Determine day status
-                    if current_date in blocked_dates:
-                        style = get_inline_style("blocked")
-                    elif current_date == today:
-                        style = get_inline_style("today")
-                    else:
-                        style = get_inline_style("available")
-
-                    week_cols[i].markdown(
-                        f'<div style="{style}">{day}</div>', unsafe_allow_html=True
-                    )
+        st.markdown(month_calendar_html(equipment_id, selected_year, selected_month, today),
+                    unsafe_allow_html=True)
     
     with col2:
         st.markdown("#### Legend")
-        st.markdown('🟢 **Available** - Open for scheduling')
-        st.markdown('🔴 **Blocked** - Already scheduled')
-        st.markdown('🔵 **Today** - Current date')
+        st.markdown(
+            "🟢 **Available** - Open for scheduling  \n"
+            "🟡 **Partly booked** - Load left for more tests  \n"
+            "🔴 **Blocked** - Booked to 100%  \n"
+            "🔵 **Today** - Outlined"
+        )
         
         st.markdown("#### Scheduled Tests This Month")
         month_schedules = []
         if equipment_id in st.session_state.schedules:
             for schedule in st.session_state.schedules[equipment_id]:
-                start_date = schedule.get('start_date')
-                if isinstance(start_date, str):
-                    try:
-                        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-                    except Exception:
-                        continue
-                
-                if start_date.month == selected_month and start_date.year == selected_year:
-                    month_schedules.append(schedule)
+                # Recurring tests contribute the occurrences starting this month
+                for occurrence in occurrences(schedule, month_start, month_end):
+                    if occurrence.start_date >= month_start:
+                        month_schedules.append(occurrence)
+            month_schedules.sort(key=lambda s: s.start_date)
             
-            if month_schedules:
-                for schedule in month_schedules:
-                    start_day_str = (
-                        schedule['start_date'].strftime("%d") 
-                        if hasattr(schedule['start_date'], 'strftime') 
-                        else str(schedule['start_date'])
-                    )
-                    st.markdown(f"**{start_day_str}th:** {schedule['test_id']} ({schedule['user']})")
-            else:
-                st.info("No tests scheduled this month")
+        if month_schedules:
+            st.markdown("\n".join(
+                f"- **{schedule.start_date:%d %b}:** {schedule.test_id} ({schedule.user})"
+                for schedule in month_schedules
+            ))
+        else:
+            st.info("No tests scheduled this month")
     
     if st.button("❌ Close"):
-        st.session_state.show_calendar = None
         st.rerun()
 
+# -------------- Modal: Lab Timeline ----------------
+# Every equipment item's bookings on one Gantt chart. The bars come straight
+# from the schedule index's interval lists (recurring tests expanded over the
+# range only), and the dialog's filters rerun the dialog alone.
+TIMELINE_WEEKS = [4, 8, 13, 26]
+TIMELINE_COLUMNS = ['Equipment', 'Group', 'Location', 'Test ID', 'User', 'Status',
+                    'Priority', 'Load %', 'Start', 'Finish']
+TIMELINE_COLOR_BY = ['Group', 'User', 'Priority', 'Status']
 
+def timeline_frame(eq_ids, start, end, users=()):
+    """One row per booked schedule (or occurrence) of `eq_ids` within [start, end].
 
-# -------------- Render Equipment Card with Progression (#4) -----------------------
-def render_equipment_card(eq_id, eq_data):
-    group_info = EQUIPMENT_GROUPS[eq_data['type']]
-    card_html = f'''
-    <div class="equipment-card">
-        <div class="equipment-header">{group_info['icon']} {eq_id}</div>
-        <div class="status-badge status-{eq_data['status'].lower()}">{eq_data['status']}</div>
-    '''
-    st.markdown(card_html, unsafe_allow_html=True)
-
-    st.markdown('<div class="parameter-section">', unsafe_allow_html=True)
-    st.markdown('<div class="parameter-title">Equipment Parameters</div>', unsafe_allow_html=True)
-    for param in group_info.get('display_params', []):
-        if 'parameters' in eq_data and param in eq_data['parameters']:
-            label = get_parameter_display_name(param)
-            unit = get_parameter_unit(param)
-            value = eq_data['parameters'][param]
-            st.markdown(f'<div class="parameter-item">{label}: <b>{value} {unit}</b></div>', unsafe_allow_html=True)
+    `Finish` is the day after the last booked day, where px.timeline ends a bar.
+    """
+    index = st.session_state.schedule_index
+    equipment_data = st.session_state.equipment_data
+    rows = []
+    for eq_id in eq_ids:
+        eq = equipment_data[eq_id]
+        for bar_start, bar_end, s in index.timeline(eq_id, start, end):
+            if users and s.user not in users:
+                continue
+            rows.append({
+                'Equipment': eq_id,
+                'Group': EQUIPMENT_GROUPS.get(eq.type, {}).get('name', eq.type),
+                'Location': eq.location,
+                'Test ID': s.test_id,
+                'User': s.user,
+                'Status': s.status,
+                'Priority': s.priority,
+                'Load %': s.load_percentage,
+                'Start': pd.Timestamp(bar_start),
+                'Finish': pd.Timestamp(bar_end + timedelta(days=1)),
+            })
+    return pd.DataFrame(rows, columns=TIMELINE_COLUMNS)
 
-    if eq_data['type'] == 'VIBRATION' and 'plates' in eq_data:
-        st.markdown(f'<div class="parameter-item">Available Plates: <b>{eq_data["plates"]}</b></div>', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+@st.dialog("Lab Timeline", width="large")
+def timeline_modal():
+    st.markdown("### 📆 Lab Timeline")
+    equipment_data = st.session_state.equipment_data
+    if not equipment_data:
+        st.info("No equipment added yet.")
+        return
 
-    # Scheduled tests (exclude completed ones)
-    active_schedules = []
-    if eq_id in st.session_state.schedules:
-        active_schedules = [s for s in st.session_state.schedules[eq_id] if s.get('status') != 'Completed']
-
-    for schedule in active_schedules:
-        sd = schedule["start_date"]
-        ed = schedule["end_date"]
-        start_str = sd.strftime("%Y-%m-%d") if hasattr(sd, "strftime") else sd
-        end_str = ed.strftime("%Y-%m-%d") if hasattr(ed, "strftime") else ed
-
-        extra_info = ""
-        if 'channels' in schedule:
-            extra_info = f" | 📡 Ch: {','.join(map(str, schedule['channels']))}"
-        elif 'plates' in schedule:
-            extra_info = f" | 🔲 Plates: {','.join(map(str, schedule['plates']))}"
-
-        # Calculate progression %
-        total_days = (parse_date(ed) - parse_date(sd)).days + 1
-        elapsed_days = (date.today() - parse_date(sd)).days + 1
-        progression = None
-        if total_days > 0 and elapsed_days > 0:
-            progression = int((elapsed_days / total_days) * 100)
-            progression = min(max(progression, 0), 100)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        groups = st.multiselect(
+            "Group", [k for k in EQUIPMENT_GROUPS if k != 'ALL'],
+            format_func=lambda g: f"{EQUIPMENT_GROUPS[g]['icon']} {EQUIPMENT_GROUPS[g]['name']}",
+            key="timeline_groups"
+        )
+    with col2:
+        locations = st.multiselect(
+            "Location", sorted({eq.location for eq in equipment_data.values() if eq.location}),
+            key="timeline_locations"
+        )
+    with col3:
+        users = st.multiselect(
+            "User", sorted({s.user for s in st.session_state.schedule_index.schedules.values() if s.user}),
+            key="timeline_users"
+        )
 
-        st.markdown(
-            f'<div class="test-item">📋 <b>{schedule["test_id"]}</b> | 👤 {schedule["user"]} | '
-            f'📊 {schedule["load_percentage"]}% | 🗓 {start_str} ➔ {end_str}{extra_info}'
-            + (f'<br>🟦 Progress: {progression}%'
-               f'<div class="progress-bar"><div class="progress-fill" style="width:{progression}%;"></div></div>'
-                if progression is not None else '')
-            + '</div>',
-            unsafe_allow_html=True
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start = st.date_input("From", value=date.today(), key="timeline_start")
+    with col2:
+        weeks = st.selectbox("Horizon", TIMELINE_WEEKS, index=2, format_func=lambda w: f"{w} weeks",
+                             key="timeline_weeks")
+    with col3:
+        color_by = st.selectbox("Colour by", TIMELINE_COLOR_BY, key="timeline_color")
+    end = start + timedelta(weeks=weeks, days=-1)
+
+    eq_ids = [
+        eq_id for eq_id, eq in sorted(equipment_data.items())
+        if (not groups or eq.type in groups) and (not locations or eq.location in locations)
+    ]
+    bars = timeline_frame(eq_ids, start, end, set(users))
+    if bars.empty:
+        st.info("Nothing is booked for this selection.")
+        return
+
+    shown = [eq_id for eq_id in eq_ids if eq_id in set(bars['Equipment'])]
+    fig = px.timeline(
+        bars, x_start='Start', x_end='Finish', y='Equipment', color=color_by,
+        hover_data={'Test ID': True, 'User': True, 'Load %': True, 'Status': True,
+                    'Start': '|%Y-%m-%d', 'Finish': False, 'Equipment': False},
+        category_orders={'Equipment': shown},
+    )
+    fig.update_traces(opacity=0.85)
+    fig.update_xaxes(range=[pd.Timestamp(start), pd.Timestamp(end + timedelta(days=1))])
+    fig.add_vline(x=pd.Timestamp(date.today()), line_dash="dot", line_color="#dc3545")
+    fig.update_layout(height=max(300, 120 + 28 * len(shown)), barmode='overlay',
+                      margin=dict(l=10, r=10, t=30, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    idle = len(eq_ids) - len(shown)
+    st.caption(
+        f"{len(bars)} bookings on {len(shown)} equipment from {start:%d %b %Y} to {end:%d %b %Y}"
+        + (f"; {idle} equipment have nothing booked." if idle else ".")
+    )
+
+
+# -------------- Modal: Test History ----------------
+@st.dialog("Test History")
+def test_history_modal():
+    st.markdown("### 📚 Test History")
+
+    months = archive_months()
+    if not months:
+        st.info("No completed or cancelled tests have been archived yet.")
+    else:
+        month = st.selectbox(
+            "Month archived",
+            options=months,
+            format_func=lambda m: datetime.strptime(m, ARCHIVE_MONTH_FORMAT).strftime("%B %Y"),
+            key="history_month"
         )
+        # Only the selected month's partition is read
+        df = archive_frame(load_archive_partition(month))
+        if not df.empty:
+            st.dataframe(df, height=400, hide_index=True)
+        st.caption(f"{len(df)} tests archived in this month")
 
-    col_chart, col_buttons = st.columns([1, 3])
-    with col_chart:
-        fig = create_mini_donut(eq_data['load_percentage'], 60)
-        st.plotly_chart(fig, config={'displayModeBar': False}, use_container_width=True, key=f"chart_{eq_id}")
-    with col_buttons:
-        col_schedule, col_calendar, col_settings, col_edit = st.columns(4)
-        with col_schedule:
-            if st.button("📅", key=f"schedule_btn_{eq_id}", help="Schedule Test"):
-                reset_all_modals()
-                st.session_state.show_schedule_form = eq_id
-                st.rerun()
-        with col_calendar:
-            if st.button("📆", key=f"calendar_btn_{eq_id}", help="View Calendar"):
-                reset_all_modals()
-                st.session_state.show_calendar = eq_id
+        st.markdown("#### Export History")
+        # The date filter runs in the store; only matching tests are read, a chunk at a time
+        export_dates = st.date_input("Tests running between (all when empty)", value=[], key="history_export_dates")
+        start = export_dates[0] if export_dates else None
+        end = export_dates[-1] if export_dates else None
+        export_controls("history_export", ARCHIVE_COLUMNS, lambda: archive_export_chunks(start, end),
+                        "ltcms_test_history")
+
+    if st.button("❌ Close", key="close_history_modal", use_container_width=True):
+        st.rerun()
+
+# -------------- Modal: Waitlist ----------------
+def add_to_waitlist(eq_type, test_id, user, duration, load_percentage, priority, earliest=None, units=0,
+                    description='', test_parameters=None):
+    entry = WaitlistEntry(
+        entry_id=str(uuid.uuid4()),
+        eq_type=eq_type,
+        test_id=test_id,
+        user=user,
+        duration=duration,
+        load_percentage=load_percentage,
+        priority=priority,
+        earliest=earliest,
+        units=units,
+        description=description,
+        test_parameters=dict(test_parameters or EQUIPMENT_GROUPS[eq_type].get('defaults', {})),
+        created_at=datetime.now(),
+    )
+    st.session_state.waitlist.push(entry)
+    save_app_state()
+    return entry
+
+@st.dialog("Waitlist", width="large")
+def waitlist_modal():
+    st.markdown("### ⏳ Waitlist")
+    st.caption("Waiting tests are booked automatically, highest priority and oldest first, "
+               "when a test on equipment of their type completes, is cancelled or is deleted.")
+    waitlist = st.session_state.waitlist
+    types = [k for k in EQUIPMENT_GROUPS if k != 'ALL']
+
+    df_data = []
+    for eq_type in types:
+        for position, entry in enumerate(waitlist.waiting(eq_type), start=1):
+            df_data.append({
+                "Type": EQUIPMENT_GROUPS[eq_type]['name'],
+                "#": position,
+                "Test ID": entry.test_id,
+                "User": entry.user,
+                "Priority": entry.priority,
+                "Days": entry.duration,
+                "Load %": entry.load_percentage,
+                "Earliest": str(entry.earliest) if entry.earliest else "",
+                "Waiting Since": entry.created_at.strftime("%Y-%m-%d %H:%M") if entry.created_at else "",
+                "Index": entry.entry_id,
+            })
+    if df_data:
+        df = pd.DataFrame(df_data)
+        st.dataframe(df.drop(columns=["Index"]), height=250, hide_index=True)
+        col_pick, col_remove = st.columns([3, 1])
+        with col_pick:
+            entry_id = st.selectbox("Select a waiting test", options=df["Index"], key="waitlist_selected",
+                                    format_func=lambda x: f"{waitlist.entries[x].test_id} - {waitlist.entries[x].user}")
+        with col_remove:
+            st.write("")
+            if st.button("🗑️ Remove", key="waitlist_remove", use_container_width=True):
+                removed = waitlist.remove(entry_id)
+                save_app_state()
+                st.success(f"{removed.test_id} removed from the waitlist.")
                 st.rerun()
-        with col_settings:
-            if st.button("⚙️", key=f"settings_btn_{eq_id}", help="Settings"):
-                reset_all_modals()
-                st.session_state.show_settings = eq_id
+    else:
+        st.info("Nobody is waiting.")
+
+    st.markdown("#### Add a Waiting Test")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        eq_type = st.selectbox("Equipment Type", types, format_func=lambda t: EQUIPMENT_GROUPS[t]['name'], key="waitlist_type")
+        test_id = st.text_input("Test ID", key="waitlist_test_id")
+        user = st.text_input("User", key="waitlist_user")
+    with col2:
+        duration = st.number_input("Days", min_value=1, max_value=365, value=7, key="waitlist_days")
+        load_percentage = st.slider("Load Percentage (%)", 1, 100, 50, 1, key="waitlist_load")
+        units = 0
+        if eq_type in ALLOCATED_UNITS:
+            units = st.number_input(f"{ALLOCATED_UNITS[eq_type][1]} needed", min_value=1, max_value=32, value=1, key="waitlist_units")
+    with col3:
+        priority = st.selectbox("Priority", PRIORITY_OPTIONS, index=1, key="waitlist_priority")
+        earliest = st.date_input("Earliest Start", value=date.today(), key="waitlist_earliest")
+        description = st.text_input("Description", key="waitlist_description")
+
+    col_add, col_close = st.columns(2)
+    with col_add:
+        if st.button("➕ Add to Waitlist", type="primary", use_container_width=True):
+            if not test_id or not user:
+                st.error("Please fill in Test ID and User name")
+            else:
+                add_to_waitlist(eq_type, test_id, user, int(duration), load_percentage, priority, earliest,
+                                int(units), description)
+                st.success(f"✅ {test_id} is waiting for {EQUIPMENT_GROUPS[eq_type]['name']}.")
                 st.rerun()
-        with col_edit:
-            if st.button("✏️", key=f"edit_btn_{eq_id}", help="Edit Equipment"):
-                reset_all_modals()
-                st.session_state.show_edit_equipment = eq_id
+    with col_close:
+        if st.button("❌ Close", key="close_waitlist_modal", use_container_width=True):
+            st.rerun()
+
+# -------------- Modal: Batch Scheduler ----------------
+def batch_requests_from_table(df, today):
+    """Turn the request table into ({request_id: row}, [Request], [error]); blank rows are skipped."""
+    def cell_date(value):
+        return None if value is None or pd.isna(value) else pd.Timestamp(value).date()
+
+    rows, batch, errors = {}, [], []
+    for n, record in enumerate(df.to_dict("records"), start=1):
+        if all(v is None or v == "" or (not isinstance(v, str) and pd.isna(v)) for v in record.values()):
+            continue
+        eq_type = record.get("Equipment Type")
+        test_id = (record.get("Test ID") or "").strip()
+        user = (record.get("User") or "").strip()
+        days = record.get("Days")
+        load = record.get("Load %")
+        if not test_id or not user:
+            errors.append(f"Row {n}: Test ID and User are required.")
+            continue
+        if eq_type not in EQUIPMENT_GROUPS or eq_type == 'ALL':
+            errors.append(f"Row {n}: choose an equipment type.")
+            continue
+        if days is None or pd.isna(days) or int(days) < 1:
+            errors.append(f"Row {n}: Days must be at least 1.")
+            continue
+        if load is None or pd.isna(load) or not 1 <= int(load) <= 100:
+            errors.append(f"Row {n}: Load % must be between 1 and 100.")
+            continue
+        units = record.get("Channels/Plates")
+        units = int(units) if units is not None and not pd.isna(units) else 1
+        earliest = cell_date(record.get("Earliest Start")) or today
+        due = cell_date(record.get("Due Date"))
+        request_id = str(n)
+        rows[request_id] = {
+            'test_id': test_id,
+            'user': user,
+            'load': int(load),
+            'priority': record.get("Priority") or "Medium",
+            'description': record.get("Description") or "",
+        }
+        batch.append(Request(
+            request_id=request_id,
+            eq_type=eq_type,
+            duration=int(days),
+            load=int(load),
+            priority=rows[request_id]['priority'],
+            earliest=max(earliest, today),
+            due=due,
+            units=units if eq_type in ALLOCATED_UNITS else 0,
+        ))
+    return rows, batch, errors
+
+@st.dialog("Batch Scheduler", width="large")
+def batch_scheduler_modal():
+    st.markdown("### 🗓️ Batch Scheduler")
+    st.caption("Each request is placed on the equipment of its type where it finishes first, "
+               "without taking any day over 100% or sharing channels/plates. Nothing is booked until you commit.")
+    types = [k for k in EQUIPMENT_GROUPS if k != 'ALL']
+    table = pd.DataFrame({
+        "Test ID": pd.Series(dtype="object"),
+        "User": pd.Series(dtype="object"),
+        "Equipment Type": pd.Series(dtype="object"),
+        "Days": pd.Series(dtype="Int64"),
+        "Load %": pd.Series(dtype="Int64"),
+        "Channels/Plates": pd.Series(dtype="Int64"),
+        "Priority": pd.Series(dtype="object"),
+        "Earliest Start": pd.Series(dtype="datetime64[ns]"),
+        "Due Date": pd.Series(dtype="datetime64[ns]"),
+        "Description": pd.Series(dtype="object"),
+    })
+    edited = st.data_editor(
+        table,
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        key="batch_requests",
+        column_config={
+            "Equipment Type": st.column_config.SelectboxColumn(
+                options=types, required=True),
+            "Days": st.column_config.NumberColumn(min_value=1, max_value=365, step=1, required=True),
+            "Load %": st.column_config.NumberColumn(min_value=1, max_value=100, step=1, default=50),
+            "Channels/Plates": st.column_config.NumberColumn(
+                min_value=1, max_value=32, step=1, help="Pulse testers and vibration tables only; defaults to 1"),
+            "Priority": st.column_config.SelectboxColumn(
+                options=PRIORITY_OPTIONS, default="Medium"),
+            "Earliest Start": st.column_config.DateColumn(help="Defaults to today"),
+            "Due Date": st.column_config.DateColumn(help="Last day the test should end; defaults to the earliest possible end"),
+        },
+    )
+    budget = st.select_slider("Improvement time (seconds)", options=BATCH_BUDGETS, value=2, key="batch_budget",
+                              help="Time spent trying better orders after the quick first placement; 0 keeps the first placement")
+
+    today = date.today()
+    fingerprint = (edited.to_json(), budget, today)
+    rows, batch, errors = batch_requests_from_table(edited, today)
+    for error in errors:
+        st.error(error)
+
+    col_preview, col_commit, col_close = st.columns(3)
+    with col_preview:
+        if st.button("🔍 Preview Plan", type="primary", use_container_width=True, disabled=not batch or bool(errors)):
+            with st.spinner("Placing tests..."):
+                machines = batch_machines({r.eq_type for r in batch}, today)
+                plan = plan_batch(batch, machines, today, budget)
+            st.session_state.batch_plan = {'fingerprint': fingerprint, 'plan': plan, 'rows': rows}
+
+    preview = st.session_state.get('batch_plan')
+    if preview and preview['fingerprint'] != fingerprint:
+        # The requests changed since the preview
+        preview = None
+    if preview:
+        plan = preview['plan']
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Placed", f"{len(plan.placements)} / {len(preview['rows'])}")
+        m2.metric("Unplaced", len(plan.unplaced))
+        m3.metric("All done by", f"{plan.makespan:%Y-%m-%d}" if plan.makespan else "-")
+        m4.metric("Weighted days late", plan.lateness)
+        if plan.orders_tried > 1:
+            st.caption(f"Improvement pass: {plan.orders_tried} orders tried in {plan.seconds:.1f}s, "
+                       f"cost {plan.greedy_cost} → {plan.cost}")
+        df_data = []
+        for p in plan.placements:
+            row = preview['rows'][p.request_id]
+            df_data.append({
+                "Test ID": row['test_id'],
+                "Equipment": p.eq_id,
+                "Start Date": str(p.start),
+                "End Date": str(p.end),
+                "Load %": row['load'],
+                "Channels/Plates": format_units(p.units),
+                "Priority": row['priority'],
+                "Days Late": p.days_late,
+            })
+        if df_data:
+            st.dataframe(pd.DataFrame(df_data), height=300, hide_index=True)
+        if plan.unplaced:
+            unplaced = ', '.join(preview['rows'][r]['test_id'] for r in plan.unplaced)
+            st.warning(f"⚠️ No equipment can take these within the planning horizon: {unplaced}")
+
+    with col_commit:
+        if st.button("✅ Commit Plan", use_container_width=True, disabled=not (preview and preview['plan'].placements)):
+            stale = commit_batch_plan(preview['plan'], preview['rows'])
+            st.session_state.pop('batch_plan', None)
+            if stale:
+                st.error("Bookings changed since the preview; nothing was scheduled. Preview again. Affected: "
+                         + ', '.join(f"{preview['rows'][p.request_id]['test_id']} on {p.eq_id}" for p in stale))
+            else:
+                st.success(f"✅ {len(preview['plan'].placements)} tests scheduled.")
                 st.rerun()
+    with col_close:
+        if st.button("❌ Close", key="close_batch_modal", use_container_width=True):
+            st.session_state.pop('batch_plan', None)
+            st.rerun()
 
-    st.markdown('</div>', unsafe_allow_html=True)
-# -------------- Main function -----------------------------
-def main():
-    # Show modals
-    if st.session_state.show_add_equipment: 
+# -------------- Modal: Import Test Plan ----------------
+# Headers are matched case-insensitively ("Load %" -> load_percentage); test
+# parameter columns use the parameter keys (e.g. max_temperature) and fall
+# back to the equipment type's defaults.
+IMPORT_REQUIRED = ['equipment_id', 'test_id', 'user', 'start_date', 'end_date', 'load_percentage']
+IMPORT_ALIASES = {
+    'equipment': 'equipment_id',
+    'load': 'load_percentage',
+    'start': 'start_date',
+    'end': 'end_date',
+    'channels_plates': 'units',
+}
+IMPORT_TEMPLATE = (
+    "Equipment ID,Test ID,User,Start Date,End Date,Load %,Priority,Description,Channels/Plates,max_temperature\n"
+    "xEVPT1,LTC-2025-001,J. Cruz,2025-09-01,2025-09-07,50,Medium,Example row,1-2,\n"
+)
+def read_test_plan(uploaded):
+    """Read an uploaded CSV or Excel plan; columns get the normalized names above."""
+    if uploaded.name.lower().endswith('.xlsx'):
+        df = pd.read_excel(uploaded, dtype=object)
+    else:
+        df = pd.read_csv(uploaded, dtype=object, skipinitialspace=True)
+    names = [re.sub(r'[^a-z0-9]+', '_', str(c).lower()).strip('_') for c in df.columns]
+    names = [IMPORT_ALIASES.get(n, n) for n in names]
+    repeated = sorted({str(c) for c, n in zip(df.columns, names) if names.count(n) > 1})
+    if repeated:
+        raise ValueError(f"columns {', '.join(repeated)} mean the same thing; keep only one of them")
+    df.columns = names
+    # Index + 2 is the row number in the file (after the header)
+    return df.dropna(how='all')
+
+def validate_test_plan(df, equipment_data, schedule_index):
+    """Check all rows of an imported plan column by column.
+
+    Returns (valid, errors): `valid` has the parsed columns of the rows
+    that passed every check, `errors` maps file row numbers to problems.
+    Rows are also checked against the existing bookings and each other, in
+    file order: a row may not take a day over 100% or reuse a channel/plate
+    booked before it. Units come from a Channels or Plates column, whichever
+    fits the row's equipment, or from a combined Channels/Plates column.
+    """
+    def column(name):
+        return df[name] if name in df else pd.Series(None, index=df.index, dtype=object)
+
+    def text(name):
+        values = column(name)
+        return values.where(values.notna(), '').astype(str).str.strip()
+
+    eq_id, test_id, user = text('equipment_id'), text('test_id'), text('user')
+    eq_type = eq_id.map({k: v.type for k, v in equipment_data.items()})
+    start = pd.to_datetime(column('start_date'), errors='coerce', format='mixed')
+    end = pd.to_datetime(column('end_date'), errors='coerce', format='mixed')
+    load = pd.to_numeric(column('load_percentage'), errors='coerce')
+    priority = text('priority').str.title().replace('', 'Medium')
+    kind = eq_type.map(lambda t: ALLOCATED_UNITS[t][0] if t in ALLOCATED_UNITS else None)
+    unit_text = text('units')
+    for name in ('channels', 'plates'):
+        given = text(name)
+        # Equipment without units takes either, so the row is flagged below
+        fits = ((kind == name) | kind.isna()) & (given != '')
+        unit_text = unit_text.where(~fits, given)
+    units = unit_text.map(lambda t: parse_units(t) if t else [])
+    capacity = eq_id.map({
+        k: getattr(v, ALLOCATED_UNITS[v.type][0]) or ALLOCATED_UNITS[v.type][2]
+        for k, v in equipment_data.items() if v.type in ALLOCATED_UNITS
+    })
+    allocated = capacity.notna()
+    highest = units.map(lambda u: max(u) if u else 0)
+
+    checks = [
+        (eq_id == '', "Equipment ID is missing"),
+        ((eq_id != '') & eq_type.isna(), "no such equipment"),
+        (test_id == '', "Test ID is missing"),
+        (user == '', "User is missing"),
+        (start.isna(), "Start Date is missing or not a date"),
+        (end.isna(), "End Date is missing or not a date"),
+        (start > end, "Start Date is after End Date"),
+        (load.isna() | (load < 1) | (load > 100) | (load % 1 != 0), "Load % must be a whole number from 1 to 100"),
+        (~priority.isin(PRIORITY_OPTIONS), "Priority must be Low, Medium, High or Critical"),
+        (units.isna(), "Channels/Plates must look like 1-3, 5"),
+        (allocated & units.notna() & (highest == 0), "Channels/Plates are required for this equipment"),
+        (allocated & (highest > capacity), "Channels/Plates exceed what the equipment has"),
+        (eq_type.notna() & ~allocated & (unit_text != ''), "this equipment has no channels or plates"),
+        (pd.DataFrame({'e': eq_id, 't': test_id, 's': start}).duplicated(), "duplicate of an earlier row"),
+    ]
+    params = {}
+    for param, (low, high) in PARAMETER_RANGES.items():
+        if param in df:
+            given = text(param) != ''
+            params[param] = pd.to_numeric(column(param), errors='coerce').where(given)
+            checks.append((given & (params[param].isna() | (params[param] < low) | (params[param] > high)),
+                           f"{get_parameter_display_name(param)} must be between {low} and {high}"))
+    if 'min_temperature' in params and 'max_temperature' in params:
+        checks.append((params['min_temperature'] > params['max_temperature'], "Min Temp is above Max Temp"))
+
+    flagged = [pd.Series(message, index=df.index[mask.fillna(False).astype(bool)]) for mask, message in checks]
+    problems = pd.concat(flagged) if flagged else pd.Series(dtype=object)
+    errors = {i + 2: list(messages) for i, messages in problems.groupby(level=0)}
+
+    valid = pd.DataFrame({
+        'equipment_id': eq_id, 'type': eq_type, 'test_id': test_id, 'user': user,
+        'start_date': start.dt.date, 'end_date': end.dt.date, 'load_percentage': load,
+        'priority': priority, 'description': text('description'), 'units': units,
+    }).drop(index=problems.index.unique())
+    valid['load_percentage'] = valid['load_percentage'].astype(int)
+    valid['test_parameters'] = [
+        {p: (float(params[p][i]) if p in params and pd.notna(params[p][i]) else v)
+         for p, v in EQUIPMENT_GROUPS.get(t, {}).get('defaults', {}).items()}
+        for i, t in zip(valid.index, valid['type'])
+    ]
+
+    # Capacity against the existing bookings and the valid rows accepted before
+    clashes = {}
+    for eq, rows in valid.groupby('equipment_id'):
+        first, last = rows['start_date'].min(), rows['end_date'].max()
+        existing = [(s.start_date, s.end_date, s.load_percentage)
+                    for s in schedule_index.overlapping(eq, first, last)]
+        units_kind = ALLOCATED_UNITS[rows['type'].iloc[0]][0] if rows['type'].iloc[0] in ALLOCATED_UNITS else None
+        accepted = []  # (start, end, load, mask) of the rows kept so far
+        for i, row in rows.iterrows():
+            start, end = row['start_date'], row['end_date']
+            found = []
+            others = existing + [(a, b, level) for a, b, level, _ in accepted]
+            steps = sweep_load([(max(a, start), min(b, end), level) for a, b, level in others
+                                if a <= end and b >= start] + [(start, end, row['load_percentage'])])
+            hit = next(((day, level) for day, level in steps if level > 100), None)
+            if hit:
+                found.append(f"{eq} would be at {hit[1]}% on {hit[0]:%Y-%m-%d}")
+            mask = 0
+            if units_kind:
+                mask = units_mask(row['units'])
+                used = 0
+                for _, booked in schedule_index.occupancy(eq, start, end, units_kind):
+                    used |= booked
+                for a, b, _, other in accepted:
+                    if a <= end and b >= start:
+                        used |= other
+                if used & mask:
+                    found.append(
+                        f"{ALLOCATED_UNITS[row['type']][1].lower()} {format_units(mask_units(used & mask))} already booked")
+            if found:
+                clashes[i + 2] = found
+            else:
+                accepted.append((start, end, row['load_percentage'], mask))
+    for row_number, messages in clashes.items():
+        errors.setdefault(row_number, []).extend(messages)
+    valid = valid.drop(index=[n - 2 for n in clashes])
+    return valid, dict(sorted(errors.items()))
+
+def apply_test_plan(valid):
+    """Book every validated row; one state change and one save for the whole plan."""
+    created_at = datetime.now()
+    booked = []
+    for row in valid.itertuples(index=False):
+        schedule = Schedule(
+            schedule_id=str(uuid.uuid4()),
+            test_id=row.test_id,
+            user=row.user,
+            start_date=row.start_date,
+            end_date=row.end_date,
+            load_percentage=row.load_percentage,
+            priority=row.priority,
+            description=row.description,
+            test_parameters=row.test_parameters,
+            status='Scheduled',
+            created_at=created_at,
+        )
+        if row.type in ALLOCATED_UNITS:
+            setattr(schedule, ALLOCATED_UNITS[row.type][0], row.units)
+        booked.append((row.equipment_id, schedule))
+    book_schedules(booked)
+
+@st.dialog("Import Test Plan", width="large")
+def import_test_plan_modal():
+    st.markdown("### 📥 Import Test Plan")
+    st.caption("One test per row: Equipment ID, Test ID, User, Start Date, End Date and Load % are required; "
+               "Priority, Description, Channels/Plates (e.g. 1-3) and test parameter columns are optional.")
+    st.download_button("⬇️ Download CSV template", IMPORT_TEMPLATE, file_name="ltcms_test_plan.csv",
+                       mime="text/csv")
+    uploaded = st.file_uploader("CSV or Excel file", type=['csv', 'xlsx'], key="import_plan_file")
+
+    if uploaded is not None:
+        try:
+            df = read_test_plan(uploaded)
+        except Exception as e:
+            st.error(f"Could not read {uploaded.name}: {e}")
+            df = None
+        missing = [c for c in IMPORT_REQUIRED if df is not None and c not in df]
+        if missing:
+            st.error("Missing columns: " + ', '.join(missing))
+        elif df is not None:
+            valid, errors = validate_test_plan(df, st.session_state.equipment_data, st.session_state.schedule_index)
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Rows", len(df))
+            m2.metric("Ready to import", len(valid))
+            m3.metric("With errors", len(errors))
+            if errors:
+                st.markdown("#### Rows with errors")
+                st.dataframe(pd.DataFrame([
+                    {"Row": n, "Equipment": df.at[n - 2, 'equipment_id'], "Test ID": df.at[n - 2, 'test_id'],
+                     "Problems": '; '.join(messages)}
+                    for n, messages in errors.items()
+                ]), height=250, hide_index=True)
+            if len(valid):
+                if st.button(f"✅ Import {len(valid)} tests", type="primary", use_container_width=True):
+                    apply_test_plan(valid)
+                    st.success(f"✅ {len(valid)} tests scheduled.")
+                    st.rerun()
+
+    if st.button("❌ Close", key="close_import_modal", use_container_width=True):
+        st.rerun()
+
+# -------------- Render Equipment Card with Progression (#4) -----------------------
+# A card's static content is one Markdown element built from these templates;
+# only the action buttons under it are real widgets. The markup is kept on
+# single lines because indented HTML would be read as a Markdown code block.
+CARD_TEMPLATE = Template(
+    '<div class="equipment-card">'
+    '<div class="equipment-header">$icon $eq_id</div>'
+    '<div class="status-badge status-$status_class">$status</div>'
+    '$gauge'
+    '$overbooked'
+    '<div class="parameter-section"><div class="parameter-title">Equipment Parameters</div>$parameters</div>'
+    '$tests'
+    '</div>'
+)
+PARAMETER_TEMPLATE = Template('<div class="parameter-item">$label: <b>$value $unit</b></div>')
+OVERBOOKED_TEMPLATE = Template('<div class="overbooked">⚠️ Overbooked: $peak% on $day</div>')
+TEST_TEMPLATE = Template(
+    '<div class="test-item">📋 <b>$test_id</b> | 👤 $user | '
+    '📊 $load% | 🗓 $start ➔ $end$extra$progress</div>'
+)
+PROGRESS_TEMPLATE = Template(
+    '<br>🟦 Progress: $progression%'
+    '<div class="progress-bar"><div class="progress-fill" style="width:$progression%;"></div></div>'
+)
+
+def schedule_progression(schedule, today=None):
+    """Percent of a schedule's days elapsed, or None before it starts."""
+    sd, ed = schedule.start_date, schedule.end_date
+    total_days = (ed - sd).days + 1
+    elapsed_days = ((today or date.today()) - sd).days + 1
+    if total_days > 0 and elapsed_days > 0:
+        return min(max(int((elapsed_days / total_days) * 100), 0), 100)
+    return None
+
+def render_card_html(eq_id, eq_data, schedules, peak=None):
+    """Return the markup of one equipment card (everything but its buttons).
+
+    `peak` is the (load, day) of the equipment's busiest upcoming day.
+    """
+    group_info = EQUIPMENT_GROUPS[eq_data.type]
+    parameters = []
+    for param in group_info.get('display_params', []):
+        if param in eq_data.parameters:
+            parameters.append(PARAMETER_TEMPLATE.substitute(
+                label=get_parameter_display_name(param),
+                value=eq_data.parameters[param],
+                unit=get_parameter_unit(param),
+            ))
+    if eq_data.type == 'VIBRATION' and eq_data.plates is not None:
+        parameters.append(PARAMETER_TEMPLATE.substitute(label="Available Plates", value=eq_data.plates, unit=""))
+
+    # Scheduled tests (exclude completed ones)
+    tests = []
+    for schedule in schedules:
+        if schedule.status == 'Completed':
+            continue
+        extra = ""
+        if schedule.channels:
+            extra = f" | 📡 Ch: {','.join(map(str, schedule.channels))}"
+        elif schedule.plates:
+            extra = f" | 🔲 Plates: {','.join(map(str, schedule.plates))}"
+        if schedule.recurrence:
+            # A recurring test shows its current or next occurrence
+            extra += f" | 🔁 {escape(schedule.recurrence.describe())}"
+            schedule = next_occurrence(schedule) or schedule
+        progression = schedule_progression(schedule)
+        tests.append(TEST_TEMPLATE.substitute(
+            test_id=escape(schedule.test_id),
+            user=escape(schedule.user),
+            load=schedule.load_percentage,
+            start=schedule.start_date.strftime("%Y-%m-%d"),
+            end=schedule.end_date.strftime("%Y-%m-%d"),
+            extra=extra,
+            progress=PROGRESS_TEMPLATE.substitute(progression=progression) if progression is not None else "",
+        ))
+
+    return CARD_TEMPLATE.substitute(
+        icon=group_info['icon'],
+        eq_id=escape(eq_id),
+        status_class=eq_data.status.lower(),
+        status=eq_data.status,
+        gauge=load_gauge_svg(eq_data.load_percentage, 60),
+        overbooked=OVERBOOKED_TEMPLATE.substitute(peak=peak[0], day=peak[1].strftime("%Y-%m-%d"))
+                   if peak and peak[0] > 100 else "",
+        parameters="".join(parameters),
+        tests="".join(tests),
+    )
+
+@st.fragment
+def render_equipment_card(eq_id, eq_data):
+    """One grid card; its buttons open their dialog by rerunning just this card."""
+    peak = st.session_state.schedule_index.upcoming_peak(eq_id)
+    st.markdown(render_card_html(eq_id, eq_data, st.session_state.schedules.get(eq_id, []), peak),
+                unsafe_allow_html=True)
+
+    col_schedule, col_calendar, col_settings, col_edit = st.columns(4)
+    with col_schedule:
+        if st.button("📅", key=f"schedule_btn_{eq_id}", help="Schedule Test"):
+            schedule_test_modal(eq_id)
+    with col_calendar:
+        if st.button("📆", key=f"calendar_btn_{eq_id}", help="View Calendar"):
+            calendar_modal(eq_id)
+    with col_settings:
+        if st.button("⚙️", key=f"settings_btn_{eq_id}", help="Settings"):
+            equipment_settings_modal(eq_id)
+    with col_edit:
+        if st.button("✏️", key=f"edit_btn_{eq_id}", help="Edit Equipment"):
+            edit_equipment_modal(eq_id)
+
+# -------------- Sidebar -----------------------------
+@st.fragment
+def render_sidebar_controls():
+    if st.button("➕ Add New Equipment", use_container_width=True):
         add_equipment_modal()
-    if st.session_state.show_schedule_form is not None: 
-        schedule_test_modal(st.session_state.show_schedule_form)
-    if st.session_state.show_settings is not None: 
-        equipment_settings_modal(st.session_state.show_settings)
-    if st.session_state.show_test_status: 
+
+    if st.button("📋 Manage Active Tests", use_container_width=True):
         test_status_modal()
-    if st.session_state.show_edit_equipment is not None:
-        edit_equipment_modal(st.session_state.show_edit_equipment)
-    if st.session_state.show_all_schedules:
+
+    if st.button("📊 See All Schedules", use_container_width=True):
         all_schedules_modal()
+
+    if st.button("📚 Test History", use_container_width=True):
+        test_history_modal()
+
+    if st.button("📆 Lab Timeline", use_container_width=True):
+        timeline_modal()
+
+    if st.button("🗓️ Batch Scheduler", use_container_width=True):
+        batch_scheduler_modal()
+
+    waiting = len(st.session_state.waitlist)
+    if st.button(f"⏳ Waitlist ({waiting})" if waiting else "⏳ Waitlist", use_container_width=True):
+        waitlist_modal()
+
+    if st.button("📥 Import Test Plan", use_container_width=True):
+        import_test_plan_modal()
+
+@st.fragment
+def render_sidebar_analytics():
+    """Sidebar metrics and utilization chart; not rerun by dashboard, card or dialog interactions."""
+    aggregates = st.session_state.aggregates
+    totals = aggregates.group('ALL')
+    total_equipment = totals.equipment
+    st.metric("Total Equipment", total_equipment)
+    st.metric("Active Schedules", totals.active_tests)
+    st.metric("Completed Tests", totals.completed_tests)
+    if total_equipment > 0:
+        avg_utilization = totals.load_total / total_equipment
+        st.metric("Avg Utilization", f"{avg_utilization:.1f}%")
+    if total_equipment > 0:
+        st.markdown("---")
+        st.markdown("**📈 Utilization Chart**")
+        fig = aggregates.utilization_figure(st.session_state.equipment_data)
+        st.plotly_chart(fig, use_container_width=True)
+
+# -------------- Main function -----------------------------
+def main():
+    # Dialogs are opened directly by the button that asks for them; only a
+    # dialog requested from inside another dialog waits for the next app run
     if st.session_state.show_calendar is not None:
-        calendar_modal(st.session_state.show_calendar)
+        equipment_id = st.session_state.show_calendar
+        st.session_state.show_calendar = None
+        calendar_modal(equipment_id)
 
     st.title("🏭 LTCMS - Lipa Technical Center Management System")
     st.markdown("**Real-time Equipment & Test Management Dashboard**")
@@ -1274,53 +4719,35 @@ def main():
             caption="Lipa Technical Center"
         )
         st.header("🔧 System Controls")
-        if st.button("➕ Add New Equipment", use_container_width=True):
-            reset_all_modals()
-            st.session_state.show_add_equipment = True
-            st.rerun()
-
-        if st.button("📋 Manage Active Tests", use_container_width=True):
-            reset_all_modals()
-            st.session_state.show_test_status = True
-            st.rerun()
-
-        if st.button("📊 See All Schedules", use_container_width=True):
-            reset_all_modals()
-            st.session_state.show_all_schedules = True
-            st.rerun()
+        render_sidebar_controls()
 
         st.markdown("---")
-        st.markdown("**🔍 Search Equipment**")
-        search_term = st.text_input("", placeholder="Search by ID or name...", key="equipment_search")
+        st.markdown("**🔍 Search Equipment & Tests**")
+        search_term = st.text_input("", placeholder="ID, name, test, user, parameter...", key="equipment_search")
+        if search_term.lower() != st.session_state.search_term:
+            st.session_state.grid_focus = None
         st.session_state.search_term = search_term.lower()
+        if search_term.strip():
+            render_search_results(search_term)
         st.markdown("---")
         if st.button("🔄 Refresh Dashboard", use_container_width=True): 
             cleanup_completed_tests()
+            refresh_equipment_loads()
             st.rerun()
+        render_save_indicator()
 
         st.markdown("---")
-        total_equipment = len(st.session_state.equipment_data)
-        total_schedules = sum(len([s for s in schedules if s.get('status') != 'Completed']) 
-                              for schedules in st.session_state.schedules.values())
-        completed_tests = sum(len([s for s in schedules if s.get('status') == 'Completed']) 
-                              for schedules in st.session_state.schedules.values())
-        st.metric("Total Equipment", total_equipment)
-        st.metric("Active Schedules", total_schedules)
-        st.metric("Completed Tests", completed_tests)
-        if total_equipment > 0:
-            avg_utilization = sum(eq['load_percentage'] for eq in st.session_state.equipment_data.values()) / total_equipment
-            st.metric("Avg Utilization", f"{avg_utilization:.1f}%")
-        if total_equipment > 0:
-            st.markdown("---")
-            st.markdown("**📈 Utilization Chart**")
-            equipment_names = list(st.session_state.equipment_data.keys())
-            utilizations = [st.session_state.equipment_data[eq]['load_percentage'] for eq in equipment_names]
-            fig = px.bar(x=equipment_names, y=utilizations, 
-                         title="Equipment Utilization %", color=utilizations,
-                         color_continuous_scale="RdYlGn_r")
-            fig.update_layout(height=300, showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
+        render_sidebar_analytics()
+
+    render_dashboard()
+    render_forecast()
 
+@st.fragment
+def render_dashboard():
+    """Summary cards, group selector, equipment grid and schedule overview.
+
+    Group, sort and paging controls rerun only this fragment.
+    """
     # Summary cards
     st.markdown("## 📊 System Dashboard")
     if not st.session_state.equipment_data:
@@ -1333,20 +4760,29 @@ def main():
     if group_filter == 'ALL':
         filtered_equipment = equipment
     else:
-        filtered_equipment = {k: v for k, v in equipment.items() if v['type'] == group_filter}
+        filtered_equipment = {k: v for k, v in equipment.items() if v.type == group_filter}
 
     filtered = filtered_equipment
-    if st.session_state.search_term:
-        filtered = {k: v for k, v in filtered.items()
-                    if st.session_state.search_term in k.lower() or
-                       st.session_state.search_term in v['name'].lower()}
+    if st.session_state.search_term.strip():
+        found = search_equipment_ids(st.session_state.search_term)
+        filtered = {k: v for k, v in filtered.items() if k in found}
+    focus = st.session_state.grid_focus
+    if focus in equipment:
+        filtered = {focus: equipment[focus]}
 
-    counts = {s: sum(1 for eq in filtered_equipment.values() if eq['status'] == s.capitalize())
+    aggregates = st.session_state.aggregates
+    if filtered is filtered_equipment:
+        group_totals = aggregates.group(group_filter)
+    else:
+        # A search or focused card narrows the cards to the equipment shown
+        group_totals = GroupSummary()
+        for eq_id in filtered:
+            summary = aggregates.equipment.get(eq_id)
+            if summary is not None:
+                group_totals.add(summary)
+    counts = {s: group_totals.status_counts.get(s.capitalize(), 0)
               for s in ['running', 'idle', 'maintenance', 'scheduled']}
-    total_active_tests = sum(
-        len([s for s in st.session_state.schedules.get(eqk, []) if s.get('status') != 'Completed'])
-        for eqk in filtered_equipment.keys()
-    )
+    total_active_tests = group_totals.active_tests
 
     cols = st.columns(5)
     styles = [
@@ -1369,15 +4805,15 @@ def main():
     grp_cols = st.columns(len(EQUIPMENT_GROUPS))
     for i, (gk, gi) in enumerate(EQUIPMENT_GROUPS.items()):
         with grp_cols[i]:
-            if st.button(f"{gi['icon']} {gi['name']}",
-                         key=f"group_{gk}",
-                         type="primary" if st.session_state.selected_group == gk else "secondary"):
-                reset_all_modals()
-                st.session_state.selected_group = gk
-                st.rerun()
+            st.button(f"{gi['icon']} {gi['name']}",
+                      key=f"group_{gk}",
+                      type="primary" if st.session_state.selected_group == gk else "secondary",
+                      on_click=select_group, args=(gk,))
 
     # Equipment grid
     st.markdown("## 🏭 Equipment Status")
+    if focus in equipment:
+        st.button(f"✖ Showing {focus} only - show all equipment", key="clear_grid_focus", on_click=clear_grid_focus)
     if not filtered:
         if st.session_state.search_term:
             st.info(f"No equipment found matching '{st.session_state.search_term}'. Try a different search term.")
@@ -1386,65 +4822,115 @@ def main():
             st.info(f"No equipment found in '{name}' group. Add some equipment to get started!")
         return
 
-    st.markdown('<div class="equipment-grid">', unsafe_allow_html=True)
-    items = list(filtered.items())
-    for row in range(0, len(items), 3):
+    col_sort, col_size, col_count = st.columns([2, 1, 2])
+    with col_sort:
+        sort_by = st.selectbox("Sort by", GRID_SORT_OPTIONS, key="grid_sort")
+    with col_size:
+        page_size = st.selectbox("Cards per page", GRID_PAGE_SIZES, key="grid_page_size")
+    # A different filter, sort or page size starts again from the first page
+    view = (st.session_state.selected_group, st.session_state.search_term, focus, sort_by, page_size)
+    if st.session_state.grid_view != view:
+        st.session_state.grid_view = view
+        st.session_state.grid_visible = page_size
+
+    items = sort_equipment(list(filtered.items()), sort_by)
+    visible = items[:st.session_state.grid_visible]
+    with col_count:
+        st.caption(f"Showing {len(visible)} of {len(items)} equipment")
+    for row in range(0, len(visible), 3):
         cols = st.columns(3)
         for idx in range(3):
-            if row + idx < len(items):
-                eq_id, eq_data = items[row + idx]
+            if row + idx < len(visible):
+                eq_id, eq_data = visible[row + idx]
                 with cols[idx]:
                     render_equipment_card(eq_id, eq_data)
-    st.markdown('</div>', unsafe_allow_html=True)
+    if len(visible) < len(items):
+        st.button(f"⬇️ Load more ({len(items) - len(visible)} remaining)", key="grid_load_more",
+                  on_click=show_more_equipment, use_container_width=True)
 
     # Active schedules overview table for filtered equipment only (#1)
-    active_schedules_exist = any(
-        any(s.get('status') != 'Completed' for s in st.session_state.schedules.get(eqk, []))
-        for eqk in filtered_equipment.keys()
-    )
+    active_schedules_exist = total_active_tests > 0
 
     if active_schedules_exist:
         st.markdown("---")
         st.markdown("## 📋 Active Schedules Overview")
         rows = []
-        for eq_id in filtered_equipment.keys():
+        for eq_id in filtered.keys():
             for s in st.session_state.schedules.get(eq_id, []):
-                if s.get('status') != 'Completed':
-                    sd, ed = s['start_date'], s['end_date']
+                if s.status != 'Completed':
+                    shown = next_occurrence(s) or s if s.recurrence else s
+                    sd, ed = shown.start_date, shown.end_date
                     row_data = {
                         'Equipment': eq_id,
-                        'Test ID': s['test_id'],
-                        'User': s['user'],
-                        'Start': sd.strftime('%Y-%m-%d') if hasattr(sd, 'strftime') else sd,
-                        'End': ed.strftime('%Y-%m-%d') if hasattr(ed, 'strftime') else ed,
-                        'Load %': s['load_percentage'],
-                        'Priority': s['priority'],
-                        'Status': s['status']
+                        'Test ID': s.test_id,
+                        'User': s.user,
+                        'Start': sd.strftime('%Y-%m-%d'),
+                        'End': ed.strftime('%Y-%m-%d'),
+                        'Load %': s.load_percentage,
+                        'Priority': s.priority,
+                        'Status': s.status
                     }
                     # Progression
-                    total_days = (parse_date(ed) - parse_date(sd)).days + 1
-                    elapsed_days = (date.today() - parse_date(sd)).days + 1
+                    total_days = (ed - sd).days + 1
+                    elapsed_days = (date.today() - sd).days + 1
                     progression = int((elapsed_days / total_days) * 100) if total_days > 0 else 0
                     row_data['Progress %'] = f"{min(max(progression, 0), 100)}%"
-                    if 'channels' in s:
-                        row_data['Channels'] = ', '.join(map(str, s['channels']))
-                    if 'plates' in s:
-                        row_data['Plates'] = ', '.join(map(str, s['plates']))
+                    if s.channels:
+                        row_data['Channels'] = ', '.join(map(str, s.channels))
+                    if s.plates:
+                        row_data['Plates'] = ', '.join(map(str, s.plates))
                     rows.append(row_data)
         if rows:
             df = pd.DataFrame(rows)
             st.dataframe(df, use_container_width=True, hide_index=True)
-            csv = df.to_csv(index=False)
-            st.download_button("📥 Export Active Schedule Data", data=csv,
+            st.download_button("📥 Export Active Schedule Data",
+                              data=lambda: write_export([df], 'CSV', list(df.columns)),
                               file_name=f"ltcms_active_schedules_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                              mime="text/csv")
+                              mime="text/csv", on_click="ignore")
 
     st.markdown("---")
     st.markdown(f"**LTCMS Dashboard Active** | **Last Update:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     if st.session_state.get('cleanup_notification'):
-        st.success("✅ Completed tests have been automatically removed from equipment schedules.")
+        st.success("✅ Completed and cancelled tests have been moved to the Test History archive.")
         st.session_state.cleanup_notification = False
+    for message in st.session_state.pop('waitlist_notification', []):
+        st.info(message)
+
+@st.fragment
+def render_forecast():
+    """Utilization forecast for the coming weeks; its controls rerun only this fragment."""
+    if not st.session_state.equipment_data:
+        return
+    forecast = st.session_state.forecast
+    if forecast.origin != date.today():
+        forecast.rebuild(st.session_state.equipment_data, st.session_state.schedules)
+
+    st.markdown("---")
+    st.markdown("## 📈 Utilization Forecast")
+    weeks = st.radio("Horizon", FORECAST_WEEKS, index=1, format_func=lambda w: f"{w} weeks",
+                     horizontal=True, key="forecast_weeks")
+    curves = forecast.group_curves(weeks).rename(columns=lambda g: EQUIPMENT_GROUPS.get(g, {}).get('name', g))
+    fig = px.line(curves, labels={'index': 'Date', 'value': 'Average booked load %', 'variable': 'Group'},
+                  title=f"Average booked load per group, next {weeks} weeks")
+    fig.add_hline(y=BOTTLENECK_LOAD, line_dash="dot", line_color="#dc3545")
+    fig.update_layout(height=350, yaxis_range=[0, 100])
+    st.plotly_chart(fig, use_container_width=True)
+
+    free = forecast.free_capacity(weeks)
+    st.markdown(f"**Free capacity (equipment-days, next {weeks} weeks)**")
+    cols = st.columns(len(free))
+    for col, (group, days) in zip(cols, free.items()):
+        info = EQUIPMENT_GROUPS.get(group, {'icon': '', 'name': group})
+        col.metric(f"{info['icon']} {info['name']}", f"{days:,.1f}")
+
+    bottlenecks = forecast.bottlenecks(weeks)
+    st.markdown(f"**Bottlenecks** (days booked at {BOTTLENECK_LOAD}% or more)")
+    if bottlenecks.empty:
+        st.caption("No equipment is that busy in this horizon.")
+    else:
+        bottlenecks['Type'] = bottlenecks['Type'].map(lambda t: EQUIPMENT_GROUPS.get(t, {}).get('name', t))
+        st.dataframe(bottlenecks, use_container_width=True, hide_index=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,330 @@
+"""Batch placement of test requests across the equipment of a type.
+
+A request asks for `duration` consecutive days at `load` percent (and, on
+pulse testers and vibration tables, `units` channels or plates) starting no
+earlier than `earliest`. plan_batch() places a batch on the machines of each
+request's type without taking any day over 100% or giving a unit to two
+tests at once, aiming at a short makespan and little priority-weighted
+lateness. LTCMS uses it for the Batch Scheduler dialog; it can also be
+benchmarked on synthetic fleets without the app:
+
+    python auto_scheduler.py bench --machines 40 --requests 300 --budget 2
+
+Placement is list scheduling: requests are taken in priority / due-date order
+and each goes to the machine where it finishes first. The optional
+improvement pass reorders that list (moving late or unplaced requests
+forward, swapping pairs) and re-places it, keeping orders that do not raise
+the cost, until the time budget runs out or the cost reaches its lower bound.
+"""
+import argparse
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Optional
+
+CAPACITY = 100
+PRIORITY_WEIGHTS = {'Low': 1, 'Medium': 2, 'High': 4, 'Critical': 8}
+# Cost of leaving a request unplaced, in weighted days of lateness
+UNPLACED_PENALTY = 10_000
+MAX_HORIZON_DAYS = 730
+
+
+@dataclass(slots=True)
+class Request:
+    request_id: str
+    eq_type: str
+    duration: int
+    load: int
+    priority: str = 'Medium'
+    earliest: Optional[date] = None
+    due: Optional[date] = None  # last day the test should end on; defaults to earliest + duration - 1
+    units: int = 0
+
+
+@dataclass(slots=True)
+class Machine:
+    eq_id: str
+    eq_type: str
+    capacity: int = 0  # channels / plates it has, 0 when units are not allocated
+    bookings: list = field(default_factory=list)  # (start, end, load, unit mask)
+
+
+@dataclass(slots=True)
+class Placement:
+    request_id: str
+    eq_id: str
+    start: date
+    end: date
+    units: list
+    days_late: int
+
+
+@dataclass(slots=True)
+class Plan:
+    placements: list
+    unplaced: list  # request ids that do not fit within the horizon
+    makespan: Optional[date]
+    lateness: int  # sum of days late x priority weight
+    cost: int
+    greedy_cost: int = 0
+    orders_tried: int = 1
+    seconds: float = 0.0
+
+
+def lowest_bits(mask, count):
+    """The `count` lowest set bits of `mask` as unit numbers (bit n-1 is unit n)."""
+    units = []
+    while mask and len(units) < count:
+        low = mask & -mask
+        units.append(low.bit_length())
+        mask ^= low
+    return units
+
+
+class Timeline:
+    """Per-day load and used-unit mask of one machine, indexed by days from the plan's origin."""
+
+    __slots__ = ('machine', 'load', 'used', 'full')
+
+    def __init__(self, machine, load, used):
+        self.machine = machine
+        self.load = load
+        self.used = used
+        self.full = (1 << machine.capacity) - 1
+
+    @classmethod
+    def build(cls, machine, origin, horizon):
+        load, used = [0] * horizon, [0] * horizon
+        for start, end, level, mask in machine.bookings:
+            for t in range(max((start - origin).days, 0), min((end - origin).days + 1, horizon)):
+                load[t] += level
+                used[t] |= mask
+        return cls(machine, load, used)
+
+    def copy(self):
+        return Timeline(self.machine, self.load[:], self.used[:])
+
+    def earliest_fit(self, t0, duration, load, units):
+        """(start, unit mask) of the first start >= t0 the request fits at, or None within the horizon."""
+        loads, used = self.load, self.used
+        limit = CAPACITY - load
+        s, last = t0, len(loads) - duration
+        while s <= last:
+            free = self.full
+            for t in range(s, s + duration):
+                if loads[t] > limit:
+                    # No window containing day t fits
+                    s = t + 1
+                    break
+                if units:
+                    free &= ~used[t]
+                    if free.bit_count() < units:
+                        s += 1
+                        break
+            else:
+                mask = 0
+                for n in lowest_bits(free, units):
+                    mask |= 1 << (n - 1)
+                return s, mask
+        return None
+
+    def book(self, start, duration, load, mask):
+        for t in range(start, start + duration):
+            self.load[t] += load
+            self.used[t] |= mask
+
+
+def _decode(order, base, origin, t0s, dues):
+    """Place `order` one request at a time on copies of the base timelines."""
+    lines = {eq_type: [line.copy() for line in group] for eq_type, group in base.items()}
+    placements, unplaced = [], []
+    lateness, last = 0, -1
+    for r in order:
+        best = None
+        for line in lines.get(r.eq_type, ()):
+            if r.units > line.machine.capacity:
+                continue
+            fit = line.earliest_fit(t0s[r.request_id], r.duration, r.load, r.units)
+            # Durations are equal across machines, so the earliest start finishes first
+            if fit is not None and (best is None or fit[0] < best[1]):
+                best = (line, fit[0], fit[1])
+        if best is None:
+            unplaced.append(r.request_id)
+            continue
+        line, start, mask = best
+        line.book(start, r.duration, r.load, mask)
+        end = start + r.duration - 1
+        days_late = max(end - dues[r.request_id], 0)
+        lateness += days_late * PRIORITY_WEIGHTS.get(r.priority, 1)
+        last = max(last, end)
+        placements.append((r.request_id, line.machine.eq_id, start, end, mask, days_late))
+    cost = lateness + last + 1 + UNPLACED_PENALTY * len(unplaced)
+    return cost, lateness, last, placements, unplaced
+
+
+def _order_key(r, dues):
+    return (-PRIORITY_WEIGHTS.get(r.priority, 1), dues[r.request_id], r.earliest, -r.duration * r.load)
+
+
+def plan_batch(requests, machines, today=None, budget=0.0, seed=0):
+    """Place `requests` on `machines`; spend up to `budget` seconds improving the greedy plan.
+
+    Requests may not start before today. Each machine's `bookings` are the
+    tests already on it and are never moved.
+    """
+    started = time.perf_counter()
+    origin = today or date.today()
+    t0s = {r.request_id: max(((r.earliest or origin) - origin).days, 0) for r in requests}
+    dues = {r.request_id: (r.due - origin).days if r.due else t0s[r.request_id] + r.duration - 1
+            for r in requests}
+    types = {r.eq_type for r in requests}
+    busy_until = max((end for m in machines if m.eq_type in types for _, end, _, _ in m.bookings),
+                     default=origin)
+    # Long enough to run every request back to back after all existing bookings
+    horizon = min(max(t0s.values(), default=0) + max((busy_until - origin).days + 1, 0)
+                  + sum(r.duration for r in requests) + 1, MAX_HORIZON_DAYS)
+    base = {}
+    for m in sorted(machines, key=lambda m: m.eq_id):
+        if m.eq_type in types:
+            base.setdefault(m.eq_type, []).append(Timeline.build(m, origin, horizon))
+
+    order = sorted(requests, key=lambda r: _order_key(r, dues))
+    best = _decode(order, base, origin, t0s, dues)
+    greedy_cost, tried = best[0], 1
+    # Nothing can finish earlier than its own earliest start allows
+    bound = max((t0s[r.request_id] + r.duration for r in requests), default=0)
+    rng = random.Random(seed)
+    deadline = started + budget
+    current = order
+    while len(order) > 1 and best[0] > bound and time.perf_counter() < deadline:
+        candidate = current[:]
+        days_late = {p[0]: p[5] for p in best[3]}
+        behind = [i for i, r in enumerate(candidate)
+                  if days_late.get(r.request_id, 1) > 0 and i > 0]
+        if behind and rng.random() < 0.7:
+            i = rng.choice(behind)
+            candidate.insert(rng.randrange(i), candidate.pop(i))
+        else:
+            i, j = rng.sample(range(len(candidate)), 2)
+            candidate[i], candidate[j] = candidate[j], candidate[i]
+        result = _decode(candidate, base, origin, t0s, dues)
+        tried += 1
+        if result[0] <= best[0]:
+            best, current = result, candidate
+
+    cost, lateness, last, placed, unplaced = best
+    placements = [Placement(request_id, eq_id, origin + timedelta(days=start), origin + timedelta(days=end),
+                            lowest_bits(mask, mask.bit_count()), days_late)
+                  for request_id, eq_id, start, end, mask, days_late in placed]
+    placements.sort(key=lambda p: (p.eq_id, p.start))
+    return Plan(
+        placements=placements,
+        unplaced=unplaced,
+        makespan=origin + timedelta(days=last) if last >= 0 else None,
+        lateness=lateness,
+        cost=cost,
+        greedy_cost=greedy_cost,
+        orders_tried=tried,
+        seconds=time.perf_counter() - started,
+    )
+
+
+def check_plan(plan, requests, machines):
+    """Return the capacity violations of a plan (empty when it is feasible)."""
+    by_id = {r.request_id: r for r in requests}
+    days = {}
+    for m in machines:
+        for start, end, level, mask in m.bookings:
+            for t in range((end - start).days + 1):
+                day = days.setdefault((m.eq_id, start + timedelta(days=t)), [0, 0])
+                day[0] += level
+                day[1] |= mask
+    problems = []
+    for p in plan.placements:
+        r = by_id[p.request_id]
+        if p.start < (r.earliest or p.start) or (p.end - p.start).days + 1 != r.duration:
+            problems.append(f"{p.request_id}: placed {p.start} to {p.end}")
+        mask = 0
+        for n in p.units:
+            mask |= 1 << (n - 1)
+        for t in range(r.duration):
+            day = days.setdefault((p.eq_id, p.start + timedelta(days=t)), [0, 0])
+            if day[1] & mask:
+                problems.append(f"{p.request_id}: units {p.units} double-booked on {p.eq_id}")
+            day[0] += r.load
+            day[1] |= mask
+            if day[0] > CAPACITY:
+                problems.append(f"{p.eq_id} at {day[0]}% on {p.start + timedelta(days=t)}")
+    return problems
+
+
+# Synthetic fleets for the benchmark: (type, units per machine)
+BENCH_TYPES = [('THERMAL_SHOCK', 0), ('TEMP_HUMIDITY', 0), ('VIBRATION', 3),
+               ('SALT_FOG', 0), ('PULSE_TESTER', 8), ('TEMP_OVENS', 0)]
+
+
+def synthetic_fleet(machines, requests, rng, today, booked=0.3):
+    """Random machines (with some existing bookings) and a batch of requests for them."""
+    fleet = []
+    for i in range(machines):
+        eq_type, capacity = BENCH_TYPES[i % len(BENCH_TYPES)]
+        m = Machine(f"{eq_type[:3]}{i:03d}", eq_type, capacity)
+        day = today
+        while rng.random() < booked * 2:
+            day += timedelta(days=rng.randint(0, 10))
+            end = day + timedelta(days=rng.randint(1, 14))
+            units = rng.sample(range(1, capacity + 1), rng.randint(1, capacity)) if capacity else []
+            m.bookings.append((day, end, rng.choice((25, 50, 100)), sum(1 << (n - 1) for n in units)))
+            day = end + timedelta(days=1)
+        fleet.append(m)
+    batch = []
+    for i in range(requests):
+        eq_type, capacity = BENCH_TYPES[rng.randrange(min(machines, len(BENCH_TYPES)))]
+        earliest = today + timedelta(days=rng.randint(0, 30))
+        duration = rng.randint(1, 21)
+        batch.append(Request(
+            request_id=f"R{i:04d}",
+            eq_type=eq_type,
+            duration=duration,
+            load=rng.choice((10, 25, 50, 75, 100)),
+            priority=rng.choice(list(PRIORITY_WEIGHTS)),
+            earliest=earliest,
+            due=earliest + timedelta(days=duration - 1 + rng.randint(0, 14)),
+            units=rng.randint(1, capacity) if capacity else 0,
+        ))
+    return fleet, batch
+
+
+def bench(options):
+    """Plan synthetic batches greedily and with the improvement pass, and check both."""
+    today = date.today()
+    print(f"{'fleet':<18} {'budget':>6} {'cost':>8} {'late':>7} {'span':>5} {'unpl':>5} {'orders':>7} {'ms':>9}")
+    for trial in range(options.trials):
+        rng = random.Random(options.seed + trial)
+        fleet, batch = synthetic_fleet(options.machines, options.requests, rng, today)
+        label = f"{options.machines}m x {options.requests}r #{trial}"
+        for budget in (0.0, options.budget):
+            result = plan_batch(batch, fleet, today, budget, seed=options.seed + trial)
+            problems = check_plan(result, batch, fleet)
+            if problems:
+                raise SystemExit(f"infeasible plan: {problems[:3]}")
+            span = (result.makespan - today).days + 1 if result.makespan else 0
+            print(f"{label:<18} {budget:>6.1f} {result.cost:>8} {result.lateness:>7} {span:>5} "
+                  f"{len(result.unplaced):>5} {result.orders_tried:>7} {result.seconds * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--machines", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds for the improvement pass")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+    bench(options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Local stand-in for the GitHub Contents API used by LTCMS.
+
+Serves GET/PUT/DELETE /repos/<owner>/<repo>/contents/<path> from memory with
+GitHub's blob shas, ETag/If-None-Match revalidation, sha conflict responses and
+rate-limit headers, so the persistence path can be exercised and benchmarked
+without network access or a real token. LTCMS only takes its GitHub paths
+when GITHUB_TOKEN is set, so give it a placeholder in .streamlit/secrets.toml
+(GITHUB_TOKEN = "local"); the server accepts any token:
+
+    python contents_api_server.py serve --port 8765 --seed ltcms_state.json
+    LTCMS_GITHUB_API_URL=http://127.0.0.1:8765 streamlit run LTCMS.py
+
+    python contents_api_server.py bench --requests 200
+
+Faults can be injected with --latency-ms, --error-rate and --rate-limit-every
+to see how the client's timeouts and retries behave.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+CONTENTS_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)/contents/?(.*)$")
+RATE_LIMIT = 5000
+
+
+def git_blob_sha(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class ContentsStore:
+    """In-memory files keyed by repository path."""
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.RLock()
+        self.remaining = RATE_LIMIT
+
+    def entry(self, path, data, with_content=True):
+        out = {
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "sha": git_blob_sha(data),
+            "size": len(data),
+            "type": "file",
+        }
+        if with_content:
+            out["encoding"] = "base64"
+            out["content"] = base64.b64encode(data).decode("ascii")
+        return out
+
+
+class ContentsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    store = None
+    options = None
+    request_count = 0
+
+    def log_message(self, format, *args):
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=None, headers=None):
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        with self.store.lock:
+            self.store.remaining = max(self.store.remaining - 1, 0)
+            remaining = self.store.remaining
+        self.send_header("X-RateLimit-Limit", str(RATE_LIMIT))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _route(self):
+        """Return the file path for a contents URL, or None after answering 404/5xx/403.
+
+        The request body is always consumed (into self.body) so an injected
+        error does not leave it on a keep-alive connection.
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = json.loads(self.rfile.read(length) or b"{}")
+        opts = self.options
+        if opts.latency_ms:
+            time.sleep(opts.latency_ms / 1000)
+        with self.store.lock:
+            ContentsHandler.request_count += 1
+            count = ContentsHandler.request_count
+        if opts.error_rate and random.random() < opts.error_rate:
+            self._send(502, {"message": "Server Error"})
+            return None
+        if opts.rate_limit_every and count % opts.rate_limit_every == 0:
+            self._send(403, {"message": "You have exceeded a secondary rate limit."}, {"Retry-After": "1"})
+            return None
+        match = CONTENTS_PATH.match(urlsplit(self.path).path)
+        if not match:
+            self._send(404, {"message": "Not Found"})
+            return None
+        return match.group(3).strip("/")
+
+    def do_GET(self):
+        path = self._route()
+        if path is None:
+            return
+        with self.store.lock:
+            data = self.store.files.get(path)
+            listing = [
+                self.store.entry(name, content, with_content=False)
+                for name, content in sorted(self.store.files.items())
+                if (name.rsplit("/", 1)[0] if "/" in name else "") == path
+            ]
+        if data is not None:
+            entry = self.store.entry(path, data)
+            etag = f'"{entry["sha"]}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, headers={"ETag": etag})
+            else:
+                self._send(200, entry, {"ETag": etag})
+        elif listing:
+            self._send(200, listing)
+        else:
+            self._send(404, {"message": "Not Found"})
+
+    def do_PUT(self):
+        path = self._route()
+        if path is None:
+            return
+        body = self.body
+        with self.store.lock:
+            current = self.store.files.get(path)
+            if current is not None and not body.get("sha"):
+                self._send(422, {"message": "Invalid request.\n\n\"sha\" wasn't supplied."})
+                return
+            if current is not None and body["sha"] != git_blob_sha(current):
+                self._send(409, {"message": f"{path} does not match {body['sha']}"})
+                return
+            data = base64.b64decode(body.get("content", ""))
+            self.store.files[path] = data
+            entry = self.store.entry(path, data, with_content=False)
+        self._send(201 if current is None else 200, {"content": entry, "commit": {"sha": uuid.uuid4().hex}})
+
+    def do_DELETE(self):
+        path = self._route()
+        if path is None:
+            return
+        body = self.body
+        with self.store.lock:
+            current = self.store.files.get(path)
+            if current is None:
+                self._send(404, {"message": "Not Found"})
+                return
+            if body.get("sha") != git_blob_sha(current):
+                self._send(409, {"message": f"{path} does not match {body.get('sha')}"})
+                return
+            del self.store.files[path]
+        self._send(200, {"content": None, "commit": {"sha": uuid.uuid4().hex}})
+
+
+def make_server(options, store=None):
+    store = store or ContentsStore()
+    handler = type("Handler", (ContentsHandler,), {"store": store, "options": options})
+    return ThreadingHTTPServer((options.host, options.port), handler)
+
+
+def seed(store, path, repo_path):
+    with open(path, "rb") as f:
+        store.files[repo_path] = f.read()
+
+
+def serve(options):
+    server = make_server(options)
+    if options.seed:
+        seed(server.RequestHandlerClass.store, options.seed, options.file_path)
+    print(f"Contents API stand-in on http://{options.host}:{server.server_port}")
+    server.serve_forever()
+
+
+def bench(options):
+    """Time state-file round trips with and without a keep-alive session."""
+    options.port = 0
+    server = make_server(options)
+    store = server.RequestHandlerClass.store
+    if options.seed:
+        seed(store, options.seed, options.file_path)
+    else:
+        store.files[options.file_path] = json.dumps({"equipment_data": {}, "schedules": {}}).encode("utf-8")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{options.host}:{server.server_port}/repos/{options.repo}/contents/{options.file_path}"
+
+    def timed(label, call):
+        started = time.perf_counter()
+        for _ in range(options.requests):
+            call()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<32} {elapsed / options.requests * 1000:8.2f} ms/op")
+
+    session = requests.Session()
+    timed("GET, new connection", lambda: requests.get(url, timeout=10))
+    timed("GET, keep-alive session", lambda: session.get(url, timeout=10))
+    etag = session.get(url, timeout=10).headers["ETag"]
+    timed("GET, If-None-Match (304)", lambda: session.get(url, headers={"If-None-Match": etag}, timeout=10))
+
+    def put():
+        sha = git_blob_sha(store.files[options.file_path])
+        data = store.files[options.file_path]
+        body = {"message": "bench", "content": base64.b64encode(data).decode("ascii"), "sha": sha}
+        session.put(url, data=json.dumps(body), timeout=10)
+
+    timed("PUT with known sha", put)
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", help="state file to serve as the initial content")
+    parser.add_argument("--repo", default="LukeyMe/LTCMS")
+    parser.add_argument("--file-path", default="ltcms_state.json")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every response")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 502")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 403 secondary rate limit")
+    parser.add_argument("--requests", type=int, default=100, help="requests per bench case")
+    parser.add_argument("--quiet", action="store_true")
+    options = parser.parse_args()
+    if options.command == "bench":
+        options.quiet = True
+        bench(options)
+    else:
+        serve(options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Run LTCMS.py under Streamlit's AppTest against a local Contents API server.
+
+The mirror starts out as the bundled ltcms_state.json. `lab.app()` returns an AppTest of the app with a hook appended: code put in
+`session_state['hook']` is run at the end of the script, with the app's
+globals, on the next `run()`.
+"""
+import json
+import os
+import sys
+import threading
+import types
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import contents_api_server  # noqa: E402
+
+STATE_FILE = "ltcms_state.json"
+HOOK = """
+if st.session_state.get('hook'):
+    exec(st.session_state.pop('hook'))
+"""
+
+
+def bundled_state():
+    with open(ROOT / STATE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Lab:
+    def __init__(self, tmp_path, store):
+        self.tmp_path = tmp_path
+        self.store = store
+        self.script = tmp_path / "ltcms_app.py"
+        self.script.write_text((ROOT / "LTCMS.py").read_text(encoding="utf-8") + HOOK, encoding="utf-8")
+
+    def app(self):
+        at = AppTest.from_file(str(self.script), default_timeout=120)
+        at.secrets["GITHUB_TOKEN"] = "test"
+        return at
+
+    def hook(self, at, code):
+        """Run `code` inside the app and return what it left in session_state.out."""
+        at.session_state["hook"] = code
+        at.run()
+        assert not at.exception, [e.value for e in at.exception]
+        return at.session_state["out"] if "out" in at.session_state else None
+
+    def remote(self):
+        return json.loads(self.store.files[STATE_FILE])
+
+    def set_remote(self, doc):
+        self.store.files[STATE_FILE] = json.dumps(doc, indent=2).encode("utf-8")
+
+
+@pytest.fixture
+def lab(tmp_path, monkeypatch):
+    options = types.SimpleNamespace(host="127.0.0.1", port=0, latency_ms=0, error_rate=0.0,
+                                    rate_limit_every=0, quiet=True)
+    server = contents_api_server.make_server(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("LTCMS_GITHUB_API_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("LTCMS_DB_PATH", str(tmp_path / "ltcms_state.db"))
+    monkeypatch.chdir(ROOT)
+    st.cache_resource.clear()
+    lab = Lab(tmp_path, server.RequestHandlerClass.store)
+    lab.set_remote(bundled_state())
+    yield lab
+    st.cache_resource.clear()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,36 @@
+"""Daily backups and their upload to the backups/ folder on GitHub."""
+import gzip
+from datetime import date, timedelta
+
+import contents_api_server
+
+BACKUP = """
+for thread in threading.enumerate():
+    if thread.name == 'ltcms-backup':
+        thread.join()
+service = BackupService(get_state_store())
+service._backup(date.today())
+st.session_state.out = (service.last_error, [t for t, _ in get_state_store().unuploaded_backups()])
+"""
+
+
+def test_failed_expiry_is_reported_and_retried(lab, monkeypatch):
+    # Old daily snapshots, more than the retention keeps
+    for k in range(30):
+        name = (date(2020, 1, 1) + timedelta(days=k)).strftime("backups/ltcms_state_%Y%m%d.json.gz")
+        lab.store.files[name] = gzip.compress(str(k).encode())
+    def refuse_delete(handler):
+        handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        handler._send(409, {"message": "conflict"})
+
+    monkeypatch.setattr(contents_api_server.ContentsHandler, "do_DELETE", refuse_delete)
+    at = lab.app()
+    at.run()
+    error, pending = lab.hook(at, BACKUP)
+    assert "Error expiring backup files" in error and "409" in error
+    assert pending == [date.today().isoformat()]
+
+    monkeypatch.undo()
+    error, pending = lab.hook(at, BACKUP)
+    assert error is None and pending == []
+    assert sum(1 for name in lab.store.files if name.startswith("backups/")) < 31
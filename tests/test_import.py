@@ -0,0 +1,48 @@
+"""Validating an imported test plan."""
+from datetime import date, timedelta
+
+START = date.today() + timedelta(days=400)
+END = START + timedelta(days=2)
+
+IMPORT = """
+class Upload(io.BytesIO):
+    name = 'plan.csv'
+try:
+    df = read_test_plan(Upload({csv!r}.encode()))
+except ValueError as e:
+    st.session_state.out = str(e)
+else:
+    valid, errors = validate_test_plan(df, st.session_state.equipment_data, st.session_state.schedule_index)
+    st.session_state.out = {{'valid': [(r.test_id, list(r.units)) for r in valid.itertuples()], 'errors': errors}}
+"""
+
+
+def run_import(lab, rows, header="Equipment ID,Test ID,User,Start Date,End Date,Load %"):
+    at = lab.app()
+    at.run()
+    csv = header + "\n" + "".join(row + "\n" for row in rows)
+    return lab.hook(at, IMPORT.format(csv=csv))
+
+
+def equipment_of_type(lab, eq_type):
+    return next(k for k, v in lab.remote()["equipment_data"].items() if v["type"] == eq_type)
+
+
+def test_only_the_row_that_overloads_a_day_is_rejected(lab):
+    out = run_import(lab, [f"ACS,T1,a,{START},{END},60", f"ACS,T2,b,{START},{END},60", f"ACS,T3,c,{START},{END},40"])
+    assert out["valid"] == [("T1", []), ("T3", [])]
+    assert list(out["errors"]) == [3]
+    assert "would be at 120%" in out["errors"][3][0]
+
+
+def test_channels_and_plates_columns_follow_the_equipment_type(lab):
+    pulse, vibration = equipment_of_type(lab, "PULSE_TESTER"), equipment_of_type(lab, "VIBRATION")
+    out = run_import(lab, [f"{pulse},T1,a,{START},{END},10,1-2,", f"{vibration},T2,b,{START},{END},10,,3"],
+                     header="Equipment ID,Test ID,User,Start Date,End Date,Load %,Channels,Plates")
+    assert out == {"valid": [("T1", [1, 2]), ("T2", [3])], "errors": {}}
+
+
+def test_columns_with_the_same_meaning_are_refused(lab):
+    out = run_import(lab, [f"ACS,T1,a,{START},{END},60,1-2,1"],
+                     header="Equipment ID,Test ID,User,Start Date,End Date,Load %,Channels/Plates,Channels Plates")
+    assert "mean the same thing" in out
@@ -0,0 +1,40 @@
+"""The per-session indexes kept current by save_app_state()."""
+import pytest
+
+RENAME = """
+old, new = 'ACS', 'NEWID'
+st.session_state.equipment_data[new] = st.session_state.equipment_data.pop(old)
+st.session_state.schedules[new] = st.session_state.schedules.pop(old)
+ids = [s.schedule_id for s in st.session_state.schedules[new]]
+booked = [s for s in st.session_state.schedules[new] if s.status in BOOKED_STATUSES]
+order = {order!r}
+st.session_state.aggregates.update(st.session_state.equipment_data, st.session_state.schedules, order)
+st.session_state.schedule_index.update(st.session_state.schedules, order)
+st.session_state.schedule_table.update(st.session_state.schedules, order)
+st.session_state.search_index.update(st.session_state.equipment_data, st.session_state.schedules, order)
+table = st.session_state.schedule_table
+first = min(s.start_date for s in booked)
+last = max(last_end(s) for s in booked)
+st.session_state.out = {{
+    'frame': sorted(table.frame().loc[table.frame()['Equipment'] == new].index),
+    'rows': sorted(i for i, (eq_id, _) in table.rows.items() if eq_id == new),
+    'booked': sorted(s.schedule_id for s in st.session_state.schedule_index.overlapping(new, first, last)),
+    'expected_booked': sorted(s.schedule_id for s in booked),
+    'search': sorted({{key[1] for _, key, _ in st.session_state.search_index.search(
+        st.session_state.schedules[new][0].test_id, limit=0) if key[0] == 'schedule'}} & set(ids)),
+    'ids': sorted(ids),
+    'equipment': sorted(st.session_state.aggregates.equipment),
+}}
+"""
+
+
+@pytest.mark.parametrize("order", [["NEWID", "ACS"], ["ACS", "NEWID"]])
+def test_rename_moves_schedules_in_every_index(lab, order):
+    at = lab.app()
+    at.run()
+    out = lab.hook(at, RENAME.format(order=order))
+    assert out["ids"]
+    assert out["frame"] == out["rows"] == out["ids"]
+    assert out["booked"] == out["expected_booked"]
+    assert out["search"]
+    assert "NEWID" in out["equipment"] and "ACS" not in out["equipment"]
@@ -0,0 +1,33 @@
+"""Recurring schedules leaving the live state once their series has run."""
+
+SERIES = """
+today = date.today()
+def series(sid, start, **rule):
+    return Schedule(schedule_id=sid, test_id=sid, user='Tester', start_date=start,
+                    end_date=start + timedelta(days=1), load_percentage=10,
+                    recurrence=Recurrence('week', **rule))
+st.session_state.schedules['ACS'] += [
+    series('until-elapsed', today - timedelta(days=60), until=today - timedelta(days=20)),
+    series('count-elapsed', today - timedelta(days=60), count=3),
+    series('still-running', today - timedelta(days=60), count=20),
+]
+save_app_state()
+cleanup_completed_tests()
+archived = {line['schedule_id']: line['status'] for month in get_state_store().archive_months()
+            for line in get_state_store().archive_partition(month)}
+st.session_state.out = {
+    'live': [s.schedule_id for s in st.session_state.schedules['ACS']],
+    'stored': [s['schedule_id'] for s in get_state_store().load_doc()['schedules']['ACS']],
+    'archived': {sid: archived.get(sid) for sid in ('until-elapsed', 'count-elapsed', 'still-running')},
+}
+"""
+
+
+def test_elapsed_series_are_archived(lab):
+    at = lab.app()
+    at.run()
+    out = lab.hook(at, SERIES)
+    assert out["archived"] == {"until-elapsed": "Completed", "count-elapsed": "Completed", "still-running": None}
+    for ids in (out["live"], out["stored"]):
+        assert "still-running" in ids
+        assert "until-elapsed" not in ids and "count-elapsed" not in ids
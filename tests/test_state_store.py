@@ -0,0 +1,55 @@
+"""The row-per-record SQLite store behind load_app_state() and save_app_state()."""
+import sqlite3
+
+REMOVE_FIRST = """
+store = SQLiteStateStore({path!r})
+doc = normalize_doc(json.loads(open('ltcms_state.json', encoding='utf-8').read()))
+eq_id = next(k for k, items in doc['schedules'].items() if len(items) >= 3)
+digests, _ = store.apply(state_rows(doc), {{}})
+items = doc['schedules'][eq_id]
+removed = items.pop(0)['schedule_id']
+items.append(items.pop(0))
+new_digests, changed = store.apply(state_rows(doc), digests)
+st.session_state.out = {{
+    'eq_id': eq_id,
+    'removed': removed,
+    'rewritten': sorted(k for k, d in new_digests.items() if digests.get(k) != d),
+    'deleted': sorted(k for k in digests if k not in new_digests),
+    'stored': [s['schedule_id'] for s in store.load_doc()['schedules'][eq_id]],
+    'expected': [s['schedule_id'] for s in items],
+}}
+"""
+
+LOAD = """
+st.session_state.out = SQLiteStateStore({path!r}).load_doc()['schedules']
+"""
+
+
+def test_removing_a_schedule_rewrites_only_it_and_the_order(lab):
+    at = lab.app()
+    at.run()
+    out = lab.hook(at, REMOVE_FIRST.format(path=str(lab.tmp_path / "store.db")))
+    assert out["deleted"] == [("schedule", out["removed"])]
+    assert out["rewritten"] == [("schedule_order", out["eq_id"])]
+    assert out["stored"] == out["expected"]
+
+
+def test_store_moves_old_schedule_positions_to_order_rows(lab):
+    path = lab.tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE schedules (schedule_id TEXT PRIMARY KEY, eq_id TEXT NOT NULL, position INTEGER NOT NULL,
+                                status TEXT, start_date TEXT, end_date TEXT, payload TEXT NOT NULL);
+        CREATE INDEX idx_schedules_eq ON schedules (eq_id, position);
+        INSERT INTO schedules VALUES ('b', 'EQ', 1, NULL, NULL, NULL, '{"schedule_id": "b"}');
+        INSERT INTO schedules VALUES ('a', 'EQ', 0, NULL, NULL, NULL, '{"schedule_id": "a"}');
+        INSERT INTO schedules VALUES ('c', 'EQ', 2, NULL, NULL, NULL, '{"schedule_id": "c"}');
+    """)
+    conn.close()
+    at = lab.app()
+    at.run()
+    out = lab.hook(at, LOAD.format(path=str(path)))
+    assert [s["schedule_id"] for s in out["EQ"]] == ["a", "b", "c"]
+    conn = sqlite3.connect(path)
+    assert "position" not in [row[1] for row in conn.execute("PRAGMA table_info(schedules)")]
+    conn.close()
@@ -0,0 +1,39 @@
+"""Importing the GitHub mirror of the state file into the local store."""
+from conftest import bundled_state
+
+
+def without_schedule_ids(doc):
+    for items in doc["schedules"].values():
+        for s in items:
+            s.pop("schedule_id", None)
+    return doc
+
+
+def schedule_users(schedules):
+    return sorted((eq_id, s.test_id, s.user) for eq_id, items in schedules.items() for s in items)
+
+
+def test_sync_imports_schedules_without_ids(lab):
+    doc = without_schedule_ids(bundled_state())
+    lab.set_remote(doc)
+    at = lab.app()
+    at.run()
+    assert not at.exception, [e.value for e in at.exception]
+    expected = sorted((eq_id, str(s["test_id"]), s["user"]) for eq_id, items in doc["schedules"].items() for s in items)
+    assert schedule_users(at.session_state.schedules) == expected
+    assert all(s.schedule_id for items in at.session_state.schedules.values() for s in items)
+
+    # A later change to the same id-less file merges record by record
+    lab.hook(at, "while get_mirror_writer().pending:\n    time.sleep(0.1)\n")
+    eq_id = next(k for k, items in doc["schedules"].items() if items)
+    changed = doc["schedules"][eq_id][0]
+    changed["user"] = "Changed Elsewhere"
+    lab.set_remote(doc)
+    out = lab.hook(at, (
+        "cache = get_state_cache()\n"
+        "cache.checked_at = 0.0\n"
+        "sync_from_github(get_state_store(), cache)\n"
+        "st.session_state.out = get_state_store().load_doc()['schedules']\n"
+    ))
+    assert [s["user"] for s in out[eq_id] if s["test_id"] == changed["test_id"]] == ["Changed Elsewhere"]
+    assert len({s["schedule_id"] for items in out.values() for s in items}) == sum(map(len, out.values()))